@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Micro-benchmarks for the pandas transforms in core/functions.py
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+The Fisherman 2014 intermediates in sample_scratch are loaded and replicated
+x1, x10, and x100 by offsetting sort_ID. Each function is timed on a fresh copy
+of its input (copying is not timed) after warm-up runs, and peak memory of one
+call is measured with tracemalloc. Results are saved as JSON so that runs can be
+compared across commits with --compare.
+
+Usage (from the repository root):
+    python benchmarks/bench_transforms.py --out bench_new.json
+    python benchmarks/bench_transforms.py --scales 1 10 --compare bench_old.json
+'''
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+import pandas as pd
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+import core.functions as fun
+from core.configmap import tID_fld, pID_fld, fill, sitemap
+
+MHW = sitemap['Fisherman']['MHW']
+
+"""
+# Fixtures
+"""
+def load_fixtures(scratch_dir=os.path.join(repo_dir, 'sample_scratch')):
+    """Load the sample_scratch dataframes used by the benchmarks."""
+    return({'pts': pd.read_pickle(os.path.join(scratch_dir, 'pts_df_elev_slope.pkl')),
+            'trans': pd.read_pickle(os.path.join(scratch_dir, 'Fisherman2014_extTrans_null_prePts.pkl')),
+            'beach': pd.read_pickle(os.path.join(scratch_dir, 'trans_df_beachmetrics.pkl')),
+            'sl2trans': pd.read_pickle(os.path.join(scratch_dir, 'sl2trans.pkl'))})
+
+def replicate(df, n, offset):
+    """Stack n copies of df, adding k*offset to sort_ID (column and index) of copy k."""
+    if n == 1:
+        return(df.copy())
+    copies = []
+    for k in range(n):
+        c = df.copy()
+        if tID_fld in c.columns:
+            c[tID_fld] = c[tID_fld] + k * offset
+        if c.index.name == tID_fld:
+            c.index = c.index + k * offset
+        copies.append(c)
+    out = pd.concat(copies)
+    if not out.index.name == tID_fld:
+        out.reset_index(drop=True, inplace=True)
+    return(out)
+
+def scaled_fixtures(fixtures, n):
+    """Fixtures replicated n times with distinct sort_IDs."""
+    offset = int(max(fixtures['trans'].index.max(), fixtures['pts'][tID_fld].max())) + 1
+    return({k: replicate(df, n, offset) for k, df in fixtures.items()})
+
+"""
+# Cases
+"""
+def _joined(f):
+    return(fun.join_columns(f['pts'].copy(), f['trans'], tID_fld))
+
+def _sorted(f):
+    return(fun.sort_pts(_joined(f), tID_fld, pID_fld))
+
+def _trans_dist(f):
+    return(fun.calc_trans_distances(_sorted(f)))
+
+def _prepped(f):
+    return(fun.prep_points(_joined(f), tID_fld, pID_fld, MHW, fill))
+
+# name: (setup(fixtures) -> args for one call, function)
+CASES = {
+    'join_columns': (lambda f: (f['pts'].copy(), f['trans'].copy(), tID_fld), fun.join_columns),
+    'join_columns_id_check': (lambda f: (f['beach'].copy(), f['sl2trans'].copy(), tID_fld), fun.join_columns_id_check),
+    'sort_pts': (lambda f: (_joined(f), tID_fld, pID_fld), fun.sort_pts),
+    'calc_trans_distances': (lambda f: (_sorted(f),), fun.calc_trans_distances),
+    'calc_pt_distances': (lambda f: (_trans_dist(f),), fun.calc_pt_distances),
+    'prep_points': (lambda f: (_joined(f), tID_fld, pID_fld, MHW, fill), fun.prep_points),
+    'aggregate_z': (lambda f: (_prepped(f), MHW, tID_fld, 'ptZ', fill), fun.aggregate_z),
+    }
+
+"""
+# Timing
+"""
+def time_case(setup, func, fixtures, repeat=5, warmup=1):
+    """Time func on fresh inputs from setup. Returns seconds of each repeat, peak bytes allocated
+    during one call, and the number of rows in the first input."""
+    times = []
+    for i in range(warmup + repeat):
+        args = setup(fixtures)
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+    # Peak memory in a separate call (tracemalloc slows the function down)
+    args = setup(fixtures)
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return(times, peak, len(args[0]))
+
+def run_benchmarks(scales=(1, 10, 100), cases=None, repeat=5, warmup=1, verbose=True):
+    """Run the benchmark cases at each scale. Returns a list of result dictionaries."""
+    fixtures = load_fixtures()
+    results = []
+    for n in scales:
+        scaled = scaled_fixtures(fixtures, n)
+        for name in (cases or CASES):
+            setup, func = CASES[name]
+            res = {'name': name, 'scale': n}
+            try:
+                times, peak, rows = time_case(setup, func, scaled, repeat, warmup)
+                res.update({'rows': rows, 'times': times, 'min': min(times),
+                            'median': float(np.median(times)), 'peak_bytes': peak})
+                if verbose:
+                    print('{:<24} x{:<4} {:>9} rows  min {:8.4f} s  median {:8.4f} s  peak {:8.1f} MB'.format(
+                          name, n, rows, res['min'], res['median'], peak/1e6))
+            except Exception as err:
+                res['error'] = '{}: {}'.format(type(err).__name__, err)
+                if verbose:
+                    print('{:<24} x{:<4} ERROR {}'.format(name, n, res['error']))
+            results.append(res)
+    return(results)
+
+def run_info():
+    """Commit and environment of the run."""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        commit = None
+    return({'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(),
+            'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__})
+
+def compare(results, baseline, threshold=1.2):
+    """Print the ratio of median times to a baseline run; flag ratios above threshold."""
+    base = {(r['name'], r['scale']): r for r in baseline['results'] if 'median' in r}
+    print('\nCompared with {} ({}):'.format(baseline['info'].get('commit'), baseline['info'].get('time')))
+    slower = []
+    for r in results:
+        b = base.get((r['name'], r['scale']))
+        if b is None or not 'median' in r:
+            continue
+        ratio = r['median'] / b['median']
+        flag = '  SLOWER' if ratio > threshold else ''
+        print('{:<24} x{:<4} {:6.2f}x{}'.format(r['name'], r['scale'], ratio, flag))
+        if flag:
+            slower.append(r)
+    return(slower)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('Usage')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--out', default='bench_transforms.json', help='output JSON')
+    parser.add_argument('--compare', help='JSON from an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2, help='ratio of median times flagged as slower')
+    args = parser.parse_args(argv)
+    results = run_benchmarks(args.scales, args.cases, args.repeat, args.warmup)
+    with open(args.out, 'w') as f:
+        json.dump({'info': run_info(), 'results': results}, f, indent=1)
+    print('OUTPUT: {}'.format(args.out))
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.threshold)
+        return(int(len(slower) > 0))
+    return(0)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Batch extraction of several site/year pairs with core.pipeline.
+Jobs run in a process pool, largest site (most transects) first, each with its
+own scratch workspace. A run manifest with the timings and failures of every
+job is saved as JSON.
+
+Usage:
+    python -m core.batch path\to\projects Fisherman:2014 Assateague:2014 --workers 4
+    python -m core.batch path\to\projects --all 2014
+    python -m core.batch path\to\projects --all 2014 --run_id batch_20180101_120000 --from join
+
+Project directories are found as <root>\<site><year> (see --proj_dir).
+Each run keeps its stage outputs in <proj_dir>\scratch\<run_id>; give the
+run_id of an earlier run to resume it (e.g. with --from).
+'''
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from core.configmap import sitemap
+import core.store as store
+import core.pipeline as pipeline
+
+def transect_count(cfg):
+    """Expected size of a job: number of extended transects (0 if unknown).
+    Uses a saved 'trans' stage if there is one, otherwise counts the FC with arcpy."""
+    for scratch in [cfg['scratch_dir'], os.path.join(cfg['proj_dir'], 'scratch')]:
+        if os.path.exists(os.path.join(scratch, 'trans', store.SCHEMA)):
+            return(store.read_schema(os.path.join(scratch, 'trans'))['nrows'])
+    try:
+        import arcpy
+        if arcpy.Exists(cfg['extendedTrans']):
+            return(int(arcpy.GetCount_management(cfg['extendedTrans']).getOutput(0)))
+    except ImportError:
+        pass
+    return(0)
+
+def job_configs(jobs, root, proj_dir='{root}/{site}{year}', run_id=None, overrides=None):
+    """Create site_config() for each (site, year) in jobs. Each job gets an isolated
+    scratch directory and arcpy scratch workspace under <proj_dir>/scratch/<run_id>."""
+    run_id = run_id or time.strftime('batch_%Y%m%d_%H%M%S')
+    cfgs = []
+    for site, year in jobs:
+        pdir = os.path.normpath(proj_dir.format(root=root, site=site, year=year))
+        cfg = pipeline.site_config(site, year, pdir, overrides)
+        cfg['scratch_dir'] = os.path.join(pdir, 'scratch', run_id)
+        cfg['scratch_workspace'] = cfg['scratch_dir']
+        cfgs.append(cfg)
+    return(cfgs)
+
+def run_job(cfg, start=None, until=None, stage_workers=1):
+    """Run the pipeline for one job and return its manifest entry. Runs in a worker process."""
+    entry = {'site': cfg['site'], 'year': cfg['year'], 'proj_dir': cfg['proj_dir'],
+             'scratch_dir': cfg['scratch_dir'], 'pid': os.getpid(), 'start': time.time()}
+    try:
+        if not os.path.exists(cfg['scratch_dir']):
+            os.makedirs(cfg['scratch_dir'])
+        summary = pipeline.run_pipeline(cfg, start, until, stage_workers, verbose=False)
+        entry['stages'] = json.loads(summary.to_json(orient='index'))
+        failed = summary.index[summary['status'] != 'done'].tolist()
+        entry['status'] = 'done' if not failed else 'failed'
+        if failed:
+            entry['error'] = 'stages not done: {}'.format(', '.join(failed))
+    except Exception as err:
+        entry['status'] = 'failed'
+        entry['error'] = '{}: {}'.format(type(err).__name__, err)
+        entry['traceback'] = traceback.format_exc()
+    entry['seconds'] = time.time() - entry['start']
+    return(entry)
+
+def run_batch(cfgs, manifest, workers=None, start=None, until=None, stage_workers=1, verbose=True):
+    """Run jobs (site configs) in a process pool, largest first, and save the run manifest to manifest (JSON).
+    Returns the manifest dictionary."""
+    start_time = time.time()
+    sizes = [transect_count(cfg) for cfg in cfgs]
+    order = sorted(range(len(cfgs)), key=lambda i: -sizes[i])
+    run = {'host': socket.gethostname(), 'start': start_time, 'workers': workers,
+           'from': start, 'until': until, 'jobs': []}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for i in order:
+            if verbose:
+                print("Queued {}{} ({} transects)".format(cfgs[i]['site'], cfgs[i]['year'], sizes[i]))
+            futures[pool.submit(run_job, cfgs[i], start, until, stage_workers)] = i
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                entry = future.result()
+            except Exception as err:
+                # e.g. worker process died
+                entry = {'site': cfgs[i]['site'], 'year': cfgs[i]['year'], 'status': 'failed',
+                         'error': '{}: {}'.format(type(err).__name__, err)}
+            entry['transects'] = sizes[i]
+            run['jobs'].append(entry)
+            if verbose:
+                print("{} {}{} in {:.1f} seconds{}".format(entry['status'].upper(), entry['site'], entry['year'],
+                      entry.get('seconds', float('nan')), ' - ' + entry['error'] if 'error' in entry else ''))
+            # Save after each job so an interrupted run keeps its record
+            run['seconds'] = time.time() - start_time
+            with open(manifest, 'w') as f:
+                json.dump(run, f, indent=1)
+    if verbose:
+        nfail = sum(j['status'] != 'done' for j in run['jobs'])
+        print("\n{} jobs ({} failed) in {:.1f} seconds. Manifest: {}".format(len(run['jobs']), nfail, run['seconds'], manifest))
+        if cfgs and cfgs[0].get('trace'):
+            print("Trace: {} (summarize with python -m core.tracing)".format(cfgs[0]['trace']))
+    return(run)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m core.batch', description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='directory that contains the project directories')
+    parser.add_argument('jobs', nargs='*', help='site:year pairs, e.g. Fisherman:2014')
+    parser.add_argument('--all', dest='all_year', help='run every site in configmap.sitemap for this year')
+    parser.add_argument('--proj_dir', default='{root}/{site}{year}', help='project directory pattern (default: {root}/{site}{year})')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of jobs to run at once')
+    parser.add_argument('--stage_workers', type=int, default=1, help='number of stages to run at once within a job')
+    parser.add_argument('--run_id', help='reuse the scratch directories of this earlier run (to resume it)')
+    parser.add_argument('--from', dest='start', choices=list(pipeline.STAGES), help='first stage to run (requires --run_id)')
+    parser.add_argument('--until', choices=list(pipeline.STAGES))
+    parser.add_argument('--cache', dest='cache_dir', help='stage cache directory shared by all jobs')
+    parser.add_argument('--trace', help='JSON-lines trace file for all jobs (default: <root>/<run_id>_trace.jsonl)')
+    parser.add_argument('--manifest', help='output JSON (default: <root>/<run_id>_manifest.json)')
+    args = parser.parse_args(argv)
+    jobs = [tuple(j.split(':')) for j in args.jobs]
+    if args.all_year:
+        jobs += [(site, args.all_year) for site in sitemap]
+    if not jobs:
+        parser.error('give site:year pairs or --all YEAR')
+    for site, year in jobs:
+        if not site in sitemap:
+            parser.error("'{}' is not in configmap.sitemap".format(site))
+    if args.start and not args.run_id:
+        parser.error('--from needs the --run_id of the run to resume (a new run has no stage outputs)')
+    stamp = time.strftime('batch_%Y%m%d_%H%M%S')
+    run_id = args.run_id or stamp
+    if args.run_id and not any(os.path.isdir(c['scratch_dir']) for c in job_configs(jobs, args.root, args.proj_dir, run_id)):
+        parser.error("no scratch directories of run '{}' were found".format(run_id))
+    # a resumed run gets its own manifest so the record of the first attempt is kept
+    name = run_id if not args.run_id else '{}_resume_{}'.format(run_id, stamp[len('batch_'):])
+    overrides = {'trace': os.path.abspath(args.trace or os.path.join(args.root, run_id + '_trace.jsonl'))}
+    if args.cache_dir:
+        overrides['cache_dir'] = args.cache_dir
+    cfgs = job_configs(jobs, args.root, args.proj_dir, run_id, overrides)
+    manifest = args.manifest or os.path.join(args.root, name + '_manifest.json')
+    run = run_batch(cfgs, manifest, args.workers, args.start, args.until, args.stage_workers)
+    return(int(any(j['status'] != 'done' for j in run['jobs'])))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Content-addressed cache for the extraction stages.
+A stage result is saved under a key that hashes the code of the stage function
+(its module and the core modules that module imports), its input datasets,
+and the parameters the stage depends on (STAGE_PARAMS), so
+a rerun with the same inputs returns the saved result and a changed
+parameter recomputes only the stages that use it. These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+'''
+import os
+import sys
+import json
+import types
+import time
+import shutil
+import pickle
+import hashlib
+import pandas as pd
+import numpy as np
+import core.store as store
+
+# Parameters (keyword arguments) that each stage depends on.
+# Keyword arguments not listed for a stage do not affect its key.
+STAGE_PARAMS = {
+    'shoreline': ['tID_fld', 'proximity'],
+    'dunes': ['tID_fld', 'proximity', 'fill'],
+    'armor': ['tID_fld', 'proj_code', 'fill'],
+    'beachwidth': ['tID_fld', 'maxDH', 'MHW', 'fill', 'skip_missing_z'],
+    'dist2inlet': ['tID_fld'],
+    'widths': ['tID_fld'],
+    'points': ['tID_fld', 'step'],
+    }
+
+META = 'meta.json'
+
+"""
+# Fingerprints
+"""
+def _hash_file(path, blocksize=1<<20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            h.update(block)
+    return(h.hexdigest())
+
+def _hash_dir(path):
+    # Directory contents by name, size, and modification time (e.g. a file geodatabase)
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for fname in sorted(files):
+            fpath = os.path.join(root, fname)
+            st = os.stat(fpath)
+            h.update('{}|{}|{}'.format(os.path.relpath(fpath, path), st.st_size, st.st_mtime_ns).encode())
+    return(h.hexdigest())
+
+def _gdb_of(path):
+    # Geodatabase that contains path, if any (feature classes are not files)
+    while path and not os.path.exists(path):
+        path = os.path.dirname(path)
+    return(path if path and path.lower().endswith('.gdb') else None)
+
+def fingerprint(obj, fingerprinter=None):
+    """Return a hex digest that changes when the content of obj changes.
+    Dataframes and arrays are hashed by value; a path to a file is hashed by content
+    and a directory by the size and modification time of its files. A dataset in a
+    geodatabase (not a file) is hashed by fingerprinter(path), e.g.
+    functions_warcpy.FCFingerprint; ValueError if there is no digest for it."""
+    h = hashlib.sha256()
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+        h.update(repr([str(c) for c in frame.columns]).encode())
+        h.update(repr([str(d) for d in frame.dtypes]).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update('{}{}'.format(obj.dtype.str, obj.shape).encode())
+        if obj.dtype == object:
+            h.update(pickle.dumps(obj.tolist()))
+        else:
+            h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, str) and (os.path.exists(obj) or _gdb_of(obj)):
+        digest = fingerprinter(obj) if fingerprinter is not None else None
+        if digest is None:
+            if os.path.isfile(obj):
+                digest = _hash_file(obj)
+            elif os.path.isdir(obj):
+                digest = _hash_dir(obj)
+            else:
+                raise ValueError("No fingerprint for {} in {}: pass a fingerprinter that "
+                                 "hashes the dataset (e.g. FCFingerprint).".format(os.path.basename(obj), _gdb_of(obj)))
+        h.update('{}|{}'.format(obj, digest).encode())
+    elif isinstance(obj, (list, tuple)):
+        # also covers namedtuples such as functions_geom.Lines
+        h.update(type(obj).__name__.encode())
+        for item in obj:
+            h.update(fingerprint(item, fingerprinter).encode())
+    elif isinstance(obj, dict):
+        for k in sorted(obj, key=str):
+            h.update(str(k).encode())
+            h.update(fingerprint(obj[k], fingerprinter).encode())
+    else:
+        h.update(repr(obj).encode())
+    return(h.hexdigest())
+
+_module_digests = {}
+
+def _code_digest(func):
+    # Hash of the source of the module that defines func and of the core modules it imports,
+    # so that editing the stage function or an engine it calls changes the key
+    mod = sys.modules.get(func.__module__)
+    if mod is None or not getattr(mod, '__file__', None):
+        return(hashlib.sha256(func.__code__.co_code).hexdigest())
+    mods = [mod] + sorted((m for m in vars(mod).values() if isinstance(m, types.ModuleType)
+                           and m.__name__.startswith('core.') and getattr(m, '__file__', None)),
+                          key=lambda m: m.__name__)
+    h = hashlib.sha256()
+    for m in mods:
+        if not m.__file__ in _module_digests:
+            _module_digests[m.__file__] = _hash_file(m.__file__)
+        h.update('{}|{}'.format(m.__name__, _module_digests[m.__file__]).encode())
+    return(h.hexdigest())
+
+"""
+# Cache
+"""
+class StageCache(object):
+    """Cache of stage results in cache_dir, limited to max_bytes.
+    When the cache is over budget, the least recently used results are deleted."""
+    def __init__(self, cache_dir, max_bytes=2e9, fingerprinter=None, verbose=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if fingerprinter is None:
+            # Hash geodatabase datasets one at a time if arcpy is available
+            try:
+                from core.functions_warcpy import FCFingerprint as fingerprinter
+            except ImportError:
+                pass
+        self.fingerprinter = fingerprinter
+        self.verbose = verbose
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, stage, func, args=(), kwargs=None):
+        """Key for func(*args, **kwargs) run as stage. The code of func is hashed with
+        _code_digest(); all positional arguments are hashed; keyword arguments only if
+        listed in STAGE_PARAMS[stage]."""
+        kwargs = kwargs or {}
+        params = STAGE_PARAMS.get(stage)
+        if params is not None:
+            kwargs = {k: v for k, v in kwargs.items() if k in params}
+        h = hashlib.sha256()
+        h.update('{}|{}.{}|{}'.format(stage, func.__module__, func.__qualname__, _code_digest(func)).encode())
+        h.update(fingerprint(list(args), self.fingerprinter).encode())
+        h.update(fingerprint(kwargs, self.fingerprinter).encode())
+        return(h.hexdigest())
+
+    def _path(self, key):
+        return(os.path.join(self.cache_dir, key))
+
+    def get(self, key):
+        """Return cached result for key or None. A hit marks the result as recently used."""
+        path = self._path(key)
+        if not os.path.exists(os.path.join(path, META)):
+            return(None)
+        with open(os.path.join(path, META)) as f:
+            meta = json.load(f)
+        if meta['kind'] == 'store':
+            result = store.StoreToDF(os.path.join(path, 'result'), mmap=False)
+        else:
+            with open(os.path.join(path, 'result.pkl'), 'rb') as f:
+                result = pickle.load(f)
+        os.utime(os.path.join(path, META))
+        return(result)
+
+    def put(self, key, result, stage=''):
+        """Save result under key, then evict old results if over budget."""
+        path = self._path(key)
+        tmp = path + '.tmp{}'.format(os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        if isinstance(result, pd.DataFrame):
+            store.DFtoStore(result, os.path.join(tmp, 'result'), verbose=False)
+            kind = 'store'
+        else:
+            with open(os.path.join(tmp, 'result.pkl'), 'wb') as f:
+                pickle.dump(result, f)
+            kind = 'pickle'
+        with open(os.path.join(tmp, META), 'w') as f:
+            json.dump({'stage': stage, 'kind': kind, 'created': time.time()}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp, path)
+        self.evict(keep=key)
+        return(path)
+
+    def entries(self):
+        """List cached results as (key, bytes, last used) from least to most recently used."""
+        out = []
+        for key in os.listdir(self.cache_dir):
+            meta = os.path.join(self._path(key), META)
+            if '.tmp' in key or not os.path.exists(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, f))
+                       for root, dirs, files in os.walk(self._path(key)) for f in files)
+            out.append((key, size, os.path.getmtime(meta)))
+        return(sorted(out, key=lambda e: e[2]))
+
+    def evict(self, keep=None):
+        """Delete least recently used results until the cache is within max_bytes."""
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for key, size, used in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+            if self.verbose:
+                print("Cache: evicted {} ({:.1f} MB)".format(key[:12], size/1e6))
+        return(total)
+
+    def clear(self):
+        """Delete all cached results."""
+        for key, size, used in self.entries():
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def run(self, stage, func, *args, **kwargs):
+        """Return func(*args, **kwargs) from the cache, or run it and cache the result."""
+        key = self.key(stage, func, args, kwargs)
+        start = time.time()
+        result = self.get(key)
+        if result is not None:
+            if self.verbose:
+                print("Cache: {} loaded from cache ({:.1f} s)".format(stage, time.time() - start))
+            return(result)
+        result = func(*args, **kwargs)
+        self.put(key, result, stage)
+        if self.verbose:
+            print("Cache: {} computed and cached ({:.1f} s)".format(stage, time.time() - start))
+        return(result)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Missing values with one scan per column.
+Columns wraps a dataframe: values equal to the fill value (-99999) are read as
+NaN once, and the missing values of each column are recorded as a validity bitmap.
+Transforms work on the NaN frame; the fill value is written back only at the
+export boundary (feature classes and CSV) with to_fill() or fill_missing().
+These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+
+Example:
+    cols = Columns(df, fill)
+    df = cols.frame                  # NaN for missing values
+    df['ptZmhw'] = df.ptZ - MHW
+    cols.update(df)                  # scans only the new column
+    df = cols.restore()              # fill again if the input used fill
+'''
+import numpy as np
+import pandas as pd
+
+def _isfill(values, fill):
+    """Boolean array: True where values equal fill."""
+    values = np.asarray(values)
+    if fill is None or values.dtype.kind == 'b':
+        return(np.zeros(len(values), bool))
+    if values.dtype.kind in 'iuf':
+        return(values == fill)
+    with np.errstate(invalid='ignore'):
+        isfill = np.asarray(values == fill, dtype=bool)
+    return(isfill & ~pd.isnull(values))
+
+def _isnull(values):
+    """Boolean array: True where values are null."""
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        return(np.isnan(values))
+    if values.dtype.kind in 'iub':
+        return(np.zeros(len(values), bool))
+    return(pd.isnull(values))
+
+class Columns(object):
+    """Dataframe with a validity bitmap per column. The input is not modified.
+    frame: the dataframe with NaN where the input had fill or null
+    fill_cols: columns where the input had fill values
+    The bitmaps (packed bits, 1 = valid) of columns without fill values are made
+    when first needed, so that a frame without fills is scanned only for fills."""
+    def __init__(self, df, fill=-99999):
+        self.fill = fill
+        self.frame = df.copy(deep=False)
+        self._bitmaps = {}
+        self._unscanned = set()
+        self.fill_cols = set()
+        self._fill_null_cols = set()
+        self._scanned = {}
+        self._index = df.index
+        self._scan(df.columns)
+
+    def _scan(self, columns):
+        # Find fill values in each column and replace them with NaN
+        for col in columns:
+            values = self.frame[col].values
+            isfill = _isfill(values, self.fill)
+            self._bitmaps.pop(col, None)
+            self.fill_cols.discard(col)
+            self._fill_null_cols.discard(col)
+            if isfill.any():
+                self.fill_cols.add(col)
+                self._unscanned.discard(col)
+                isnull = _isnull(values)
+                if isnull.any():
+                    self._fill_null_cols.add(col)
+                self._bitmaps[col] = np.packbits(~(isfill | isnull))
+                if np.asarray(values).dtype.kind in 'iuf':
+                    self.frame[col] = np.where(isfill, np.nan, values)
+                else:
+                    self.frame[col] = self.frame[col].mask(isfill)
+            else:
+                self._unscanned.add(col)
+            self._scanned[col] = np.asarray(self.frame[col].values)
+
+    @property
+    def bitmaps(self):
+        """Packed bits (1 = valid) of each column with missing values."""
+        for col in self._unscanned:
+            isnull = _isnull(self.frame[col].values)
+            if isnull.any():
+                self._bitmaps[col] = np.packbits(~isnull)
+        self._unscanned = set()
+        return(self._bitmaps)
+
+    @property
+    def null_cols(self):
+        """Columns with missing values that were null (not fill) in the input."""
+        return((set(self.bitmaps) - self.fill_cols) | self._fill_null_cols)
+
+    def update(self, df, columns=None):
+        """Use df as the frame (e.g. after adding columns) and scan only the columns that are
+        new or were recomputed (or those listed in columns). All are rescanned if the rows changed."""
+        # Compare with the columns as scanned: df may be self.frame with columns added in place
+        self.frame = df.copy(deep=False)
+        if not df.index.equals(self._index):
+            self._bitmaps, self._unscanned, self.fill_cols, self._fill_null_cols = {}, set(), set(), set()
+            self._scanned = {}
+            columns = df.columns
+        self._index = df.index
+        for col in [c for c in self._bitmaps if not c in df.columns]:
+            del self._bitmaps[col]
+        for col in [c for c in self._scanned if not c in df.columns]:
+            del self._scanned[col]
+        self._unscanned &= set(df.columns)
+        self.fill_cols &= set(df.columns)
+        self._fill_null_cols &= set(df.columns)
+        if columns is None:
+            # new columns and columns that no longer share memory with the scanned values
+            columns = [c for c in df.columns if not c in self._scanned or
+                       not np.may_share_memory(np.asarray(df[c].values), self._scanned[c])]
+        self._scan(columns)
+        return(self)
+
+    def valid(self, col):
+        """Boolean array: True where col has a value."""
+        if not col in self.bitmaps:
+            return(np.ones(len(self.frame), bool))
+        return(np.unpackbits(self.bitmaps[col], count=len(self.frame)).astype(bool))
+
+    def missing_count(self, col):
+        if not col in self.bitmaps:
+            return(0)
+        return(len(self.frame) - int(np.unpackbits(self.bitmaps[col], count=len(self.frame)).sum()))
+
+    def has_missing(self, col=None):
+        return(bool(self.bitmaps) if col is None else col in self.bitmaps)
+
+    def to_fill(self, fill=None):
+        """Copy of the frame with fill (default: self.fill) in every missing value.
+        Only columns with missing values are rewritten."""
+        fill = self.fill if fill is None else fill
+        df = self.frame.copy(deep=False)
+        for col in self.bitmaps:
+            df[col] = _put_fill(df[col], self.valid(col), fill)
+        return(df)
+
+    def restore(self):
+        """The frame in the representation of the input: fill for all missing
+        values if the input used fill (as the transforms have done), else NaN."""
+        if self.fill_cols:
+            return(self.to_fill())
+        return(self.frame)
+
+def _put_fill(series, valid, fill):
+    values = series.values
+    if np.asarray(values).dtype.kind in 'iuf':
+        return(pd.Series(np.where(valid, values, fill), index=series.index, name=series.name))
+    # object (not categorical or string dtype) so that fill can be mixed with the labels
+    return(series.astype(object).where(valid, fill))
+
+def fill_missing(df, fill=-99999, columns=None):
+    """Export boundary: replace nulls with fill, rewriting only the columns that have nulls."""
+    df = df.copy(deep=False)
+    for col in (columns if columns is not None else df.columns):
+        isnull = pd.isnull(df[col].values)
+        if isnull.any():
+            df[col] = _put_fill(df[col], ~isnull, fill)
+    return(df)
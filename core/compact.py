@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Compact point tables for large sites.
+The point table keeps only point-level columns: floats are stored as float32
+where the round trip is within a tolerance (coordinates relative to an origin),
+IDs as the smallest integer type, and raster classes and ub_feat as categoricals
+with small-int codes. Transect-level values stay in the transect table and are
+broadcast to the points by sort_ID only when needed (e.g. for export).
+These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+
+Example:
+    pts = compact.compact_points(pts_df, trans_df)
+    pts_df = compact.expand_points(pts, trans_df)
+'''
+import numpy as np
+import pandas as pd
+
+COORD_FLDS = ['seg_x', 'seg_y', 'SHAPE@X', 'SHAPE@Y']
+CLASS_FLDS = ['GeoSet', 'SubType', 'VegType', 'VegDens', 'DisMOSH', 'ub_feat']
+ID_FLDS = ['sort_ID', 'SplitSort']
+# Transect values used by fun.prep_points to calculate the point distances
+PREP_TRANS_FLDS = ['SL_x', 'SL_y', 'DH_x', 'DH_y', 'DL_x', 'DL_y', 'Arm_x', 'Arm_y', 'WidthPart']
+
+# df.attrs keys with what is needed to restore the original columns
+DTYPES = 'compact_dtypes'
+ORIGIN = 'compact_origin'
+
+"""
+# Compacting
+"""
+def downcast_floats(df, tol=0.001, coords=COORD_FLDS):
+    """Convert float64 columns to float32 where no value changes by more than tol
+    (in the units of the column, e.g. m). Coordinate columns are stored relative to
+    an origin (the floor of their minimum) so that they keep their precision."""
+    df = df.copy()
+    for col in df.columns[[dt == np.float64 for dt in df.dtypes]]:
+        vals = df[col].values
+        origin = 0.0
+        if col in coords and np.isfinite(vals).any():
+            origin = float(np.floor(np.nanmin(vals)))
+            vals = vals - origin
+        vals32 = vals.astype(np.float32)
+        with np.errstate(invalid='ignore'):
+            err = np.nanmax(np.abs(vals32.astype(np.float64) - vals)) if np.isfinite(vals).any() else 0
+        if err <= tol:
+            df.attrs.setdefault(DTYPES, {})[col] = 'float64'
+            if origin:
+                df.attrs.setdefault(ORIGIN, {})[col] = origin
+            df[col] = vals32
+    return(df)
+
+def downcast_ids(df, flds=ID_FLDS):
+    """Store integer-valued ID columns without nulls as the smallest integer type."""
+    for col in [c for c in flds if c in df.columns]:
+        vals = df[col].values
+        if not len(vals) or not np.issubdtype(vals.dtype, np.number) or np.isnan(vals.astype('f8')).any():
+            continue
+        if not np.all(vals == np.round(vals)):
+            continue
+        small = pd.to_numeric(vals.astype(np.int64), downcast='integer')
+        if small.dtype != vals.dtype:
+            df.attrs.setdefault(DTYPES, {})[col] = str(vals.dtype)
+            df[col] = small
+    return(df)
+
+def categorize(df, flds=CLASS_FLDS):
+    """Store raster classes and ub_feat as categoricals (int8 codes for fewer than 128 classes)."""
+    for col in [c for c in flds if c in df.columns]:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        df.attrs.setdefault(DTYPES, {})[col] = str(df[col].dtype)
+        df[col] = df[col].astype('category')
+    return(df)
+
+def compact_points(pts_df, trans_df=None, tID_fld='sort_ID', tol=0.001):
+    """Return a compact copy of pts_df. Columns that are also in trans_df (transect values
+    joined to the points) are dropped; see expand_points to add them back."""
+    if trans_df is not None:
+        pts_df = pts_df.drop([c for c in trans_df.columns if c != tID_fld], axis=1, errors='ignore')
+    pts = pts_df.copy()
+    pts = downcast_ids(pts, [tID_fld] + [c for c in ID_FLDS if c != tID_fld])
+    pts = categorize(pts)
+    pts = downcast_floats(pts, tol)
+    return(pts)
+
+"""
+# Expanding
+"""
+def restore_dtypes(pts):
+    """Return pts with the original dtypes and absolute coordinates."""
+    dtypes = pts.attrs.get(DTYPES, {})
+    origin = pts.attrs.get(ORIGIN, {})
+    df = pts.copy()
+    for col, dt in dtypes.items():
+        if not col in df.columns:
+            continue
+        df[col] = df[col].astype(dt)
+        if col in origin:
+            df[col] = df[col] + origin[col]
+    df.attrs = {}
+    return(df)
+
+def transect_values(pts, trans_df, columns=None, tID_fld='sort_ID'):
+    """Broadcast transect columns (default: all) to the points by tID_fld.
+    Returns a dataframe aligned with pts; points without a matching transect get NaN."""
+    columns = [c for c in (columns if columns is not None else trans_df.columns) if c != tID_fld]
+    tids = trans_df[tID_fld].values if tID_fld in trans_df.columns else trans_df.index.values
+    pos = pd.Index(tids).get_indexer(np.asarray(pts[tID_fld].values, dtype=np.asarray(tids).dtype))
+    missing = pos < 0
+    out = {}
+    for col in columns:
+        vals = np.asarray(trans_df[col].values)
+        if missing.any():
+            # take from an extra null row
+            if not vals.dtype.kind in 'fO':
+                vals = vals.astype('f8')
+            vals = np.append(vals, np.array([np.nan], dtype=vals.dtype))
+            out[col] = vals[np.where(missing, len(trans_df), pos)]
+        else:
+            out[col] = vals[pos]
+        if vals.dtype == object:
+            # keep object (pandas would infer a string dtype)
+            out[col] = pd.Series(out[col], index=pts.index, dtype=object)
+    return(pd.DataFrame(out, index=pts.index, columns=columns))
+
+def expand_points(pts, trans_df=None, columns=None, tID_fld='sort_ID'):
+    """Return the full point table: original dtypes and coordinates, with the transect
+    columns (default: all) of trans_df broadcast to the points."""
+    df = restore_dtypes(pts)
+    if trans_df is None:
+        return(df)
+    tvals = transect_values(df, trans_df, columns, tID_fld)
+    df = df.drop(tvals.columns, axis=1, errors='ignore')
+    return(pd.concat([df, tvals], axis=1))
+
+def memory_MB(df):
+    """Memory used by a dataframe in MB, including object values."""
+    return(df.memory_usage(deep=True).sum() / 1e6)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Streaming CSV export of the final point and transect tables.
+The table is written in chunks of rows: each chunk gets the BN set recodes
+(with lookup arrays built once), the fill value for nulls, and is formatted as
+CSV text, which a background thread writes to the file while the next chunk
+is prepared. Only a few chunks are in memory at a time. Compact point tables
+(core.compact) are expanded with the transect values one chunk at a time.
+These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+'''
+import threading
+import queue
+import numpy as np
+import pandas as pd
+import core.compact as compact
+from core.columns import fill_missing
+
+# Codes of sets of values in the BN layers
+RECODES = {'SubType': {7777:'{1111, 2222}', 1000:'{1111, 3333}'},
+           'VegType': {77:'{11, 22}', 88:'{22, 33}', 99:'{33, 44}'},
+           'VegDens': {666: '{111, 222}', 777: '{222, 333}',
+                       888: '{333, 444}', 999: '{222, 333, 444}'}}
+
+"""
+# Recoding
+"""
+def recode_lookup(mapping):
+    """Return (codes, labels): sorted codes and the matching labels, for recode()."""
+    codes = sorted(mapping)
+    return(np.array(codes, dtype='f8'), np.array([mapping[c] for c in codes], dtype=object))
+
+def recode(values, lookup):
+    """Replace values that are codes in lookup (from recode_lookup) with their labels,
+    as DataFrame.replace does: the result is an object array if any value was replaced."""
+    codes, labels = lookup
+    vals = np.asarray(values)
+    if not vals.dtype.kind in 'iuf':
+        num = pd.to_numeric(pd.Series(vals), errors='coerce').values.astype('f8')
+    else:
+        num = vals.astype('f8')
+    pos = np.minimum(np.searchsorted(codes, num), len(codes) - 1)
+    hit = codes[pos] == num
+    if not hit.any():
+        return(values)
+    out = vals.astype(object)
+    out[hit] = labels[pos[hit]]
+    return(out)
+
+def recode_chunk(df, lookups):
+    """Apply the lookups ({column: recode_lookup(...)}) to the columns of df."""
+    for col, lookup in lookups.items():
+        if col in df.columns:
+            values = df[col].values
+            vals = recode(values, lookup)
+            if not vals is values:
+                df[col] = pd.Series(vals, index=df.index, dtype=object)
+    return(df)
+
+"""
+# Writing
+"""
+class _Writer(threading.Thread):
+    """Thread that writes text from a bounded queue to a file."""
+    def __init__(self, path, maxsize=2):
+        threading.Thread.__init__(self, daemon=True)
+        self.path = path
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error = None
+
+    def run(self):
+        try:
+            with open(self.path, 'w', newline='') as f:
+                while True:
+                    text = self.queue.get()
+                    if text is None:
+                        break
+                    f.write(text)
+        except Exception as err:
+            self.error = err
+            # keep taking chunks so that the producer does not block
+            while self.queue.get() is not None:
+                pass
+
+    def put(self, text):
+        if self.error:
+            raise self.error
+        self.queue.put(text)
+
+    def close(self):
+        self.queue.put(None)
+        self.join()
+        if self.error:
+            raise self.error
+
+def iter_chunks(df, chunksize=20000, trans_df=None, columns=None, tID_fld='sort_ID'):
+    """Yield the rows of df in chunks. With trans_df, df is a compact point table and each
+    chunk is expanded with the transect values (compact.expand_points). columns selects
+    and orders the output columns."""
+    for start in range(0, max(len(df), 1), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        if trans_df is not None:
+            chunk = compact.expand_points(chunk, trans_df, tID_fld=tID_fld)
+        elif chunk.attrs.get(compact.DTYPES):
+            chunk = compact.restore_dtypes(chunk)
+        else:
+            chunk = chunk.copy()
+        if columns is not None:
+            chunk = chunk.reindex(columns=columns)
+        yield(chunk)
+
+def write_csv(df, csv_fname, fill=-99999, recodes=RECODES, chunksize=20000, trans_df=None,
+              columns=None, tID_fld='sort_ID', verbose=True):
+    """Write df (or a compact point table with its trans_df) to csv_fname in chunks,
+    recoding the BN sets and replacing nulls with fill. Returns the number of rows written.
+    The output is the same as df.replace(recodes).fillna(fill).to_csv(csv_fname, index=False)."""
+    lookups = {col: recode_lookup(mapping) for col, mapping in (recodes or {}).items()}
+    writer = _Writer(csv_fname)
+    writer.start()
+    nrows = 0
+    try:
+        for i, chunk in enumerate(iter_chunks(df, chunksize, trans_df, columns, tID_fld)):
+            chunk = recode_chunk(chunk, lookups)
+            chunk = fill_missing(chunk, fill)
+            writer.put(chunk.to_csv(None, header=(i == 0), index=False, na_rep=fill))
+            nrows += len(chunk)
+    finally:
+        writer.close()
+    if verbose:
+        print("OUTPUT: {} ({} rows)".format(csv_fname, nrows))
+    return(nrows)
@@ -17,10 +17,13 @@ from operator import add
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.style.use('ggplot')
+import core.tracing as tracing
+from core.columns import Columns
 
 def print_duration(start, suppress=False):
-    """Print the duration since the given start time."""
-    duration = time.clock() - start
+    """Print the duration since the given start time (from time.perf_counter()).
+    For timing records of processing stages, use core.tracing instead."""
+    duration = time.perf_counter() - start
     hours, remainder = divmod(duration, 3600)
     minutes, seconds = divmod(remainder, 60)
     duration_str = '{:.0f}:{:.0f}:{:.1f} seconds'.format(hours, minutes, seconds)
@@ -84,8 +87,9 @@ def join_columns_id_check(df1, df2, id_fld='ID', how='outer', fill=-99999):
     df1 = df1.drop(df1.axes[1].intersection(df2.axes[1]), axis=1, errors='ignore') # remove matching columns from target dataframe
     df1 = df1.join(df2, how=how)
     # If the dataframe contains both fill values and Null values, replaces fill with Nulls.
-    if (df1 == fill).any().any() and (df1 == np.nan).any().any():
-        df1.replace(fill, np.nan, inplace=True)
+    cols = Columns(df1, fill)
+    if cols.fill_cols and cols.null_cols:
+        df1 = cols.frame
     return(df1)
 
 def join_columns(df1, df2, id_fld='ID', how='outer'):
@@ -109,17 +113,15 @@ def join_columns(df1, df2, id_fld='ID', how='outer'):
 
 def adjust2mhw(df, MHW, fldlist=['DH_z', 'DL_z', 'Arm_z'], fill=-99999):
     """Add elevation fields with values adjusted to MHW, stored in '[fieldname]mhw'"""
-    # If fill values present in df, replace with nan to perform adjustment and then replace
-    if (df == fill).any().any():
-        input_fill = True
-        df.replace(fill, np.nan, inplace=True)
+    # If fill values present in df, adjust with nan and then replace
+    cols = Columns(df, fill)
+    df = cols.frame
     for f in fldlist:
         df = df.drop(f+'mhw', axis=1, errors='ignore')
         df[f+'mhw'] = df[f].subtract(MHW)
-    if input_fill:
-        df.fillna(fill, inplace=True)
-    return(df)
+    return(cols.update(df, [f+'mhw' for f in fldlist]).restore())
 
+@tracing.traced()
 def sort_pts(df, tID_fld='sort_ID', pID_fld='SplitSort'):
     """Calculate pt distance from shore; use that to sort pts and create pID_fld"""
     # 1. set X and Y fields
@@ -163,10 +165,11 @@ def calc_pt_distances(df):
     df = join_columns(df, df2)
     return(df)
 
+@tracing.traced()
 def prep_points(df, tID_fld, pID_fld, MHW, fill=-99999, old2newflds={}):
     """Preprocess transect points (after running FCtoDF(transPts, xy=True))"""
     # Replace fills with NaNs
-    df.replace(fill, np.nan, inplace=True)
+    df = Columns(df, fill).frame
     # Rename columns
     if len(old2newflds):
         df.rename(index=str, columns=old2newflds, inplace=True)
@@ -178,32 +181,106 @@ def prep_points(df, tID_fld, pID_fld, MHW, fill=-99999, old2newflds={}):
     df = calc_pt_distances(df)
     return(df)
 
+@tracing.traced()
 def aggregate_z(df, MHW, id_fld, zfld, fill):
     """Aggregate ptZmhw to max and mean and join to transects"""
-    input_fill=False
-    if (df == fill).any().any():
-        input_fill = True
-        df.replace(fill, np.nan, inplace=True)
+    cols = Columns(df, fill)
+    df = cols.frame
     df = (df.drop(zfld+'mhw', axis=1, errors='ignore')
             .join(df[zfld].subtract(MHW), rsuffix='mhw'))
     # get mean only if > 80% of points have elevation
-    meanf = lambda x: x.mean() if float(x.count())/x.size > 0.8 else np.nan
-    # zmhw = df.groupby(id_fld)[zfld+'mhw'].agg({'mean_Zmhw':meanf,
-    #                                            'max_Zmhw':np.max})
-    zmhw = df.groupby(id_fld)[zfld+'mhw'].agg([meanf,max]).rename(columns={'<lambda>':'mean_Zmhw','max':'max_Zmhw'})
+    prof = build_profiles(df, id_fld)
+    zmhw = (profile_stats(prof, df[zfld+'mhw'].values, coverage=0.8)[['mean', 'max']]
+            .rename(columns={'mean':'mean_Zmhw', 'max':'max_Zmhw'}))
     df = join_columns(df, zmhw, id_fld)
-    if input_fill:
-        df.fillna(fill, inplace=True)
-    return(df, zmhw)
+    return(cols.update(df, [zfld+'mhw'] + list(zmhw.columns)).restore(), zmhw)
+
+"""
+# Profile matrix: points as a padded (transect x station) array
+"""
+Profiles = collections.namedtuple('Profiles', ['ids', 'lengths', 'starts', 'order', 'row', 'col', 'width', 'id_fld'])
+# ids: transect IDs (sorted); lengths: number of stations (points) on each transect
+# starts: position of the first station of each transect in the sorted points
+# order: position in the input dataframe of each sorted point
+# row, col: matrix cell (transect, station) of each sorted point; width: max stations
+
+def build_profiles(df, tID_fld='sort_ID', pID_fld='SplitSort'):
+    """Index the points in df as a transect x station matrix. Points are ordered
+    by tID_fld and then by pID_fld (if present) or their order in df. Points
+    without a transect ID are left out. Build once and reuse for each column."""
+    ids = df[tID_fld].values if tID_fld in df.columns else df.index.get_level_values(tID_fld).values
+    ids = np.asarray(ids, dtype='f8')
+    keep = np.flatnonzero(~np.isnan(ids))
+    if pID_fld in df.columns:
+        order = keep[np.lexsort((df[pID_fld].values[keep], ids[keep]))]
+    else:
+        order = keep[np.argsort(ids[keep], kind='stable')]
+    uids, starts, lengths = np.unique(ids[order], return_index=True, return_counts=True)
+    row = np.repeat(np.arange(len(uids)), lengths)
+    col = np.arange(len(order)) - np.repeat(starts, lengths)
+    width = int(lengths.max()) if len(lengths) else 0
+    if len(uids) and np.all(uids == np.round(uids)):
+        uids = uids.astype(np.int64)
+    return(Profiles(uids, lengths, starts, order, row, col, width, tID_fld))
 
-def get_beachplot_values(pts_set):
-    """Get values to use while plotting island and beach cross-section for QC."""
+def profile_matrix(prof, values, pad=np.nan):
+    """Return values (aligned with the rows of the dataframe used in build_profiles)
+    as a (transect x station) array padded with pad."""
+    values = np.asarray(values, dtype='f8')
+    mat = np.full((len(prof.ids), prof.width), pad, dtype='f8')
+    mat[prof.row, prof.col] = values[prof.order]
+    return(mat)
+
+def transect_rows(prof, tID):
+    """Positions in the points dataframe of the points of transect tID, in station order,
+    e.g. pts_set = pts_df.iloc[transect_rows(prof, 100)]"""
+    i = np.searchsorted(prof.ids, tID)
+    if i == len(prof.ids) or prof.ids[i] != tID:
+        return(np.zeros(0, np.int64))
+    return(prof.order[prof.starts[i]:prof.starts[i] + prof.lengths[i]])
+
+def profile_stats(prof, values, coverage=0.8):
+    """Per-transect statistics of values (e.g. ptZmhw), each a single reduction along
+    the station axis of the profile matrix:
+    count and coverage (fraction of stations with a value), mean (only where coverage
+    is greater than the coverage argument), max, first and last station with a value,
+    argmax (station of the first maximum), and argmax_row (position of that point in the
+    dataframe, like idxmax). Stations are numbered from 0; NaN where no station has a value."""
+    mat = profile_matrix(prof, values)
+    valid = ~np.isnan(mat)
+    count = valid.sum(axis=1)
+    has = count > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cover = count / prof.lengths
+        mean = np.where(valid, mat, 0).sum(axis=1) / count
+    mean[~(cover > coverage)] = np.nan
+    masked = np.where(valid, mat, -np.inf)
+    argmax = masked.argmax(axis=1)
+    vmax = np.where(has, masked[np.arange(len(argmax)), argmax], np.nan)
+    first = valid.argmax(axis=1)
+    last = prof.width - 1 - valid[:, ::-1].argmax(axis=1)
+    argmax_row = prof.order[np.minimum(prof.starts + argmax, len(prof.order) - 1)] if len(prof.order) else argmax
+    stats = pd.DataFrame({'count': count, 'coverage': cover, 'mean': mean, 'max': vmax,
+                          'first': np.where(has, first, np.nan), 'last': np.where(has, last, np.nan),
+                          'argmax': np.where(has, argmax, np.nan), 'argmax_row': np.where(has, argmax_row, np.nan)},
+                         index=pd.Index(prof.ids, name=prof.id_fld))
+    return(stats)
+
+def get_beachplot_values(pts_set, zstats, tID_fld='sort_ID'):
+    """Get values to use while plotting island and beach cross-section for QC.
+    pts_set: points of one transect in station order, e.g. pts_df.iloc[transect_rows(prof, tID)]
+    zstats: profile_stats(prof, pts_df['ptZmhw'].values) for all transects, calculated once"""
     tran = pts_set.iloc[0]
 
-    # Get maximum Z values
-    idmaxz = pts_set['ptZmhw'].idxmax()
-    maxz = pts_set['ptZmhw'].loc[idmaxz]
-    mz_xy = pts_set[['seg_x', 'seg_y']].loc[idmaxz]
+    # Get maximum Z values (station of the maximum from the profile statistics)
+    stats = zstats.loc[tran[tID_fld]]
+    if np.isnan(stats['argmax']):
+        idmaxz, maxz = None, np.nan
+        mz_xy = pd.Series({'seg_x': np.nan, 'seg_y': np.nan})
+    else:
+        idmaxz = pts_set.index[int(stats['argmax'])]
+        maxz = stats['max']
+        mz_xy = pts_set[['seg_x', 'seg_y']].iloc[int(stats['argmax'])]
     mz_dist = np.hypot(mz_xy.seg_x - tran.SL_x, mz_xy.seg_y- tran.SL_y)
 
     # Get beach end and beach top
@@ -220,10 +297,10 @@ def get_beachplot_values(pts_set):
     # Return
     return(tran, idmaxz, maxz, mz_xy, mz_dist, bend, btop)
 
-def plot_island_profile(ax, pts_set, MHW, MTL):
+def plot_island_profile(ax, pts_set, zstats, MHW, MTL):
     """Plot island cross-section to QC calculated values."""
     # Get prep values
-    tran, idmaxz, maxz, mz_xy, mz_dist, bend, btop = get_beachplot_values(pts_set)
+    tran, idmaxz, maxz, mz_xy, mz_dist, bend, btop = get_beachplot_values(pts_set, zstats)
     maxz = maxz+MHW
     btop = btop+MHW
 
@@ -268,10 +345,10 @@ def plot_island_profile(ax, pts_set, MHW, MTL):
     ax.axhspan(ymin=-0.5, ymax=MHW, xmin=xllim, xmax=xulim, alpha=0.2, color='blue')
     plt.annotate('MHW', xy=(-tran.WidthFull*0.02, MHW-0.15), color='blue', alpha=0.7)
 
-def plot_beach_profile(ax, pts_set, MHW, MTL, maxDH):
+def plot_beach_profile(ax, pts_set, zstats, MHW, MTL, maxDH):
     """Plot beach cross-section to QC calculated values."""
     # Get prep values
-    tran, idmaxz, maxz, mz_xy, mz_dist, bend, btop = get_beachplot_values(pts_set)
+    tran, idmaxz, maxz, mz_xy, mz_dist, bend, btop = get_beachplot_values(pts_set, zstats)
     maxz = maxz+MHW
     btop = btop+MHW
     maxDH = maxDH+MHW
@@ -0,0 +1,851 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Vectorized geometry functions. These functions do not use arcpy.
+Lines are passed as flat coordinate arrays with offsets (see Lines), which can
+be read from a feature class with functions_warcpy.FCtoLines().
+Designed to be imported by either prepper.ipynb or extractor.py.
+'''
+import collections
+import pandas as pd
+import numpy as np
+
+"""
+# Geometry containers and general use functions
+"""
+# ids: one value per line (multipart features repeat the ID, one line per part)
+# xy: (n_vertices, 2) array of vertex coordinates
+# offsets: (n_lines + 1) array; vertices of line i are xy[offsets[i]:offsets[i+1]]
+Lines = collections.namedtuple('Lines', ['ids', 'xy', 'offsets'])
+
+# Grid (bucket) index of items with bounding boxes.
+# Cells are keyed by _cell_key(); keys is sorted and items is aligned with keys.
+GridIndex = collections.namedtuple('GridIndex', ['cell', 'x0', 'y0', 'keys', 'items'])
+
+def make_lines(ids, xy, offsets):
+    """Return Lines with arrays coerced to the expected dtypes."""
+    xy = np.asarray(xy, dtype='f8').reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ids = np.asarray(ids)
+    if len(offsets) != len(ids) + 1 or offsets[-1] != len(xy):
+        raise ValueError('offsets must have one more value than ids and end at the number of vertices.')
+    return(Lines(ids, xy, offsets))
+
+def lines_from_list(ids, coordlist):
+    """Create Lines from a list of vertex lists, e.g. [[(x1, y1), (x2, y2)], ...]."""
+    counts = [len(c) for c in coordlist]
+    xy = np.concatenate([np.asarray(c, dtype='f8').reshape(-1, 2) for c in coordlist]) if len(coordlist) else np.empty((0, 2))
+    return(make_lines(ids, xy, np.concatenate([[0], np.cumsum(counts)])))
+
+def ragged_arange(counts):
+    """Return (group, position) arrays enumerating range(c) for each c in counts.
+    E.g. counts [2, 3] --> group [0, 0, 1, 1, 1], position [0, 1, 0, 1, 2]."""
+    counts = np.asarray(counts, dtype=np.int64)
+    group = np.repeat(np.arange(len(counts)), counts)
+    starts = np.cumsum(counts) - counts
+    position = np.arange(counts.sum()) - np.repeat(starts, counts)
+    return(group, position)
+
+def line_segments(lines):
+    """Return the index of the start vertex and the line index of each segment.
+    Segment k runs from xy[start[k]] to xy[start[k]+1]."""
+    nverts = np.diff(lines.offsets)
+    nsegs = np.maximum(nverts - 1, 0)
+    line_idx, pos = ragged_arange(nsegs)
+    start = lines.offsets[:-1][line_idx] + pos
+    return(start, line_idx)
+
+def segment_arrays(lines):
+    """Return ax, ay, bx, by, line index, and cumulative distance along the line at the start of each segment."""
+    start, line_idx = line_segments(lines)
+    a = lines.xy[start]
+    b = lines.xy[start + 1]
+    seglen = np.hypot(b[:, 0] - a[:, 0], b[:, 1] - a[:, 1])
+    # cumulative length at segment start, restarting at each line
+    cum = group_cumsum(seglen, line_idx, exclusive=True)
+    return(a[:, 0], a[:, 1], b[:, 0], b[:, 1], line_idx, cum)
+
+def group_cumsum(values, group, exclusive=False):
+    """Cumulative sum of values restarting at each group (group must be sorted, e.g. the line index of each segment).
+    Each group is summed on its own, so the result for a line does not depend on
+    the lines before it. With exclusive, the sum is of the values before each element."""
+    values = np.asarray(values, dtype='f8')
+    if not len(values):
+        return(values.copy())
+    incl = pd.Series(values).groupby(np.asarray(group), sort=False).cumsum().values
+    if not exclusive:
+        return(incl)
+    first = np.r_[True, group[1:] != group[:-1]]
+    return(np.where(first, 0.0, np.r_[0.0, incl[:-1]]))
+
+def line_lengths(lines):
+    """Return the length of each line."""
+    start, line_idx = line_segments(lines)
+    d = np.hypot(*(lines.xy[start + 1] - lines.xy[start]).T) if len(start) else np.zeros(0)
+    return(np.bincount(line_idx, weights=d, minlength=len(lines.ids)))
+
+def line_boxes(lines):
+    """Return xmin, ymin, xmax, ymax of each line (inf/-inf for lines without vertices)."""
+    n = len(lines.ids)
+    counts = np.diff(lines.offsets)
+    has = counts > 0
+    xmin, ymin = np.full(n, np.inf), np.full(n, np.inf)
+    xmax, ymax = np.full(n, -np.inf), np.full(n, -np.inf)
+    starts = lines.offsets[:-1][has]
+    xmin[has] = np.minimum.reduceat(lines.xy[:, 0], starts)
+    ymin[has] = np.minimum.reduceat(lines.xy[:, 1], starts)
+    xmax[has] = np.maximum.reduceat(lines.xy[:, 0], starts)
+    ymax[has] = np.maximum.reduceat(lines.xy[:, 1], starts)
+    return(xmin, ymin, xmax, ymax)
+
+def take_lines(lines, idx):
+    """Return Lines with only the lines at positions idx, in that order."""
+    idx = np.asarray(idx, dtype=np.int64)
+    counts = np.diff(lines.offsets)[idx]
+    group, pos = ragged_arange(counts)
+    verts = lines.offsets[:-1][idx][group] + pos
+    return(Lines(lines.ids[idx], lines.xy[verts], np.r_[0, np.cumsum(counts)].astype(np.int64)))
+
+def point_segment_distance(px, py, ax, ay, bx, by):
+    """Distance from points to segments (element-wise) and the
+    position (t from 0 to 1, x, y) of the nearest point on the segment."""
+    dx = bx - ax
+    dy = by - ay
+    len2 = dx*dx + dy*dy
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = ((px - ax)*dx + (py - ay)*dy) / len2
+    t = np.where(len2 > 0, np.clip(t, 0, 1), 0)
+    fx = ax + t*dx
+    fy = ay + t*dy
+    return(np.hypot(px - fx, py - fy), t, fx, fy)
+
+def segment_intersection(ax, ay, bx, by, cx, cy, dx, dy):
+    """Intersect segments a-b with segments c-d (element-wise).
+    Return hit mask, t along a-b, u along c-d, and x, y of intersection.
+    Collinear overlaps are not reported as hits."""
+    rx, ry = bx - ax, by - ay
+    sx, sy = dx - cx, dy - cy
+    denom = rx*sy - ry*sx
+    qx, qy = cx - ax, cy - ay
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = (qx*sy - qy*sx) / denom
+        u = (qx*ry - qy*rx) / denom
+        x = ax + t*rx
+        y = ay + t*ry
+    hit = (denom != 0) & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    return(hit, t, u, x, y)
+
+def segment_distance(ax, ay, bx, by, cx, cy, dx, dy):
+    """Minimum distance between segments a-b and c-d (element-wise); 0 where they cross."""
+    hit = segment_intersection(ax, ay, bx, by, cx, cy, dx, dy)[0]
+    d = np.minimum.reduce([point_segment_distance(ax, ay, cx, cy, dx, dy)[0],
+                           point_segment_distance(bx, by, cx, cy, dx, dy)[0],
+                           point_segment_distance(cx, cy, ax, ay, bx, by)[0],
+                           point_segment_distance(dx, dy, ax, ay, bx, by)[0]])
+    return(np.where(hit, 0.0, d))
+
+"""
+# Grid index
+"""
+def _cell_key(col, row):
+    """Combine integer cell column and row into one int64 key."""
+    return((col.astype(np.int64) + 2**30) * 2**31 + (row.astype(np.int64) + 2**30))
+
+def build_grid_index(xmin, ymin, xmax, ymax, cell, pad=0.0):
+    """Bucket items (given by their bounding boxes) into a grid of square cells.
+
+    Each bounding box is expanded by pad plus half a cell before it is
+    bucketed, so that query_grid_index() only has to look in the cell of
+    each station along a query segment. Use pad to find items within a
+    distance of the query segments (e.g. the proximity tolerance).
+    """
+    cell = float(cell)
+    if not cell > 0:
+        raise ValueError('Grid cell size must be greater than 0.')
+    xmin, ymin, xmax, ymax = [np.atleast_1d(np.asarray(v, dtype='f8')) for v in (xmin, ymin, xmax, ymax)]
+    if not len(xmin):
+        return(GridIndex(cell, 0.0, 0.0, np.zeros(0, np.int64), np.zeros(0, np.int64)))
+    grow = pad + cell/2.0
+    x0 = float(np.nanmin(xmin)) - grow
+    y0 = float(np.nanmin(ymin)) - grow
+    c0 = np.floor((xmin - grow - x0) / cell).astype(np.int64)
+    c1 = np.floor((xmax + grow - x0) / cell).astype(np.int64)
+    r0 = np.floor((ymin - grow - y0) / cell).astype(np.int64)
+    r1 = np.floor((ymax + grow - y0) / cell).astype(np.int64)
+    ncols = c1 - c0 + 1
+    nrows = r1 - r0 + 1
+    item, pos = ragged_arange(ncols * nrows)
+    col = c0[item] + pos // nrows[item]
+    row = r0[item] + pos % nrows[item]
+    keys = _cell_key(col, row)
+    order = np.argsort(keys, kind='stable')
+    return(GridIndex(cell, x0, y0, keys[order], item[order]))
+
+def index_points(x, y, cell, pad=0.0):
+    """Grid index of points."""
+    return(build_grid_index(x, y, x, y, cell, pad))
+
+def index_segments(ax, ay, bx, by, cell, pad=0.0):
+    """Grid index of segments by bounding box."""
+    return(build_grid_index(np.minimum(ax, bx), np.minimum(ay, by),
+                            np.maximum(ax, bx), np.maximum(ay, by), cell, pad))
+
+def query_grid_index(index, ax, ay, bx, by, chunk=500000):
+    """Find candidate items near each query segment a-b.
+
+    Stations are placed along each segment no more than one cell apart and
+    looked up in the index. Returns unique (segment, item) pairs. Candidates
+    must still be tested exactly; the index only removes the far ones.
+    """
+    ax, ay, bx, by = [np.atleast_1d(np.asarray(v, dtype='f8')) for v in (ax, ay, bx, by)]
+    empty = (np.zeros(0, np.int64), np.zeros(0, np.int64))
+    if not len(index.keys) or not len(ax):
+        return(empty)
+    nitems = int(index.items.max()) + 1
+    seglen = np.hypot(bx - ax, by - ay)
+    nstations = np.where(np.isfinite(seglen), np.ceil(seglen / index.cell), 0).astype(np.int64) + 1
+    # Process in chunks of segments to bound the number of stations in memory
+    block = (np.cumsum(nstations) - nstations) // chunk
+    bounds = np.r_[0, np.flatnonzero(np.diff(block)) + 1, len(ax)]
+    qlist, ilist = [], []
+    for s0, s1 in zip(bounds[:-1], bounds[1:]):
+        seg, pos = ragged_arange(nstations[s0:s1])
+        seg += s0
+        frac = np.where(nstations[seg] > 1, pos / np.maximum(nstations[seg] - 1, 1), 0.0)
+        sx = ax[seg] + frac * (bx[seg] - ax[seg])
+        sy = ay[seg] + frac * (by[seg] - ay[seg])
+        ok = np.isfinite(sx) & np.isfinite(sy)
+        seg, sx, sy = seg[ok], sx[ok], sy[ok]
+        qkeys = _cell_key(np.floor((sx - index.x0) / index.cell), np.floor((sy - index.y0) / index.cell))
+        lo = np.searchsorted(index.keys, qkeys, 'left')
+        hi = np.searchsorted(index.keys, qkeys, 'right')
+        grp, off = ragged_arange(hi - lo)
+        pairs = np.unique(seg[grp] * nitems + index.items[lo[grp] + off])
+        qlist.append(pairs // nitems)
+        ilist.append(pairs % nitems)
+    return(np.concatenate(qlist), np.concatenate(ilist))
+
+def group_argmin(groups, values, tiebreak=None):
+    """Return positions of the minimum value within each group; ties go to the lowest tiebreak (default: position)."""
+    if tiebreak is None:
+        tiebreak = np.arange(len(values))
+    order = np.lexsort((tiebreak, values, groups))
+    g = groups[order]
+    first = np.r_[True, g[1:] != g[:-1]] if len(g) else np.zeros(0, bool)
+    return(order[first])
+
+"""
+#%% dune and shoreline points to transects
+"""
+def nearest_pts2lines(lines, pts_xy, proximity=25, cell=None):
+    """For each line ID, find the nearest point closer than proximity.
+
+    Returns a DataFrame indexed by line ID with the position of the point
+    (pt) and its index in pts_xy, and the position of the point snapped to
+    the line (snapX, snapY). Line IDs without a point within proximity are
+    omitted. Ties go to the point that comes first in pts_xy, like a search
+    cursor that only replaces the match with a strictly nearer point.
+    """
+    pts_xy = np.asarray(pts_xy, dtype='f8').reshape(-1, 2)
+    cols = ['pt', 'dist', 'snapX', 'snapY']
+    if not len(pts_xy) or not len(lines.ids):
+        return(pd.DataFrame(columns=cols, index=pd.Index([], name='id')))
+    if cell is None:
+        cell = max(float(proximity), 1.0)
+    ax, ay, bx, by, line_idx, _ = segment_arrays(lines)
+    ptx, pty = pts_xy[:, 0], pts_xy[:, 1]
+    index = index_points(ptx, pty, cell, pad=proximity)
+    seg, pt = query_grid_index(index, ax, ay, bx, by)
+    dist, t, fx, fy = point_segment_distance(ptx[pt], pty[pt], ax[seg], ay[seg], bx[seg], by[seg])
+    near = dist < proximity
+    seg, pt, dist, fx, fy = seg[near], pt[near], dist[near], fx[near], fy[near]
+    # Multipart lines share an ID, so group by the ID rather than by the line
+    _, id_code = np.unique(lines.ids, return_inverse=True)
+    grp = id_code[line_idx[seg]]
+    best = group_argmin(grp, dist, tiebreak=pt)
+    df = pd.DataFrame({'pt': pt[best], 'dist': dist[best],
+                       'snapX': fx[best], 'snapY': fy[best]},
+                      index=pd.Index(lines.ids[line_idx[seg[best]]], name='id'))
+    return(df)
+
+def dune2trans(trans, pts_xy, pts_z, prefix, proximity=25, tID_fld='sort_ID', cell=None):
+    """Get the nearest dune point (within proximity) to each transect.
+    Returns columns [prefix]_x, _y, _z, _snapX, _snapY, like geom_dune2trans()."""
+    pts_xy = np.asarray(pts_xy, dtype='f8').reshape(-1, 2)
+    pts_z = np.asarray(pts_z, dtype='f8')
+    near = nearest_pts2lines(trans, pts_xy, proximity, cell)
+    pt = near['pt'].values.astype(np.int64)
+    df = pd.DataFrame({prefix+'_x': pts_xy[pt, 0], prefix+'_y': pts_xy[pt, 1],
+                       prefix+'_z': pts_z[pt],
+                       prefix+'_snapX': near['snapX'].values,
+                       prefix+'_snapY': near['snapY'].values},
+                      index=near.index, dtype='f8')
+    df.index.name = tID_fld
+    return(df)
+
+def dunes2trans(trans, dh_xy, dh_z, dl_xy, dl_z, tID_fld='sort_ID', proximity=25, cell=None):
+    """Find the nearest dune crest (DH) and dune toe (DL) points to the transects.
+    Arcpy-free equivalent of find_ClosestPt2Trans_snap()."""
+    colnames =['DH_x', 'DH_y', 'DH_z', 'DH_snapX', 'DH_snapY',
+                'DL_x', 'DL_y', 'DL_z', 'DL_snapX','DL_snapY']
+    dh = dune2trans(trans, dh_xy, dh_z, 'DH', proximity, tID_fld, cell)
+    dl = dune2trans(trans, dl_xy, dl_z, 'DL', proximity, tID_fld, cell)
+    out_df = dh.join(dl, how='outer').reindex(columns=colnames)
+    out_df.index.name = tID_fld
+    return(out_df)
+
+def line_crossings(lines, others, cell=None):
+    """Find every crossing of lines with others.
+
+    Returns a DataFrame with one row per crossing: the positional indices of
+    the line and the other line, the crossing position (x, y), and the
+    distance along each line to the crossing (along, along_other). The
+    segments of others are bucketed in a grid index, so each segment of
+    lines is only tested against the segments of others near it.
+    """
+    cols = ['line', 'other', 'x', 'y', 'along', 'along_other']
+    ax, ay, bx, by, line_idx, cum = segment_arrays(lines)
+    cx, cy, dx, dy, other_idx, ocum = segment_arrays(others)
+    if not len(ax) or not len(cx):
+        return(pd.DataFrame({c: np.zeros(0, np.int64 if c in ('line', 'other') else 'f8') for c in cols}, columns=cols))
+    olen = np.hypot(dx - cx, dy - cy)
+    if cell is None:
+        # Segments of others are usually short, so size cells to a typical segment
+        cell = max(float(np.nanmedian(olen)), 1.0)
+    index = index_segments(cx, cy, dx, dy, cell)
+    seg, oseg = query_grid_index(index, ax, ay, bx, by)
+    hit, t, u, x, y = segment_intersection(ax[seg], ay[seg], bx[seg], by[seg],
+                                           cx[oseg], cy[oseg], dx[oseg], dy[oseg])
+    seg, oseg, t, u, x, y = seg[hit], oseg[hit], t[hit], u[hit], x[hit], y[hit]
+    seglen = np.hypot(bx[seg] - ax[seg], by[seg] - ay[seg])
+    df = pd.DataFrame({'line': line_idx[seg], 'other': other_idx[oseg], 'x': x, 'y': y,
+                       'along': cum[seg] + t*seglen,
+                       'along_other': ocum[oseg] + u*olen[oseg]}, columns=cols)
+    # A crossing exactly on a shared vertex is found on both adjoining segments
+    df = df.drop_duplicates(['line', 'other', 'x', 'y'])
+    return(df.sort_values(['line', 'along']).reset_index(drop=True))
+
+def shore2trans(trans, shoreline, slpts_xy, slope, tID_fld='sort_ID', proximity=25, cell=None):
+    """Get the position where each transect crosses the shoreline (SL_x, SL_y) and
+    the slope (Bslope) of the nearest shoreline point within proximity.
+    Arcpy-free equivalent of add_shorelinePts2Trans().
+
+    Like geom_shore2trans(), when a transect crosses more than one shoreline
+    feature the last feature is used. When it crosses the same feature more
+    than once, the crossing nearest the start of the transect is used.
+    """
+    uids = pd.unique(trans.ids)
+    df = pd.DataFrame(np.nan, index=pd.Index(uids, name=tID_fld), columns=['SL_x', 'SL_y', 'Bslope'], dtype='float64')
+    # 1. SL_x and SL_y at the crossing of the transect and the shoreline
+    xing = line_crossings(trans, shoreline, cell)
+    if len(xing):
+        tid = trans.ids[xing['line'].values]
+        _, grp = np.unique(tid, return_inverse=True)
+        best = group_argmin(grp, -xing['other'].values, tiebreak=xing['along'].values)
+        df.loc[tid[best], 'SL_x'] = xing['x'].values[best]
+        df.loc[tid[best], 'SL_y'] = xing['y'].values[best]
+    # 2. Bslope at the closest shoreline point within proximity
+    near = nearest_pts2lines(trans, slpts_xy, proximity)
+    if len(near):
+        df.loc[near.index, 'Bslope'] = np.asarray(slope, dtype='f8')[near['pt'].values.astype(np.int64)]
+    return(df)
+
+def armor2trans(trans, armor, sl_df, tID_fld='sort_ID', fill=-99999, cell=None):
+    """Get the position (Arm_x, Arm_y) where armoring lines cross each transect.
+    Arcpy-free equivalent of the Intersect step of ArmorLineToTrans_PD().
+
+    Where a transect crosses armoring more than once, the crossing closest to
+    the shoreline position of the transect (SL_x, SL_y in sl_df, indexed by
+    transect ID) is used, i.e. the most seaward one. Without a shoreline
+    position (NaN or fill), the crossing nearest the start of the transect is used.
+    Returns a DataFrame indexed by tID_fld of the transects that cross armoring.
+    """
+    xing = line_crossings(trans, armor, cell)
+    if not len(xing):
+        # e.g. a partition without armoring
+        return(pd.DataFrame({'Arm_x': np.zeros(0), 'Arm_y': np.zeros(0)}, index=pd.Index(trans.ids[:0], name=tID_fld)))
+    tid = trans.ids[xing['line'].values.astype(np.int64)]
+    x, y = xing['x'].values, xing['y'].values
+    sl = sl_df.reindex(pd.unique(tid))[['SL_x', 'SL_y']].replace(fill, np.nan)
+    _, grp = np.unique(tid, return_inverse=True)
+    pos = sl.index.get_indexer(tid)
+    dist = np.hypot(sl['SL_x'].values[pos] - x, sl['SL_y'].values[pos] - y)
+    best = group_argmin(grp, np.where(np.isnan(dist), np.inf, dist), tiebreak=xing['along'].values)
+    return(pd.DataFrame({'Arm_x': x[best], 'Arm_y': y[best]}, index=pd.Index(tid[best], name=tID_fld)))
+
+def line_ends(lines):
+    """Return DataFrame indexed by line ID with the first (start_x, start_y) and
+    last (end_x, end_y) vertex. For multipart lines, the start of the first
+    part and the end of the last part are used."""
+    uids, first = np.unique(lines.ids, return_index=True)
+    _, last = np.unique(lines.ids[::-1], return_index=True)
+    last = len(lines.ids) - 1 - last
+    s = lines.xy[lines.offsets[:-1][first]]
+    e = lines.xy[lines.offsets[1:][last] - 1]
+    df = pd.DataFrame({'start_x': s[:, 0], 'start_y': s[:, 1],
+                       'end_x': e[:, 0], 'end_y': e[:, 1]}, index=uids)
+    return(df)
+
+"""
+Line extension
+"""
+def _move_vertices(xy, iv, iref, dist):
+    """Move vertices iv (in place) by dist along the direction from vertices iref to iv.
+    Vertices that coincide with their reference vertex are not moved."""
+    d = xy[iv] - xy[iref]
+    seglen = np.hypot(d[:, 0], d[:, 1])
+    ok = seglen > 0
+    xy[iv[ok]] += d[ok] / seglen[ok, None] * dist[ok, None]
+
+def extend_lines(lines, distance, end='end'):
+    """Extend every feature by distance, continuing the direction of its first and/or last segment.
+    Arcpy-free engine of functions_warcpy.ExtendLine().
+
+    distance: one number, an array with one value per feature (in the order of feature_runs()),
+        or a pandas Series indexed by feature ID (features not in the Series are not changed).
+        Negative values shorten the end segment.
+    end: 'start', 'end', or 'both'. The first vertex of the first part and/or the last vertex
+        of the last part of each feature is moved; no vertices are added. Features with a
+        zero-length end segment are not changed.
+    Returns new Lines."""
+    if not end in ('start', 'end', 'both'):
+        raise ValueError("end must be 'start', 'end', or 'both'.")
+    first, nparts = feature_runs(lines)
+    if isinstance(distance, pd.Series):
+        distance = distance.reindex(lines.ids[first]).fillna(0).values
+    dist = np.broadcast_to(np.asarray(distance, dtype='f8'), first.shape)
+    xy = lines.xy.copy()
+    if end in ('end', 'both'):
+        last = first + nparts - 1
+        iv = lines.offsets[last + 1] - 1
+        ok = iv > lines.offsets[last]
+        _move_vertices(xy, iv[ok], iv[ok] - 1, dist[ok])
+    if end in ('start', 'both'):
+        iv = lines.offsets[first]
+        ok = lines.offsets[first + 1] - iv > 1
+        _move_vertices(xy, iv[ok], iv[ok] + 1, dist[ok])
+    return(Lines(lines.ids, xy, lines.offsets))
+
+"""
+Duplicate lines
+"""
+def geometry_keys(lines, tolerance=0.001, shift=0.0):
+    """Return the feature IDs and a hashable key of each feature's shape. Vertices are rounded
+    to tolerance, each part is oriented so that it starts at its lower (x, y) end, and parts are
+    sorted, so features with the same vertices (within rounding) in either direction get the same key.
+    shift (in units of tolerance) moves the rounding grid."""
+    first, nparts = feature_runs(lines)
+    q = np.round(lines.xy / tolerance + shift).astype(np.int64)
+    # Reverse the parts whose last vertex is lower than their first
+    start, stop = lines.offsets[:-1], lines.offsets[1:]
+    nonempty = stop > start
+    a, b = q[start[nonempty]], q[stop[nonempty] - 1]
+    flip = np.zeros(len(start), bool)
+    flip[nonempty] = (b[:, 0] < a[:, 0]) | ((b[:, 0] == a[:, 0]) & (b[:, 1] < a[:, 1]))
+    group, pos = ragged_arange(stop - start)
+    order = np.where(flip[group], stop[group] - 1 - pos, start[group] + pos)
+    q = q[order]
+    parts = [q[i:j].tobytes() for i, j in zip(start, stop)]
+    keys = [b'|'.join(sorted(parts[i:i+n])) if n > 1 else parts[i] for i, n in zip(first, nparts)]
+    return(lines.ids[first], keys)
+
+def duplicate_lines(lines, others, tolerance=0.001):
+    """Find the features of lines that have the same shape as a feature of others (see geometry_keys()),
+    with one hash lookup per feature. Features without a match are checked again on a rounding grid
+    shifted by half the tolerance, so that vertices that differ by much less than the tolerance are
+    rarely split by rounding. Returns a dataframe of matched pairs (line_ID, other_ID)."""
+    pairs = []
+    matched = set()
+    for shift in (0.0, 0.5):
+        other_ids, other_keys = geometry_keys(others, tolerance, shift)
+        lookup = dict(zip(other_keys, other_ids))
+        ids, keys = geometry_keys(lines, tolerance, shift)
+        for i, k in zip(ids, keys):
+            if k in lookup and not i in matched:
+                pairs.append((i, lookup[k]))
+                matched.add(i)
+    return(pd.DataFrame(pairs, columns=['line_ID', 'other_ID']))
+
+"""
+Transect ordering
+"""
+def transect_chainage(trans, ref, cell=None):
+    """Chainage (distance along ref) where each transect crosses the reference lines (sort lines or shoreline).
+
+    Returns a DataFrame indexed by transect ID with the ID of the ref feature
+    (ref_ID) and the chainage. The parts of a multipart ref feature are measured
+    in order. A transect that crosses more than one ref feature is assigned to
+    the first feature (in the order of ref); if it crosses that feature more
+    than once, the crossing nearest the start of the transect is used.
+    Transects that do not cross ref are not included.
+    """
+    first, nparts = feature_runs(ref)
+    feat = np.repeat(np.arange(len(first)), nparts)
+    # Chainage at the start of each part of a multipart feature
+    part_start = group_cumsum(line_lengths(ref), feat, exclusive=True)
+    xing = line_crossings(trans, ref, cell)
+    if not len(xing):
+        return(pd.DataFrame({'ref_ID': ref.ids[:0], 'chainage': np.zeros(0)}, index=pd.Index(trans.ids[:0], name='trans_ID')))
+    other = xing['other'].values.astype(np.int64)
+    tid = trans.ids[xing['line'].values.astype(np.int64)]
+    _, grp = np.unique(tid, return_inverse=True)
+    best = group_argmin(grp, feat[other], tiebreak=xing['along'].values)
+    return(pd.DataFrame({'ref_ID': ref.ids[other[best]],
+                         'chainage': xing['along_other'].values[best] + part_start[other[best]]},
+                        index=pd.Index(tid[best], name='trans_ID')))
+
+def chainage_order(trans, ref, reverse=False, start=1, cell=None):
+    """Order transects along the reference lines: by ref feature (in the order of ref), then
+    by chainage along the feature (see transect_chainage()), descending where reverse is True.
+    reverse is a bool for all ref features or a dict or Series of bools by ref ID.
+    Returns the transect_chainage() DataFrame in sort order with sort_ID numbered from start."""
+    df = transect_chainage(trans, ref, cell)
+    first, _ = feature_runs(ref)
+    chain = df['chainage'].values
+    order = []
+    for rid in ref.ids[first]:
+        sel = np.flatnonzero(df['ref_ID'].values == rid)
+        rev = reverse.get(rid, False) if hasattr(reverse, 'get') else reverse
+        order.append(sel[np.argsort(-chain[sel] if rev else chain[sel], kind='stable')])
+    df = df.iloc[np.concatenate(order) if order else np.zeros(0, np.int64)].copy()
+    df['sort_ID'] = np.arange(start, start + len(df))
+    return(df)
+
+"""
+Dist2Inlet
+"""
+def inlet_chainage(shoreline, inlets, tolerance=1.0):
+    """Locate the inlets along each shoreline line as chainage (distance along the line).
+
+    Returns a DataFrame with the positional index of the shoreline line and
+    the chainage of each inlet crossing, sorted. Because the shoreline is
+    usually split at the inlet lines, an inlet within tolerance of either
+    end of a shoreline line is placed at that end.
+    """
+    xing = line_crossings(shoreline, inlets)
+    df = pd.DataFrame({'line': xing['line'].values.astype(np.int64),
+                       'chainage': xing['along'].values.astype('f8')})
+    # Inlets that touch the ends of the shoreline lines
+    lengths = line_lengths(shoreline)
+    nlines = len(shoreline.ids)
+    ends_xy = np.r_[shoreline.xy[shoreline.offsets[:-1]], shoreline.xy[shoreline.offsets[1:] - 1]]
+    if len(inlets.ids) and len(ends_xy):
+        # distance from every shoreline end to the nearest inlet segment
+        ax, ay, bx, by, _, _ = segment_arrays(inlets)
+        index = index_segments(ax, ay, bx, by, cell=max(float(tolerance), 1.0), pad=tolerance)
+        e, seg = query_grid_index(index, ends_xy[:, 0], ends_xy[:, 1], ends_xy[:, 0], ends_xy[:, 1])
+        d, _, _, _ = point_segment_distance(ends_xy[e, 0], ends_xy[e, 1], ax[seg], ay[seg], bx[seg], by[seg])
+        e = np.unique(e[d <= tolerance])
+        at_end = e >= nlines
+        line = np.where(at_end, e - nlines, e)
+        df = pd.concat([df, pd.DataFrame({'line': line, 'chainage': np.where(at_end, lengths[line], 0.0)})],
+                       ignore_index=True)
+    df = df.sort_values(['line', 'chainage']).reset_index(drop=True)
+    # Remove inlets found both by crossing and at an end
+    dup = (df['line'].diff() == 0) & (df['chainage'].diff().abs() <= tolerance)
+    return(df[~dup].reset_index(drop=True))
+
+def dist2inlet(trans, shoreline, inlets, tID_fld='sort_ID', tolerance=1.0, jump=300, verbose=True):
+    """
+    Measure distance along the oceanside shore from each transect to the nearest inlet.
+    Arcpy-free equivalent of measure_Dist2Inlet(); see that function for the method.
+
+    The inlets are located once as chainage along each shoreline line
+    (inlet_chainage()). Each transect/shoreline crossing gets a chainage from
+    line_crossings(), and Dist2Inlet is the smallest difference between that
+    chainage and an inlet chainage on the same shoreline line. If the
+    shoreline touches no inlet, Dist2Inlet is NaN. When a transect crosses
+    the shoreline more than once, the smallest distance is used.
+    Prints a warning when consecutive transects differ by more than jump.
+    """
+    inl = inlet_chainage(shoreline, inlets, tolerance)
+    xing = line_crossings(trans, shoreline)
+    if not len(xing):
+        return(pd.DataFrame(columns=['Dist2Inlet'], index=pd.Index([], name=tID_fld), dtype='f8'))
+    # Put every shoreline line on one axis so one searchsorted covers all lines
+    lengths = line_lengths(shoreline)
+    base = np.r_[0, np.cumsum(lengths + 2*jump + 1)][:-1]
+    inl_pos = base[inl['line'].values] + inl['chainage'].values
+    xline = xing['other'].values.astype(np.int64)
+    pos = base[xline] + xing['along_other'].values
+    i = np.searchsorted(inl_pos, pos)
+    dist = np.full(len(pos), np.nan)
+    for j in (i - 1, i):
+        ok = (j >= 0) & (j < len(inl_pos))
+        jj = np.clip(j, 0, max(len(inl_pos) - 1, 0))
+        if len(inl_pos):
+            same = ok & (inl['line'].values[jj] == xline)
+            dist = np.fmin(dist, np.where(same, np.abs(pos - inl_pos[jj]), np.nan))
+    df = (pd.DataFrame({tID_fld: trans.ids[xing['line'].values], 'Dist2Inlet': dist})
+            .groupby(tID_fld)['Dist2Inlet'].min().to_frame())
+    # Alert if there is a large change (> jump) in values between consecutive transects
+    if verbose and len(df) > 1:
+        ids = df.index.values
+        d = df['Dist2Inlet'].values
+        big = (np.diff(ids) == 1) & (np.abs(np.diff(d)) > jump)
+        for k in np.flatnonzero(big):
+            print("CAUTION: Large change in Dist2Inlet values between transects {} ({} m) and {} ({} m).".format(ids[k], d[k], ids[k+1], d[k+1]))
+    return(df)
+
+"""
+Beach width
+"""
+def snap_to_transects(x, y, ends):
+    """Project points onto the transects (element-wise, aligned rows of ends).
+    The transect is treated as the straight line from its start to its end
+    and the position is clamped to the transect, like snapToLine()."""
+    d, t, fx, fy = point_segment_distance(x, y, ends['start_x'].values, ends['start_y'].values,
+                                          ends['end_x'].values, ends['end_y'].values)
+    return(fx, fy)
+
+def beach_width(trans_df, ends, maxDH, MHW, tID_fld='sort_ID', fill=-99999, skip_missing_z=True):
+    """
+    Calculate upper beach width (uBW) and height (uBH) for all transects at once.
+    Arcpy-free equivalent of calc_BeachWidth_fill(); see that function for the method.
+
+    ends is the output of line_ends() for the transects. The DL, DH, and Arm
+    positions are projected onto each transect in bulk and the top-of-beach
+    feature is selected with array masks: DL first, then DH if DH_zmhw <= maxDH,
+    then Arm. With skip_missing_z, a point with a missing Z is not used.
+    Inputs may mark missing values with either NaN or fill; outputs use NaN.
+    """
+    ends = ends.reindex(trans_df.index)
+    def col(name):
+        # Treat fills as missing without rewriting the frame
+        if not name in trans_df.columns:
+            return(np.full(len(trans_df), np.nan))
+        v = pd.to_numeric(trans_df[name], errors='coerce').values.astype('f8')
+        return(np.where(v == fill, np.nan, v))
+    slx, sly = col('SL_x'), col('SL_y')
+    has_sl = ~np.isnan(slx)
+    out = {}
+    ok = {}
+    for f in ['DL', 'DH', 'Arm']:
+        x, y, z = col(f+'_x'), col(f+'_y'), col(f+'_z')
+        # Add (or recalculate) elevation fields adjusted to MHW
+        out[f+'_zmhw'] = z - MHW
+        # Distance from MHW shoreline to the position of the feature along the transect
+        fx, fy = snap_to_transects(x, y, ends)
+        has_xy = has_sl & ~np.isnan(x)
+        out['Dist'+f] = np.where(has_xy, np.hypot(slx - fx, sly - fy), np.nan)
+        ok[f] = has_xy & ~np.isnan(z) if skip_missing_z else has_xy
+    # DH is only eligible if its elevation is available and no higher than maxDH
+    with np.errstate(invalid='ignore'):
+        ok['DH'] = ok['DH'] & ~np.isnan(out['DH_zmhw']) & (out['DH_zmhw'] <= maxDH)
+    conds = [ok['DL'], ok['DH'], ok['Arm']]
+    out['uBW'] = np.select(conds, [out['DistDL'], out['DistDH'], out['DistArm']], np.nan)
+    out['uBH'] = np.select(conds, [out['DL_zmhw'], out['DH_zmhw'], out['Arm_zmhw']], np.nan)
+    ub_feat = np.full(len(trans_df), np.nan, dtype=object)
+    for cond, f in zip(conds[::-1], ['Arm', 'DH', 'DL']):
+        ub_feat[cond] = f
+    out['ub_feat'] = ub_feat
+    bw_df = pd.DataFrame(out, index=trans_df.index,
+                         columns=['DL_zmhw', 'DH_zmhw', 'Arm_zmhw', 'DistDL', 'DistDH', 'DistArm', 'uBW', 'uBH', 'ub_feat'])
+    trans_df = trans_df.drop(bw_df.columns, axis=1, errors='ignore').join(bw_df)
+    return(trans_df)
+
+"""
+Widths
+"""
+def start_in_rings(lines, rings):
+    """Test whether the first vertex of each line is inside the polygon rings (even-odd rule).
+
+    A ray is cast from the start of the line away from the line (backwards
+    along its first segment) to the edge of the rings' extent and the ring
+    crossings are counted, so the cost depends on the edges near the ray.
+    """
+    n = len(lines.ids)
+    inside = np.zeros(n, dtype=bool)
+    if not n or not len(rings.xy):
+        return(inside)
+    xmin, ymin = np.nanmin(rings.xy, axis=0)
+    xmax, ymax = np.nanmax(rings.xy, axis=0)
+    p = lines.xy[lines.offsets[:-1]]
+    q = lines.xy[np.minimum(lines.offsets[:-1] + 1, lines.offsets[1:] - 1)]
+    d = p - q
+    dlen = np.hypot(d[:, 0], d[:, 1])
+    d = np.where(dlen[:, None] > 0, d / np.where(dlen > 0, dlen, 1)[:, None], [1.0, 0.0])
+    in_box = (p[:, 0] >= xmin) & (p[:, 0] <= xmax) & (p[:, 1] >= ymin) & (p[:, 1] <= ymax)
+    # Distance along the ray to leave the extent, plus a margin
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tx = np.where(d[:, 0] > 0, (xmax - p[:, 0]) / d[:, 0], np.where(d[:, 0] < 0, (xmin - p[:, 0]) / d[:, 0], np.inf))
+        ty = np.where(d[:, 1] > 0, (ymax - p[:, 1]) / d[:, 1], np.where(d[:, 1] < 0, (ymin - p[:, 1]) / d[:, 1], np.inf))
+    reach = np.minimum(tx, ty) + 1.0
+    idx = np.flatnonzero(in_box)
+    if not len(idx):
+        return(inside)
+    end = p[idx] + d[idx] * reach[idx, None]
+    rays = Lines(idx, np.column_stack([p[idx], end]).reshape(-1, 2), np.arange(0, 2*len(idx) + 1, 2))
+    xing = line_crossings(rays, rings)
+    counts = np.bincount(xing['line'].values.astype(np.int64), minlength=len(idx))
+    inside[idx] = counts % 2 == 1
+    return(inside)
+
+def island_widths(trans, rings, tID_fld='sort_ID'):
+    """Calculate WidthFull, WidthLand, and WidthPart for all transects.
+    Arcpy-free equivalent of calc_IslandWidths(); see that function for the definitions.
+
+    Each transect is intersected with the boundary polygon rings in one
+    batched pass (line_crossings()). The crossings are sorted along the
+    transect into intervals inside the polygon:
+    - WidthLand is the sum of the interval lengths;
+    - WidthPart is the length of the first interval along the transect;
+    - WidthFull is the distance from the start of the first interval to the end of the last.
+    Transects that do not overlap the polygon are omitted, as with Clip.
+    """
+    cols = ['WidthFull', 'WidthLand', 'WidthPart']
+    xing = line_crossings(trans, rings)
+    lengths = line_lengths(trans)
+    inside0 = start_in_rings(trans, rings)
+    line = xing['line'].values.astype(np.int64)
+    along = xing['along'].values
+    # Number of crossings per line tells whether the line ends inside
+    ncross = np.bincount(line, minlength=len(trans.ids))
+    inside_end = inside0 ^ (ncross % 2 == 1)
+    # Interval bounds: start of line if it starts inside, crossings, end of line if it ends inside
+    s_idx = np.flatnonzero(inside0)
+    e_idx = np.flatnonzero(inside_end)
+    b_line = np.r_[s_idx, line, e_idx]
+    b_pos = np.r_[np.zeros(len(s_idx)), along, lengths[e_idx]]
+    order = np.lexsort((b_pos, b_line))
+    b_line, b_pos = b_line[order], b_pos[order]
+    if not len(b_line):
+        return(pd.DataFrame(columns=cols, index=pd.Index([], name=tID_fld), dtype='f8'))
+    # Bounds alternate entry/exit within each line
+    entry, exit_ = b_pos[0::2], b_pos[1::2]
+    iline = b_line[0::2]
+    width = exit_ - entry
+    keep = width > 0
+    iline, entry, exit_, width = iline[keep], entry[keep], exit_[keep], width[keep]
+    df = pd.DataFrame({tID_fld: trans.ids[iline], 'entry': entry, 'exit': exit_, 'width': width})
+    grp = df.groupby(tID_fld, sort=False)
+    widths_df = pd.DataFrame({'WidthFull': grp['exit'].max() - grp['entry'].min(),
+                              'WidthLand': grp['width'].sum(),
+                              'WidthPart': grp['width'].first()}, columns=cols)
+    widths_df.index.name = tID_fld
+    return(widths_df)
+
+"""
+Corridor filter
+"""
+def lines_near_polygons(lines, rings, distance, cell=None):
+    """Test whether each line is within distance of the polygon rings (i.e. not disjoint from
+    the rings buffered by distance): a line is near if a segment comes within distance of an
+    edge or if it starts inside the rings. Returns a boolean array with one value per line.
+
+    Lines whose bounding box is farther than distance from the extent of the rings are rejected
+    first; the edges are bucketed in a grid index, so the cost depends on the lines near the rings.
+    """
+    n = len(lines.ids)
+    near = np.zeros(n, dtype=bool)
+    if not n or not len(rings.xy):
+        return(near)
+    xmin, ymin, xmax, ymax = line_boxes(lines)
+    rxmin, rymin = np.nanmin(rings.xy, axis=0)
+    rxmax, rymax = np.nanmax(rings.xy, axis=0)
+    idx = np.flatnonzero((xmax >= rxmin - distance) & (xmin <= rxmax + distance) &
+                         (ymax >= rymin - distance) & (ymin <= rymax + distance))
+    if not len(idx):
+        return(near)
+    sub = take_lines(lines, idx)
+    ax, ay, bx, by, line_idx, _ = segment_arrays(sub)
+    cx, cy, dx, dy, _, _ = segment_arrays(rings)
+    if cell is None:
+        cell = max(float(distance), float(np.nanmedian(np.hypot(dx - cx, dy - cy))), 1.0)
+    index = index_segments(cx, cy, dx, dy, cell, pad=distance)
+    seg, edge = query_grid_index(index, ax, ay, bx, by)
+    d = segment_distance(ax[seg], ay[seg], bx[seg], by[seg], cx[edge], cy[edge], dx[edge], dy[edge])
+    sub_near = np.zeros(len(idx), dtype=bool)
+    sub_near[line_idx[seg[d <= distance]]] = True
+    # Lines entirely inside the polygons do not come near an edge
+    rest = np.flatnonzero(~sub_near)
+    if len(rest):
+        sub_near[rest] = start_in_rings(take_lines(sub, rest), rings)
+    near[idx] = sub_near
+    return(near)
+
+"""
+Format conversion
+"""
+def subset_lines(lines, start, stop):
+    """Return Lines with only lines start to stop (positional)."""
+    v0, v1 = lines.offsets[start], lines.offsets[stop]
+    return(Lines(lines.ids[start:stop], lines.xy[v0:v1], lines.offsets[start:stop+1] - v0))
+
+def feature_runs(lines):
+    """Return the positional index of the first line of each feature and the
+    number of lines (parts) in it. Parts of a feature are consecutive lines with the same ID."""
+    ids = lines.ids
+    if not len(ids):
+        return(np.zeros(0, np.int64), np.zeros(0, np.int64))
+    first = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    return(first, np.diff(np.r_[first, len(ids)]))
+
+def _station_counts(lines, step):
+    """Number of stations per feature: len(range(0, int(length), step))."""
+    first, nparts = feature_runs(lines)
+    part_len = line_lengths(lines) if len(lines.ids) else np.zeros(0)
+    feat_len = np.add.reduceat(part_len, first) if len(first) else np.zeros(0)
+    return(np.ceil(np.floor(feat_len) / step).astype(np.int64), first)
+
+def densify_lines(lines, step=5, tID_fld='sort_ID'):
+    """Get points at step intervals along each line (sort_ID, seg_x, seg_y).
+
+    Arcpy-free equivalent of the positionAlongLine() loop in
+    TransectsToPointsDF(). Stations are placed at 0, step, 2*step, ... up to
+    (but not including) the integer length of each feature. For multipart
+    features, distance is measured along the parts in order, skipping the
+    gaps between them. All stations are interpolated from the cumulative
+    segment lengths at once.
+    """
+    step = float(step)
+    if not step > 0:
+        raise ValueError('step must be greater than 0.')
+    nst, first = _station_counts(lines, step)
+    ax, ay, bx, by, line_idx, _ = segment_arrays(lines)
+    seglen = np.hypot(bx - ax, by - ay)
+    # Feature of each segment
+    feat_of_line = np.repeat(np.arange(len(first)), np.diff(np.r_[first, len(lines.ids)]))
+    feat = feat_of_line[line_idx]
+    # Measure along each feature (parts in order, without the gaps)
+    seg_start = group_cumsum(seglen, feat, exclusive=True)
+    seg_end = group_cumsum(seglen, feat)
+    nsegs = np.bincount(feat, minlength=len(first))
+    first_seg = np.cumsum(nsegs) - nsegs
+    nst = np.where(nsegs > 0, nst, 0)
+    # Stations
+    f, k = ragged_arange(nst)
+    pos = k * step
+    # First segment of the feature that ends at or after each station: sort stations
+    # and segment ends together by feature and measure (stations first at ties) and
+    # count the segments before each station
+    kind = np.r_[np.ones(len(seg_end), np.int8), np.zeros(len(pos), np.int8)]
+    order = np.lexsort((kind, np.r_[seg_end, pos], np.r_[feat, f]))
+    nseg_before = np.cumsum(kind[order])
+    is_st = kind[order] == 0
+    s = np.empty(len(pos), np.int64)
+    s[order[is_st] - len(seg_end)] = nseg_before[is_st]
+    s = np.clip(s, first_seg[f], first_seg[f] + nsegs[f] - 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = np.where(seglen[s] > 0, (pos - seg_start[s]) / seglen[s], 0.0)
+    t = np.clip(t, 0, 1)
+    df = pd.DataFrame({tID_fld: lines.ids[first][f],
+                       'seg_x': ax[s] + t * (bx[s] - ax[s]),
+                       'seg_y': ay[s] + t * (by[s] - ay[s])},
+                      columns=[tID_fld, 'seg_x', 'seg_y'])
+    return(df)
+
+def iter_densify_lines(lines, step=5, tID_fld='sort_ID', chunksize=1000000):
+    """Yield densify_lines() output in chunks of whole features with up to
+    about chunksize stations each, for sites with millions of stations."""
+    nst, first = _station_counts(lines, float(step))
+    stops = np.r_[first[1:], len(lines.ids)]
+    block = (np.cumsum(nst) - nst) // chunksize
+    bounds = np.r_[0, np.flatnonzero(np.diff(block)) + 1, len(first)]
+    for b0, b1 in zip(bounds[:-1], bounds[1:]):
+        if b1 > b0:
+            yield(densify_lines(subset_lines(lines, first[b0], stops[b1-1]), step, tID_fld))
@@ -0,0 +1,528 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Raster functions. These functions do not use arcpy.
+Grids are stored as a folder of tiles (.npy or raw binary) with a grid.json
+file of georeferencing metadata, so that the tiles can be memory-mapped and
+only the tiles that are needed are read. Rasters in a geodatabase can be
+exported to this format with functions_warcpy.RasterToGrid().
+Designed to be imported by either prepper.ipynb or extractor.py.
+'''
+import os
+import json
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import core.functions_geom as fgeom
+
+"""
+# Grid storage
+"""
+def grid_meta(x0, y0, cellsize, nrows, ncols, dtype='f4', nodata=None, tile=1024, fmt='npy'):
+    """Metadata for a tiled grid. x0, y0 are the coordinates of the upper left corner."""
+    meta = {'x0': float(x0), 'y0': float(y0), 'cellsize': float(cellsize),
+            'nrows': int(nrows), 'ncols': int(ncols),
+            'tile_rows': int(min(tile, nrows)), 'tile_cols': int(min(tile, ncols)),
+            'dtype': np.dtype(dtype).str, 'nodata': nodata, 'format': fmt}
+    return(meta)
+
+def _tile_path(path, meta, tr, tc):
+    ext = '.npy' if meta.get('format', 'npy') == 'npy' else '.raw'
+    return(os.path.join(path, 'tile_{}_{}{}'.format(tr, tc, ext)))
+
+def tile_shape(meta, tr, tc):
+    """Shape (rows, columns) of tile (tr, tc); tiles in the last row and column may be smaller."""
+    nr = min(meta['tile_rows'], meta['nrows'] - tr*meta['tile_rows'])
+    nc = min(meta['tile_cols'], meta['ncols'] - tc*meta['tile_cols'])
+    return(nr, nc)
+
+def create_grid(path, meta):
+    """Create the folder and metadata file for a tiled grid. Tiles are added with write_tile()."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    with open(os.path.join(path, 'grid.json'), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return(path)
+
+def is_grid(path):
+    """True if path is a tiled grid folder (has grid.json)."""
+    return(os.path.isfile(os.path.join(str(path), 'grid.json')))
+
+def read_grid_meta(path):
+    """Read the metadata of a tiled grid."""
+    with open(os.path.join(path, 'grid.json')) as f:
+        return(json.load(f))
+
+def write_tile(path, meta, tr, tc, arr):
+    """Save tile (tr, tc) of a grid."""
+    arr = np.asarray(arr, dtype=meta['dtype'])
+    if arr.shape != tile_shape(meta, tr, tc):
+        raise ValueError('Tile ({}, {}) should have shape {}, not {}.'.format(tr, tc, tile_shape(meta, tr, tc), arr.shape))
+    if meta.get('format', 'npy') == 'npy':
+        np.save(_tile_path(path, meta, tr, tc), arr)
+    else:
+        arr.tofile(_tile_path(path, meta, tr, tc))
+    return(path)
+
+def read_tile(path, meta, tr, tc):
+    """Memory-map tile (tr, tc) of a grid. Returns None if the tile was not written (all nodata)."""
+    fname = _tile_path(path, meta, tr, tc)
+    if not os.path.exists(fname):
+        return(None)
+    if meta.get('format', 'npy') == 'npy':
+        return(np.load(fname, mmap_mode='r'))
+    return(np.memmap(fname, dtype=meta['dtype'], mode='r', shape=tile_shape(meta, tr, tc)))
+
+def write_grid(path, arr, x0, y0, cellsize, nodata=None, tile=1024, fmt='npy'):
+    """Save a 2D array as a tiled grid."""
+    arr = np.asarray(arr)
+    meta = grid_meta(x0, y0, cellsize, arr.shape[0], arr.shape[1], arr.dtype, nodata, tile, fmt)
+    tmp = create_grid(_tmp_path(path), meta)
+    for tr in range(-(-meta['nrows'] // meta['tile_rows'])):
+        for tc in range(-(-meta['ncols'] // meta['tile_cols'])):
+            r0, c0 = tr*meta['tile_rows'], tc*meta['tile_cols']
+            write_tile(tmp, meta, tr, tc, arr[r0:r0+meta['tile_rows'], c0:c0+meta['tile_cols']])
+    return(_move_grid(tmp, path))
+
+def read_grid(path, meta=None):
+    """Read a whole tiled grid into one array (for small grids and checking)."""
+    if meta is None:
+        meta = read_grid_meta(path)
+    out = np.full((meta['nrows'], meta['ncols']), np.nan, dtype='f8')
+    ntr, ntc = _ntiles(meta)
+    for tr in range(ntr):
+        for tc in range(ntc):
+            t = read_tile(path, meta, tr, tc)
+            if t is not None:
+                r0, c0 = tr*meta['tile_rows'], tc*meta['tile_cols']
+                out[r0:r0+t.shape[0], c0:c0+t.shape[1]] = _mask_nodata(t, meta)
+    return(out)
+
+def _mask_nodata(values, meta):
+    """Return values as float with nodata replaced by NaN."""
+    values = np.asarray(values, dtype='f8')
+    if meta.get('nodata') is not None:
+        values = np.where(values == meta['nodata'], np.nan, values)
+    return(values)
+
+def read_window(path, meta, r0, r1, c0, c1):
+    """Read rows r0:r1 and columns c0:c1 of a grid as floats, assembled from the tiles that overlap.
+    Cells outside the grid or with nodata are NaN, so windows can extend past the edges (e.g. for a halo)."""
+    out = np.full((r1 - r0, c1 - c0), np.nan)
+    tr0, tr1 = max(r0, 0) // meta['tile_rows'], (min(r1, meta['nrows']) - 1) // meta['tile_rows']
+    tc0, tc1 = max(c0, 0) // meta['tile_cols'], (min(c1, meta['ncols']) - 1) // meta['tile_cols']
+    for tr in range(tr0, tr1 + 1):
+        for tc in range(tc0, tc1 + 1):
+            tile = read_tile(path, meta, tr, tc)
+            if tile is None:
+                continue
+            tr_off, tc_off = tr*meta['tile_rows'], tc*meta['tile_cols']
+            # overlap of the tile and the window, in grid coordinates
+            a0, a1 = max(r0, tr_off), min(r1, tr_off + tile.shape[0])
+            b0, b1 = max(c0, tc_off), min(c1, tc_off + tile.shape[1])
+            if a1 > a0 and b1 > b0:
+                out[a0-r0:a1-r0, b0-c0:b1-c0] = _mask_nodata(tile[a0-tr_off:a1-tr_off, b0-tc_off:b1-tc_off], meta)
+    return(out)
+
+"""
+# Raster processing
+"""
+def _ntiles(meta):
+    return(-(-meta['nrows'] // meta['tile_rows']), -(-meta['ncols'] // meta['tile_cols']))
+
+def _tmp_path(path):
+    # Sibling folder where a grid is written before it is moved to path
+    return('{}_tmp{}'.format(os.path.normpath(path), os.getpid()))
+
+def _move_grid(tmp, path):
+    """Move a finished grid from tmp to path (replacing a grid there), so that
+    is_grid(path) is only true for a complete grid."""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return(path)
+
+def _run_tiles(func, jobs, workers=1):
+    """Run func(*job) for each job, optionally across a process pool."""
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(func, *zip(*jobs)))
+    else:
+        for job in jobs:
+            func(*job)
+
+def _aggregate_tile(in_path, out_path, factor, tr, tc):
+    meta = read_grid_meta(in_path)
+    out_meta = read_grid_meta(out_path)
+    nr, nc = tile_shape(out_meta, tr, tc)
+    r0, c0 = tr*out_meta['tile_rows']*factor, tc*out_meta['tile_cols']*factor
+    win = read_window(in_path, meta, r0, r0 + nr*factor, c0, c0 + nc*factor)
+    # Block mean of factor x factor cells with a strided reshape; nodata cells are ignored
+    blocks = win.reshape(nr, factor, nc, factor)
+    valid = ~np.isnan(blocks)
+    n = valid.sum(axis=(1, 3))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(n > 0, np.where(valid, blocks, 0).sum(axis=(1, 3)) / n, np.nan)
+    if n.any():
+        write_tile(out_path, out_meta, tr, tc, mean)
+
+def aggregate_grid(in_path, out_path, factor=5, tile=None, workers=1):
+    """Aggregate a grid to cells factor times larger with the MEAN of the input cells (ignoring nodata).
+    Arcpy-free equivalent of arcpy.sa.Aggregate(grid, factor, 'MEAN') with the extent expanded.
+
+    The input is read and the output written one output tile at a time, so
+    peak memory depends on the tile size rather than the grid size. The output
+    is written to a temporary folder and moved to out_path when complete.
+    Set workers > 1 to process tiles in a process pool.
+    """
+    meta = read_grid_meta(in_path)
+    if tile is None:
+        tile = max(meta['tile_rows'] // factor, 1)
+    out_meta = grid_meta(meta['x0'], meta['y0'], meta['cellsize']*factor,
+                         -(-meta['nrows'] // factor), -(-meta['ncols'] // factor),
+                         'f4', None, tile, meta.get('format', 'npy'))
+    tmp = create_grid(_tmp_path(out_path), out_meta)
+    ntr, ntc = _ntiles(out_meta)
+    _run_tiles(_aggregate_tile, [(in_path, tmp, factor, tr, tc) for tr in range(ntr) for tc in range(ntc)], workers)
+    return(_move_grid(tmp, out_path))
+
+def horn_slope(win, cellsize, z_factor=1.0):
+    """Slope (PERCENT_RISE) of the interior of win with Horn's method.
+    win includes a one-cell halo; NaN neighbors take the value of the center cell."""
+    e = win[1:-1, 1:-1]
+    def nb(dr, dc):
+        v = win[1+dr:win.shape[0]-1+dr, 1+dc:win.shape[1]-1+dc]
+        return(np.where(np.isnan(v), e, v))
+    a, b, c = nb(-1, -1), nb(-1, 0), nb(-1, 1)
+    d, f = nb(0, -1), nb(0, 1)
+    g, h, i = nb(1, -1), nb(1, 0), nb(1, 1)
+    dzdx = ((c + 2*f + i) - (a + 2*d + g)) / (8.0 * cellsize)
+    dzdy = ((g + 2*h + i) - (a + 2*b + c)) / (8.0 * cellsize)
+    return(np.hypot(dzdx, dzdy) * z_factor * 100.0)
+
+def _slope_tile(in_path, out_path, z_factor, tr, tc):
+    meta = read_grid_meta(in_path)
+    nr, nc = tile_shape(meta, tr, tc)
+    r0, c0 = tr*meta['tile_rows'], tc*meta['tile_cols']
+    win = read_window(in_path, meta, r0 - 1, r0 + nr + 1, c0 - 1, c0 + nc + 1)
+    if np.isnan(win[1:-1, 1:-1]).all():
+        return
+    out_meta = read_grid_meta(out_path)
+    write_tile(out_path, out_meta, tr, tc, horn_slope(win, meta['cellsize'], z_factor))
+
+def slope_grid(in_path, out_path, z_factor=1.0, workers=1):
+    """Calculate slope (PERCENT_RISE) of a grid with Horn's method.
+    Arcpy-free equivalent of arcpy.Slope_3d(grid, out, 'PERCENT_RISE').
+
+    Each output tile is computed from the matching input tile plus a
+    one-cell halo, so peak memory depends on the tile size. The output is
+    written to a temporary folder and moved to out_path when complete.
+    Set workers > 1 to process tiles in a process pool.
+    """
+    meta = read_grid_meta(in_path)
+    out_meta = dict(meta, dtype=np.dtype('f4').str, nodata=None)
+    tmp = create_grid(_tmp_path(out_path), out_meta)
+    ntr, ntc = _ntiles(meta)
+    _run_tiles(_slope_tile, [(in_path, tmp, z_factor, tr, tc) for tr in range(ntr) for tc in range(ntc)], workers)
+    return(_move_grid(tmp, out_path))
+
+"""
+# Point sampling
+"""
+def _georef(meta):
+    return((meta['x0'], meta['y0'], meta['cellsize'], meta['nrows'], meta['ncols']))
+
+def gather_cells(path, meta, rows, cols):
+    """Get the values at the given cell rows and columns as floats (NaN for nodata or outside the grid).
+    Values are gathered tile by tile, so only the tiles that contain cells are read."""
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    out = np.full(len(rows), np.nan)
+    ok = (rows >= 0) & (rows < meta['nrows']) & (cols >= 0) & (cols < meta['ncols'])
+    idx = np.flatnonzero(ok)
+    if not len(idx):
+        return(out)
+    tr = rows[idx] // meta['tile_rows']
+    tc = cols[idx] // meta['tile_cols']
+    ntc = -(-meta['ncols'] // meta['tile_cols'])
+    tkey = tr * ntc + tc
+    order = np.argsort(tkey, kind='stable')
+    idx, tkey = idx[order], tkey[order]
+    starts = np.flatnonzero(np.r_[True, tkey[1:] != tkey[:-1]])
+    for s0, s1 in zip(starts, np.r_[starts[1:], len(idx)]):
+        k = tkey[s0]
+        tile = read_tile(path, meta, k // ntc, k % ntc)
+        if tile is None:
+            continue
+        sel = idx[s0:s1]
+        vals = tile[rows[sel] - (k // ntc)*meta['tile_rows'], cols[sel] - (k % ntc)*meta['tile_cols']]
+        out[sel] = _mask_nodata(vals, meta)
+    return(out)
+
+def cell_index(meta, x, y, method='nearest'):
+    """Cell rows and columns (and weights for bilinear) of points.
+
+    nearest: the cell that contains the point.
+    bilinear: the four cell centers around the point, as (rows, cols, weights)
+    arrays with shape (4, n).
+    """
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    fc = (x - meta['x0']) / meta['cellsize']
+    fr = (meta['y0'] - y) / meta['cellsize']
+    if method == 'nearest':
+        good = np.isfinite(fc) & np.isfinite(fr)
+        rows = np.where(good, np.floor(np.where(good, fr, 0)), -1).astype(np.int64)
+        cols = np.where(good, np.floor(np.where(good, fc, 0)), -1).astype(np.int64)
+        return(rows[None, :], cols[None, :], np.ones((1, len(x))))
+    elif method == 'bilinear':
+        fc = fc - 0.5
+        fr = fr - 0.5
+        good = np.isfinite(fc) & np.isfinite(fr)
+        c0 = np.where(good, np.floor(np.where(good, fc, 0)), -2).astype(np.int64)
+        r0 = np.where(good, np.floor(np.where(good, fr, 0)), -2).astype(np.int64)
+        wc = np.where(good, fc - c0, 0)
+        wr = np.where(good, fr - r0, 0)
+        rows = np.stack([r0, r0, r0 + 1, r0 + 1])
+        cols = np.stack([c0, c0 + 1, c0, c0 + 1])
+        weights = np.stack([(1-wr)*(1-wc), (1-wr)*wc, wr*(1-wc), wr*wc])
+        return(rows, cols, weights)
+    else:
+        raise ValueError("method must be 'nearest' or 'bilinear', not '{}'.".format(method))
+
+def sample_grids(grids, x, y, method='nearest'):
+    """Sample several tiled grids at points (e.g. seg_x, seg_y of the transect points).
+
+    grids is a dict of {output column: grid path} or {output column: (grid path, method)}.
+    The cell index of every point is computed once for each distinct
+    georeference, so aligned grids (e.g. DEM and slope) share it. For
+    bilinear, corners with nodata are left out and the weights of the
+    others are rescaled. Returns a DataFrame with one column per grid.
+    """
+    x = np.asarray(x, dtype='f8')
+    y = np.asarray(y, dtype='f8')
+    cache = {}
+    out = {}
+    for name, spec in grids.items():
+        path, m = (spec if isinstance(spec, (tuple, list)) else (spec, method))
+        meta = read_grid_meta(path)
+        key = (_georef(meta), m)
+        if not key in cache:
+            cache[key] = cell_index(meta, x, y, m)
+        rows, cols, weights = cache[key]
+        vals = gather_cells(path, meta, rows.ravel(), cols.ravel()).reshape(rows.shape)
+        if m == 'nearest':
+            out[name] = vals[0]
+        else:
+            valid = ~np.isnan(vals)
+            wsum = np.where(valid, weights, 0).sum(axis=0)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[name] = np.where(wsum > 0, np.nansum(vals * weights, axis=0) / wsum, np.nan)
+    return(pd.DataFrame(out, columns=list(grids.keys())))
+
+def extract_values_to_pts(pts_df, grids, method='nearest', xy=['seg_x', 'seg_y']):
+    """Add values from tiled grids to the points dataframe.
+    Arcpy-free equivalent of ExtractMultiValuesToPoints; e.g. grids={'ptZ': dem_dir, 'ptSlp': slope_dir}."""
+    vals = sample_grids(grids, pts_df[xy[0]].values, pts_df[xy[1]].values, method)
+    vals.index = pts_df.index
+    pts_df = pts_df.drop(vals.columns, axis=1, errors='ignore').join(vals)
+    return(pts_df)
+
+"""
+# Contours
+"""
+# Corners of a marching-squares cell: top left, top right, bottom right, bottom left.
+# Positions are (x, y) with y up; the case index adds 8, 4, 2, 1 for corners above the threshold.
+_CORNERS = np.array([[0, 0], [1, 0], [1, -1], [0, -1]], dtype='f8')
+# Edges: top, right, bottom, left, as pairs of corners
+_EDGES = [(0, 1), (1, 2), (3, 2), (0, 3)]
+
+def _case_table():
+    """Oriented segments (start edge, end edge) for each of the 16 cases, with land on the left.
+    Saddle cases (5, 10) get two sets: [0] when the cell center is water, [1] when it is land."""
+    mid = np.array([_CORNERS[list(e)].mean(axis=0) for e in _EDGES])
+    def orient(p, q, corner, land):
+        d = mid[q] - mid[p]
+        k = _CORNERS[corner] - mid[p]
+        left = d[0]*k[1] - d[1]*k[0] > 0
+        return((p, q) if left == land else (q, p))
+    # edges adjacent to each corner
+    adj = {0: (0, 3), 1: (0, 1), 2: (1, 2), 3: (2, 3)}
+    table = {}
+    for case in range(16):
+        land = [bool(case & b) for b in (8, 4, 2, 1)]
+        n = sum(land)
+        segs = [[], []]
+        if n in (1, 3):
+            # one corner differs from the others; cut it off
+            k = land.index(True) if n == 1 else land.index(False)
+            segs = [[orient(adj[k][0], adj[k][1], k, land[k])]] * 2
+        elif n == 2 and case not in (5, 10):
+            # two adjacent land corners; the segment runs between the other two edges
+            k = land.index(True)
+            crossed = [e for e in range(4) if land[_EDGES[e][0]] != land[_EDGES[e][1]]]
+            segs = [[orient(crossed[0], crossed[1], k, True)]] * 2
+        elif case in (5, 10):
+            lands = [k for k in range(4) if land[k]]
+            waters = [k for k in range(4) if not land[k]]
+            segs = [[orient(adj[k][0], adj[k][1], k, True) for k in lands],
+                    [orient(adj[k][0], adj[k][1], k, False) for k in waters]]
+        table[case] = segs
+    return(table)
+_CASES = _case_table()
+
+def _ring_areas(xy, offsets):
+    """Signed area of closed rings (positive counterclockwise)."""
+    x, y = xy[:, 0], xy[:, 1]
+    cross = x[:-1]*y[1:] - x[1:]*y[:-1]
+    seg_ring = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))[:-1]
+    keep = np.ones(len(cross), bool)
+    keep[offsets[1:-1] - 1] = False  # pairs spanning two rings
+    return(0.5*np.bincount(seg_ring[keep], weights=cross[keep], minlength=len(offsets) - 1))
+
+def _trace_rings(bits, vals, thr, center_land):
+    """Chain the marching-squares segments of one threshold into rings.
+    Returns ring vertices in padded (x=col, y=row) grid units and offsets."""
+    H, W = vals.shape
+    case = (bits[:-1, :-1]*8 + bits[:-1, 1:]*4 + bits[1:, 1:]*2 + bits[1:, :-1]*1).astype(np.int64)
+    starts, ends = [], []
+    for c in range(1, 15):
+        rr, cc = np.nonzero(case == c)
+        if not len(rr):
+            continue
+        for sel, segs in ((center_land[rr, cc] == False, _CASES[c][0]), (center_land[rr, cc] == True, _CASES[c][1])):
+            r, k = rr[sel], cc[sel]
+            for p, q in segs:
+                starts.append(_edge_id(r, k, p, W))
+                ends.append(_edge_id(r, k, q, W))
+    if not len(starts):
+        return(np.zeros((0, 2)), np.zeros(1, np.int64))
+    s = np.concatenate(starts)
+    e = np.concatenate(ends)
+    n = len(s)
+    order = np.argsort(s)
+    nxt = order[np.searchsorted(s[order], e)]
+    # Label each cycle with its smallest segment index (pointer jumping)
+    label = np.arange(n)
+    ptr = nxt.copy()
+    for _ in range(int(np.ceil(np.log2(n))) + 1):
+        label = np.minimum(label, label[ptr])
+        ptr = ptr[ptr]
+    # Rank segments along each cycle from its root
+    root = label == np.arange(n)
+    steps = np.where(root, 0, 1)
+    ptr = np.where(root, np.arange(n), nxt)
+    for _ in range(int(np.ceil(np.log2(n))) + 1):
+        steps = steps + steps[ptr]
+        ptr = ptr[ptr]
+    size = np.bincount(label, minlength=n)[label]
+    rank = (size - steps) % size
+    order = np.lexsort((rank, label))
+    pts = _edge_point(s[order], vals, thr, W)
+    # Close each ring by repeating its first vertex
+    first = np.flatnonzero(np.r_[True, label[order][1:] != label[order][:-1]])
+    counts = np.diff(np.r_[first, n])
+    ring, pos = fgeom.ragged_arange(counts + 1)
+    src = np.where(pos < counts[ring], first[ring] + pos, first[ring])
+    return(pts[src], np.r_[0, np.cumsum(counts + 1)])
+
+def _edge_id(r, c, edge, W):
+    """Unique ID of an edge between two cell centers: even for horizontal, odd for vertical."""
+    if edge == 0:   # top
+        return(2*(r*W + c))
+    elif edge == 2: # bottom
+        return(2*((r + 1)*W + c))
+    elif edge == 3: # left
+        return(2*(r*W + c) + 1)
+    else:           # right
+        return(2*(r*W + c + 1) + 1)
+
+def _edge_point(eid, vals, thr, W):
+    """Position of the threshold crossing on each edge, interpolated between the cell centers."""
+    cell = eid // 2
+    r, c = cell // W, cell % W
+    vert = eid % 2 == 1
+    r2 = np.where(vert, r + 1, r)
+    c2 = np.where(vert, c, c + 1)
+    v1, v2 = vals[r, c], vals[r2, c2]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = (thr - v1) / (v2 - v1)
+    t = np.where(np.isfinite(t), np.clip(t, 0, 1), 0.5)
+    return(np.column_stack([np.where(vert, c, c + t), np.where(vert, r + t, r)]))
+
+def contour_polygons(arr, x0, y0, cellsize, thresholds, min_area=300, min_hole_sz=300, nodata=None):
+    """Trace the outlines of land above each threshold from a DEM array (marching squares).
+
+    Arcpy-free equivalent of RasterToLandPerimeter(): the case index of
+    every cell is computed for all thresholds at once (e.g. MTL and MHW), so
+    the grid is swept once. Cells with nodata count as water. The isolines
+    are interpolated between cell centers and chained into closed rings.
+    Rings of land smaller than min_area are dropped and holes smaller than
+    min_hole_sz are filled (square map units). The aggregation distance of
+    AggregatePolygons is not applied.
+
+    Returns {threshold: functions_geom.Lines}, where the ID of each ring is
+    its polygon number and each polygon's outer ring comes before its holes.
+    """
+    thresholds = list(np.atleast_1d(thresholds))
+    vals = np.asarray(arr, dtype='f8')
+    if nodata is not None:
+        vals = np.where(vals == nodata, np.nan, vals)
+    # Pad with water so that every contour closes
+    vals = np.pad(vals, 1, constant_values=np.nan)
+    thr = np.asarray(thresholds, dtype='f8')[:, None, None]
+    with np.errstate(invalid='ignore'):
+        bits = (vals[None] > thr).astype(np.int8)
+        center = (vals[None, :-1, :-1] + vals[None, :-1, 1:] + vals[None, 1:, 1:] + vals[None, 1:, :-1]) / 4.0
+        center_land = np.where(np.isnan(center), False, center > thr)
+    out = {}
+    for k, t in enumerate(thresholds):
+        pts, offsets = _trace_rings(bits[k], vals, float(t), center_land[k])
+        # Grid units (with padding) to map coordinates
+        xy = np.column_stack([x0 + (pts[:, 0] - 0.5)*cellsize, y0 - (pts[:, 1] - 0.5)*cellsize])
+        out[t] = _assemble_polygons(xy, offsets, min_area, min_hole_sz)
+    return(out)
+
+def _assemble_polygons(xy, offsets, min_area, min_hole_sz):
+    """Filter rings by size and group holes with the smallest outer ring that contains them."""
+    nrings = len(offsets) - 1
+    if not nrings:
+        return(fgeom.make_lines([], np.zeros((0, 2)), [0]))
+    area = _ring_areas(xy, offsets)
+    outer = np.flatnonzero(area >= min_area)
+    holes = np.flatnonzero((area < 0) & (-area >= min_hole_sz))
+    owner = np.full(nrings, -1)
+    owner[outer] = outer
+    if len(holes) and len(outer):
+        rings = fgeom.Lines(outer, *_subset(xy, offsets, outer))
+        # Cast a ray in +x from the first vertex of each hole and count crossings with each outer ring
+        p = xy[offsets[holes]]
+        xmax = xy[:, 0].max() + 1.0
+        rays = fgeom.Lines(np.arange(len(holes)), np.column_stack([p, np.column_stack([np.full(len(p), xmax), p[:, 1]])]).reshape(-1, 2),
+                           np.arange(0, 2*len(holes) + 1, 2))
+        xing = fgeom.line_crossings(rays, rings)
+        cnt = xing.groupby(['line', 'other']).size()
+        inside = cnt[cnt % 2 == 1].reset_index()
+        if len(inside):
+            inside['outer'] = outer[inside['other'].values]
+            inside['area'] = area[inside['outer'].values]
+            best = inside.sort_values('area').drop_duplicates('line')
+            owner[holes[best['line'].values]] = best['outer'].values
+    keep = np.flatnonzero(owner >= 0)
+    # Polygon number in order of the outer rings; outer ring first, then its holes
+    poly = np.searchsorted(outer, owner[keep])
+    order = np.lexsort((keep, ~np.isin(keep, outer), poly))
+    keep, poly = keep[order], poly[order]
+    sub_xy, sub_off = _subset(xy, offsets, keep)
+    return(fgeom.make_lines(poly, sub_xy, sub_off))
+
+def _subset(xy, offsets, rings):
+    """Vertices and offsets of the selected rings."""
+    counts = offsets[rings + 1] - offsets[rings]
+    ring, pos = fgeom.ragged_arange(counts)
+    return(xy[offsets[rings][ring] + pos], np.r_[0, np.cumsum(counts)])
@@ -10,6 +10,7 @@ Designed to be imported by either prepper.ipynb or extractor.py.
 '''
 import time
 import os
+import shutil
 import collections
 import pandas as pd
 import numpy as np
@@ -17,6 +18,11 @@ from operator import add
 import sys
 import arcpy
 import core.functions as fun
+import core.functions_geom as fgeom
+import core.functions_raster as frst
+import core.partition as part
+import core.tracing as tracing
+from core.columns import Columns
 
 """
 # General use functions
@@ -333,42 +339,52 @@ def ProcessDEM(elevGrid: str, utmSR) -> str:
     print('OUTPUT: {} at 5x5 resolution.'.format(os.path.basename(elevGrid+'_5m')))
     return(elevGrid+'_5m')
 
+def ProcessDEMGrid(elevGrid, utmSR, out_dir, workers=1):
+    """Tiled 5 m grid (functions_raster) of the DEM in utmSR, the grid equivalent of ProcessDEM.
+    A DEM that is not in utmSR, or whose cell size does not divide 5 m, is first projected
+    to 1 m cells (ProjectRaster, as in ProcessDEM). The DEM is exported to the grid 'elev'
+    in out_dir and aggregated to 'elev_5m' with functions_raster.aggregate_grid() (MEAN)
+    by the cell size in the grid metadata. Existing grids are reused."""
+    grid5 = os.path.join(out_dir, 'elev_5m')
+    if frst.is_grid(grid5):
+        return(grid5)
+    dsc = arcpy.Describe(elevGrid)
+    factor = 5.0 / float(dsc.meanCellWidth)
+    src = elevGrid
+    if dsc.spatialReference.name != utmSR.name or abs(factor - round(factor)) > 1e-6:
+        src = elevGrid+'_projected'
+        if not arcpy.Exists(src):
+            arcpy.ProjectRaster_management(elevGrid, src, utmSR, cell_size="1")
+    elev = RasterToGrid(src, os.path.join(out_dir, 'elev'), verbose=False, overwrite=False)
+    factor = 5.0 / frst.read_grid_meta(elev)['cellsize']
+    if abs(factor - round(factor)) > 1e-6 or round(factor) < 1:
+        raise ValueError("Cell size of {} ({} m) does not aggregate evenly to 5 m.".format(src, 5.0 / factor))
+    frst.aggregate_grid(elev, grid5, int(round(factor)), workers=workers)
+    print('OUTPUT: {} at 5x5 resolution.'.format(grid5))
+    return(grid5)
+
 def RemoveTransectsOutsideBounds(trans: str, barrierBoundary: str, distance: int =200) -> str:
-    """Delete transects not within distance (default: 200 m) of the study area."""
-    for row in arcpy.da.SearchCursor(barrierBoundary, ['SHAPE@']):
-        geom = row[0]
-        with arcpy.da.UpdateCursor(trans, ['SHAPE@']) as cursor:
-            for trow in cursor:
-                tran = trow[0]
-                if tran.disjoint(geom.buffer(distance)):
+    """Delete transects not within distance (default: 200 m) of the study area.
+    Transects are tested against the boundary edges with a grid index
+    (functions_geom.lines_near_polygons()) and deleted in one cursor pass."""
+    sr = arcpy.Describe(trans).spatialReference
+    lines = FCtoLines(trans, 'OID@')
+    near = fgeom.lines_near_polygons(lines, FCtoLines(barrierBoundary, 'OID@', sr), distance)
+    # A multipart transect is kept if any part is near
+    far = set(lines.ids.tolist()) - set(lines.ids[near].tolist())
+    if far:
+        with arcpy.da.UpdateCursor(trans, ['OID@']) as cursor:
+            for row in cursor:
+                if row[0] in far:
                     cursor.deleteRow()
     return(trans)
 
-def ExtendLine(fc: str, new_fc: str, distance: int, proj_code: int=26918, verbose: bool=True) -> str:
-    """Extend all lines in FC by specified distance. Save in new FC."""
-    # From GIS stack exchange http://gis.stackexchange.com/questions/71645/a-tool-or-way-to-extend-line-by-specified-distance
-    # layer must have map projection
-    def accumulate(iterable):
-        # accumulate([1,2,3,4,5]) --> 1 3 6 10 15
-        # (Equivalent to itertools.accumulate() - isn't in Python 2.7)
-        it = iter(iterable)
-        total = next(it) # initialize with the first value
-        yield total
-        for element in it:
-            total = add(total, element)
-            yield total
-    def newcoord_rev(coords, dist):
-        # From: gis.stackexchange.com/questions/71645/extending-line-by-specified-distance-in-arcgis-for-desktop
-        # Computes new coordinates x0,y0 at a specified distance along the
-        # prolongation of the line from x2,y2 to x1,y1
-        (x1,y1),(x2,y2) = coords
-        dx = x2 - x1 # change in x
-        dy = y2 - y1 # change in y
-        linelen = np.hypot(dx, dy) # distance between xy1 and xy2
-        x0 = x1 - dx/linelen * dist
-        y0 = y1 - dy/linelen * dist
-        return(x0, y0)
-
+def ExtendLine(fc: str, new_fc: str, distance, proj_code: int=26918, verbose: bool=True, end: str=None) -> str:
+    """Extend all lines in FC by specified distance. Save in new FC.
+    By default, a positive distance extends the end of each line and a negative distance extends
+    the start by abs(distance); set end to 'start', 'end', or 'both' to choose. distance can also be an
+    array (one value per feature, in OID order) or a pandas Series indexed by OID, in which case the sign
+    is applied to each feature. The extension is done by functions_geom.extend_lines()."""
     # Project transects to UTM
     if len(os.path.split(new_fc)) > 1:
         fcpath, fcbase = os.path.split(new_fc)
@@ -379,58 +395,42 @@ def ExtendLine(fc: str, new_fc: str, distance: int, proj_code: int=26918, verbos
     else:
         print('{} is already projected in UTM.'.format(os.path.basename(fc)))
         arcpy.FeatureClassToFeatureClass_conversion(fc, fcpath, fcbase)
-
-    #OID is needed to determine how to break up flat list of data by feature.
-    coordinates = [[row[0], row[1]] for row in
-                   arcpy.da.SearchCursor(fc, ["OID@", "SHAPE@XY"],
-                   explode_to_points=True)]
-    oid, vert = zip(*coordinates)
-    # Construct list of numbers that mark the start of a new feature class by
-    # counting OIDs and accumulating the values.
-    vertcounts = list(accumulate(collections.Counter(oid).values()))
-
-    if distance >= 0:
-        # Grab the last two vertices of each feature
-        lastpoint = [point for x,point in enumerate(vert) if x+1 in vertcounts or x+2 in vertcounts]
-        # Obtain list of tuples of new end coordinates by converting flat list of
-        # tuples to list of lists of tuples.
-        newvert = [fun.newcoord(y, float(distance)) for y in zip(*[iter(lastpoint)]*2)]
-        j = 0
-        with arcpy.da.UpdateCursor(new_fc, "SHAPE@XY", explode_to_points=True) as cursor:
-            for i, row in enumerate(cursor):
-                if i+1 in vertcounts:
-                    row[0] = newvert[j]
-                    j+=1
-                    cursor.updateRow(row) #FIXME: If the FC was projected as part of the function, returns RuntimeError: "The spatial index grid size is invalid."
+    # Read the (projected) vertices by OID, extend them all at once, and replace the shapes
+    lines = FCtoLines(new_fc, 'OID@')
+    if end is None:
+        # The sign of each feature's distance chooses the end to extend
+        first, _ = fgeom.feature_runs(lines)
+        if isinstance(distance, pd.Series):
+            distance = distance.reindex(lines.ids[first]).fillna(0).values
+        dist = np.broadcast_to(np.asarray(distance, dtype='f8'), first.shape)
+        lines = fgeom.extend_lines(lines, np.where(dist >= 0, dist, 0), 'end')
+        lines = fgeom.extend_lines(lines, np.where(dist < 0, -dist, 0), 'start')
     else:
-        # Grab the first two vertices of each feature (they will either be listed in vertcounts or one ahead of one in vertcounts)
-        firstpoint = [point for x, point in enumerate(vert) if x in vertcounts or x-1 in vertcounts]
-        # Obtain list of tuples of new end coordinates by converting flat list of
-        # tuples to list of lists of tuples.
-        newvert = [newcoord_rev(y, -float(distance)) for y in zip(*[iter(firstpoint)]*2)]
-        j = 0
-        with arcpy.da.UpdateCursor(new_fc, "SHAPE@XY", explode_to_points=True) as cursor:
-            for i, row in enumerate(cursor):
-                if i in vertcounts:
-                    row[0] = newvert[j]
-                    j+=1
-                    cursor.updateRow(row) #FIXME: If the FC was projected as part of the function, returns RuntimeError: "The spatial index grid size is invalid."
+        lines = fgeom.extend_lines(lines, distance, end)
+    UpdateLineShapes(new_fc, lines)
     if verbose:
         print("Transects extended.")
     return(new_fc)
 
-def RemoveDuplicates(trans_presort, orig_xtnd, verbose=True):
-    """Remove each feature from trans_presort that is an exact
-    duplicate geometry of a feature in orig_xtnd."""
+def RemoveDuplicates(trans_presort, orig_xtnd, verbose=True, tolerance=0.001):
+    """Remove each feature from trans_presort that is a duplicate geometry (within tolerance,
+    in either direction) of a feature in orig_xtnd. Duplicates are found by hashing the rounded
+    vertices of each line (functions_geom.duplicate_lines()) and deleted in one cursor pass."""
     # 2. Remove orig transects from manually created transects
     # If any of the original extended transects (with null values) are still present in trans_presort, delete them.
-    for row in arcpy.da.SearchCursor(orig_xtnd, ['SHAPE@']):
-        oldline = row[0]
-        with arcpy.da.UpdateCursor(trans_presort, ['SHAPE@']) as cursor:
-            for trow in cursor:
-                tran = trow[0]
-                if tran.equals(oldline):
+    sr = arcpy.Describe(trans_presort).spatialReference
+    pairs = fgeom.duplicate_lines(FCtoLines(trans_presort, 'OID@'), FCtoLines(orig_xtnd, 'OID@', sr), tolerance)
+    pairs.columns = ['presort_OID', 'orig_OID']
+    dups = set(pairs['presort_OID'].tolist())
+    if dups:
+        with arcpy.da.UpdateCursor(trans_presort, ['OID@']) as cursor:
+            for row in cursor:
+                if row[0] in dups:
                     cursor.deleteRow()
+    if verbose:
+        print("Removed {} features of {} that duplicate features of {}.".format(len(dups), os.path.basename(trans_presort), os.path.basename(orig_xtnd)))
+        if len(pairs):
+            print(pairs.to_string(index=False))
     arcpy.FeatureClassToFeatureClass_conversion(trans_presort, arcpy.env.scratchGDB, trans_presort+'_preAppend')
     # 3. Append original extended transects (with values) to the new transects
     arcpy.Append_management(orig_xtnd, trans_presort)
@@ -534,6 +534,41 @@ def SortTransectsFromSortLines(in_trans, out_trans, sort_lines_or_corner='LL', t
             cursor.updateRow([row[0], row[0]])
     return(out_trans)
 
+def SortTransectsByChainage(in_trans, sort_lines, tID_fld='sort_ID', reverse=False, start=1, verbose=True):
+    """Assign tID_fld in place by the chainage of each transect along sort_lines (sort lines or a shoreline),
+    an alternative to SortTransectsFromSortLines that creates no scratch feature classes.
+    If sort_lines has the fields 'sort' and 'reverse' (see SortTransectPrep), the lines are used in the
+    order of 'sort' and reversed where 'reverse' is 'T'; otherwise reverse applies to every line.
+    Transects that do not cross sort_lines get a null tID_fld."""
+    sr = arcpy.Describe(in_trans).spatialReference
+    ref = FCtoLines(sort_lines, 'OID@', sr)
+    fnames = [f.name for f in arcpy.ListFields(sort_lines)]
+    if 'sort' in fnames and 'reverse' in fnames:
+        rows = {oid: (srt, rev) for oid, srt, rev in arcpy.da.SearchCursor(sort_lines, ['OID@', 'sort', 'reverse'])}
+        nulls = [oid for oid, (srt, _) in rows.items() if srt is None]
+        if nulls:
+            raise ValueError("Sort lines {} of {} have no 'sort' value.".format(nulls, os.path.basename(sort_lines)))
+        # Put the sort line features in the order of 'sort' (stable, so parts stay in order)
+        ref = fgeom.take_lines(ref, np.argsort([rows[oid][0] for oid in ref.ids], kind='stable'))
+        reverse = {oid: rev == 'T' for oid, (_, rev) in rows.items()}
+    order = fgeom.chainage_order(FCtoLines(in_trans, 'OID@'), ref, reverse, start)
+    sort_ids = dict(zip(order.index.tolist(), order['sort_ID'].tolist()))
+    # LONG, as a SHORT field overflows above 32767 transects
+    AddNewFields(in_trans, [tID_fld], fieldtype="LONG", verbose=verbose)
+    ftype = [f.type for f in arcpy.ListFields(in_trans, tID_fld)][0]
+    if ftype == 'SmallInteger' and len(order) and order['sort_ID'].max() > 32767:
+        raise ValueError("{} is a SHORT field and cannot hold {} transects; delete it or use another tID_fld.".format(tID_fld, order['sort_ID'].max()))
+    nnull = 0
+    with arcpy.da.UpdateCursor(in_trans, ['OID@', tID_fld]) as cursor:
+        for row in cursor:
+            nnull += not row[0] in sort_ids
+            cursor.updateRow([row[0], sort_ids.get(row[0])])
+    if verbose:
+        print("Assigned {} to {} transects along {}.".format(tID_fld, len(sort_ids), os.path.basename(sort_lines)))
+        if nnull:
+            print("{} transects do not cross the sort lines and have a null {}.".format(nnull, tID_fld))
+    return(in_trans)
+
 def SortTransectsByFeature(in_fc, new_ct, sort_lines=[], sortrow=[0, 'LL'], sortfield='sort_ID'):
     """Sort transects by one of the lines in sort_lines."""
     out_fc = 'trans_sort{}_temp'.format(new_ct)
@@ -628,13 +663,13 @@ def RasterToLandPerimeter(in_raster, out_polygon, threshold,
     print('Aggregation distance: {}\nMinimum area: {}\nMinimum hole size: {}'.format(agg_dist, min_area, min_hole_sz))
     return(out_polygon)
 
+@tracing.traced('shoreline_polygon')
 def CombineShorelinePolygons(bndMTL: str, bndMHW: str, inletLines: str,
     ShorelinePts: str, bndpoly: str, SA_bounds: str='', verbose: bool=True):
     """
     Use MTL and MHW contour polygons to create shoreline polygon.
     'Shoreline' = MHW on oceanside and MTL on bayside
     """
-    start = time.clock()
     # Inlet lines must intersect the MHW polygon
     symdiff = os.path.join(arcpy.env.scratchGDB, 'shore_1symdiff')
     split = os.path.join(arcpy.env.scratchGDB, 'shore_2split')
@@ -663,16 +698,40 @@ def CombineShorelinePolygons(bndMTL: str, bndMHW: str, inletLines: str,
     print('''User input required! Select extra features in {} for deletion.\nRecommended technique: select the polygon/s to keep and then Switch Selection.\n'''.format(os.path.basename(bndpoly)))
     return(bndpoly)
 
-def DEMtoFullShorelinePoly(elevGrid, MTL, MHW, inletLines, ShorelinePts, SA_bounds='', suffix=''):
+def GridToLandPerimeters(elev_grid, out_polygons, thresholds, spatial_ref, min_area=300, min_hole_sz=300):
+    """
+    Tiled grid (functions_raster) => polygons of land above each threshold.
+    Alternative to RasterToLandPerimeter that traces the contours for all thresholds
+    in one sweep of the DEM (functions_raster.contour_polygons()). out_polygons
+    and thresholds are lists of the same length, e.g. ['bndpoly_mtl', 'bndpoly_mhw'] and [MTL, MHW].
+    """
+    meta = frst.read_grid_meta(elev_grid)
+    arr = frst.read_grid(elev_grid, meta)
+    contours = frst.contour_polygons(arr, meta['x0'], meta['y0'], meta['cellsize'], thresholds, min_area, min_hole_sz)
+    for out_polygon, threshold in zip(out_polygons, thresholds):
+        LinesToFC(contours[threshold], out_polygon, spatial_ref, 'POLYGON')
+    print('Minimum area: {}\nMinimum hole size: {}'.format(min_area, min_hole_sz))
+    return(out_polygons)
+
+def DEMtoFullShorelinePoly(elevGrid, MTL, MHW, inletLines, ShorelinePts, SA_bounds='', suffix='', use_grid=True):
     """Delinate the full shoreline polygon from the DEM.
-    Creates the MTL and MHW contour polygons and then combines them."""
+    Creates the MTL and MHW contour polygons and then combines them.
+    With use_grid, the DEM is exported to a tiled grid in the scratch folder and both contours
+    are traced in one sweep (GridToLandPerimeters); use_grid=False runs the geoprocessing chain
+    (RasterToLandPerimeter), which also merges polygons within 10 m of each other."""
     bndMTL = 'bndpoly_mtl' + suffix
     bndMHW = 'bndpoly_mhw' + suffix
     bndpoly = 'bndpoly' + suffix
-    print("Creating the MTL contour polgon from the DEM...")
-    RasterToLandPerimeter(elevGrid, bndMTL, MTL, agg_dist='10', min_area='300', min_hole_sz='300')  # Polygon of MTL contour
-    print("Creating the MHW contour polgon from the DEM...")
-    RasterToLandPerimeter(elevGrid, bndMHW, MHW, agg_dist='10', min_area='300', min_hole_sz='300')  # Polygon of MHW contour
+    if use_grid:
+        print("Creating the MTL and MHW contour polygons from the DEM...")
+        grid = RasterToGrid(elevGrid, os.path.join(arcpy.env.scratchFolder, os.path.basename(elevGrid) + '_grid'), verbose=False)
+        GridToLandPerimeters(grid, [bndMTL, bndMHW], [MTL, MHW], arcpy.Describe(elevGrid).spatialReference,
+                             min_area=300, min_hole_sz=300)
+    else:
+        print("Creating the MTL contour polgon from the DEM...")
+        RasterToLandPerimeter(elevGrid, bndMTL, MTL, agg_dist='10', min_area='300', min_hole_sz='300')  # Polygon of MTL contour
+        print("Creating the MHW contour polgon from the DEM...")
+        RasterToLandPerimeter(elevGrid, bndMHW, MHW, agg_dist='10', min_area='300', min_hole_sz='300')  # Polygon of MHW contour
     print("Combining the two polygons...")
     bndpoly = CombineShorelinePolygons(bndMTL, bndMHW, inletLines, ShorelinePts, bndpoly, SA_bounds)
     #DeleteTempFiles()
@@ -808,41 +867,33 @@ def find_similar_fields(prefix, oldPts, fields=[], verbose=True):
         fdict[key]['src'] = src
     return(fdict)
 
-def ArmorLineToTrans_PD(in_trans, armorLines, sl2trans_df, tID_fld, proj_code, elevGrid_5m):
+@tracing.traced('armor')
+def ArmorLineToTrans_PD(in_trans, armorLines, sl2trans_df, tID_fld, proj_code, elevGrid_5m, fill=-99999, workers=1):
     """Get position and elevation of armoring lines at each transect.
 
     __Arm_x__, __Arm_y__, and __Arm_z__ are the easting, northing, and elevation, respectively, where an artificial structure crosses the transect in the vicinity of the beach. These features are meant to supplement the dune toe data set by providing an upper limit to the beach in areas where dune toe extraction was confounded by the presence of an artificial structure. Values are populated for each transect as follows:
 
-    1. Get the positions of intersection between the digitized armoring lines and the transects (Intersect tool from the Overlay toolset);
-    2. Extract the elevation value at each intersection point from the DEM (Extract Multi Values to Points tool from Spatial Analyst);
+    1. Get the positions of intersection between the digitized armoring lines and the transects (functions_geom.armor2trans());
+    2. Where a transect crosses armoring more than once, use the intersection closest to the shoreline (SL_x, SL_y in sl2trans_df);
+    3. Extract the elevation value at each intersection point from the DEM (a tiled grid from ProcessDEMGrid() or a raster).
+
+    Arm_z is NaN where the DEM has no data; fill is only used to read missing SL_x/SL_y in sl2trans_df.
     """
-    #FIXME: How do I know which point will be encountered first? - don't want those in back to take the place of
-    arm2trans = os.path.join(arcpy.env.scratchGDB, "arm2trans")
     flds = ['Arm_x', 'Arm_y', 'Arm_z']
     if not arcpy.Exists(armorLines) or not int(arcpy.GetCount_management(armorLines).getOutput(0)):
         print('\nArmoring file either missing or empty so we will proceed without armoring data. If shorefront tampering is present at this site, cancel the operations to digitize.')
-        df = pd.DataFrame(columns=flds)
+        return(pd.DataFrame({f: np.zeros(0) for f in flds}, index=pd.Index([], name=tID_fld)))
+    trans = FCtoLines(in_trans, tID_fld)
+    arm_lines = FCtoLines(armorLines, 'OID@', spatial_ref=arcpy.Describe(in_trans).spatialReference)
+    df = part.run_partitioned(fgeom.armor2trans, trans, [arm_lines, sl2trans_df],
+                              {'tID_fld': tID_fld, 'fill': fill},
+                              workers=workers, tID_fld=tID_fld)
+    print('Getting elevation of beach armoring by extracting elevation values at the armoring points.')
+    if frst.is_grid(elevGrid_5m):
+        df['Arm_z'] = frst.sample_grids({'Arm_z': elevGrid_5m}, df['Arm_x'].values, df['Arm_y'].values)['Arm_z'].values
     else:
-        # Create armor points with XY fields
-        if not arcpy.Exists(arm2trans):
-            arcpy.Intersect_analysis((armorLines, in_trans), arm2trans+'_multi', output_type='POINT')
-            print('Getting elevation of beach armoring by extracting elevation values to arm2trans points.')
-            arcpy.MultipartToSinglepart_management(arm2trans+'_multi', arm2trans)
-            arcpy.sa.ExtractMultiValuesToPoints(arm2trans, [[elevGrid_5m, 'Arm_z']])
-        df = FCtoDF(arm2trans, xy=True, dffields=[tID_fld, 'Arm_z'])
-        df.index = df.pop(tID_fld)
-        df.rename(columns={'SHAPE@X':'Arm_x','SHAPE@Y':'Arm_y'}, inplace=True)
-    # Where multiple armor intersect points created along a transect, use the closest point to the shoreline.
-    if df.index.duplicated().any():
-        idx = df.index[df.index.duplicated()]
-        print("Looks like these transects {} are intersected by armoring lines multiple times. We will select the more seaward of the points.".format(idx.unique().tolist()))
-        for i in idx.unique():
-            sl = sl2trans_df.loc[i, :] # get shoreline point at transect #FIXME: what happens if there's no shoreline point
-            rows = df.loc[i,:] # get rows with duplicated transect ID
-            rows = rows.assign(bw = lambda x: np.hypot(sl.SL_x - x.Arm_x, sl.SL_y - x.Arm_y)) # calculate dist from SL to each point in row (bw) #FIXME: 'Series' object has no attribute 'assign'
-            df.drop(i, axis=0, inplace=True)
-            df = pd.concat([df, rows.loc[rows['bw'] == min(rows['bw']), flds]]) # return the row with the smallest bw
-    return(df)
+        df['Arm_z'] = RasterValuesAtPoints(elevGrid_5m, df['Arm_x'].values, df['Arm_y'].values)
+    return(df[flds])
 
 def geom_shore2trans(transect, tID, shoreline, in_pts, slp_fld, proximity=25):
     """
@@ -867,10 +918,15 @@ def geom_shore2trans(transect, tID, shoreline, in_pts, slp_fld, proximity=25):
     # Return: X and Y at the intersect of trans and shoreline, slope at nearest shoreline point (within proximity distance)
     return(slxpt.X, slxpt.Y, slp)
 
-def add_shorelinePts2Trans(in_trans, in_pts, shoreline, tID_fld='sort_ID', proximity=25, verbose=True):
+@tracing.traced('shoreline')
+def add_shorelinePts2Trans(in_trans, in_pts, shoreline, tID_fld='sort_ID', proximity=25, verbose=True, workers=1):
     """Get positions of shoreline at each transect.
+
+    The transects, shoreline, and shoreline points are each read once and
+    matched with functions_geom.shore2trans(), which finds all
+    transect/shoreline crossings and nearest slope points in one pass.
+    With workers > 1, ranges of transects are matched in parallel (core.partition).
     """
-    start = time.clock()
     if verbose:
         print("\nMatching shoreline points to transects...")
 
@@ -881,23 +937,18 @@ def add_shorelinePts2Trans(in_trans, in_pts, shoreline, tID_fld='sort_ID', proxi
         print("Using field '{}' as slope.".format(slp_fld))
     in_pts = ReProject(in_pts, in_pts+'_utm', proj_code=arcpy.Describe(in_trans).spatialReference.factoryCode)
 
-    # Make dataframe with SL_x, SL_y, Bslope
-    df = pd.DataFrame(columns=['SL_x', 'SL_y', 'Bslope'], dtype='float64')
-    df.index.name = tID_fld
-
-    # Iterate through transects
-    for trow in arcpy.da.SearchCursor(in_trans, ("SHAPE@",  tID_fld)):
-        transect = trow[0]
-        tID = trow[1]
-        #!! Get values (slope at nearest SLpt and XY at intersect) for transect geometry
-        newrow = geom_shore2trans(transect, tID, shoreline, in_pts, slp_fld, proximity)
-        df.loc[tID, ['SL_x', 'SL_y', 'Bslope']] = newrow
+    # Read geometries to arrays
+    trans = FCtoLines(in_trans, tID_fld)
+    sr = arcpy.Describe(in_trans).spatialReference
+    sl_lines = FCtoLines(shoreline, 'OID@', spatial_ref=sr)
+    pts_df = FCtoDF(in_pts, xy=True, dffields=[slp_fld], verbose=False)
 
-        if verbose:
-            if tID % 100 < 1:
-                print('...duration at transect {}: {}'.format(tID, fun.print_duration(start, True)))
+    # Make dataframe with SL_x, SL_y, Bslope
+    slpts = part.make_points(pts_df[['SHAPE@X', 'SHAPE@Y']].values, pts_df[slp_fld].values)
+    df = part.run_partitioned(fgeom.shore2trans, trans, [sl_lines, slpts],
+                              {'tID_fld': tID_fld, 'proximity': proximity},
+                              halo=proximity, workers=workers, tID_fld=tID_fld)
 
-    fun.print_duration(start)
     return(df)
 
 def geom_dune2trans(trow, out_df, in_pts, z_fld, prefix, proximity=25):
@@ -933,12 +984,17 @@ def geom_dune2trans(trow, out_df, in_pts, z_fld, prefix, proximity=25):
         out_df.loc[tID, colnames_xyz] = [pt.X, pt.Y, pt.Z]
     return(out_df)
 
-def find_ClosestPt2Trans_snap(in_trans, dh_pts, dl_pts, trans_df, tID_fld='sort_ID', proximity=25, verbose=True, fill=-99999):
+@tracing.traced('dunes')
+def find_ClosestPt2Trans_snap(in_trans, dh_pts, dl_pts, trans_df, tID_fld='sort_ID', proximity=25, verbose=True, fill=-99999, workers=1):
     """
     Find the nearest dune crest/toe point to the transects.
+
+    The transect vertices and dune points are each read once and matched with
+    functions_geom.dunes2trans(), which uses a grid index of the dune points
+    so that each transect is only compared to the points near it.
+    With workers > 1, ranges of transects are matched in parallel (core.partition).
     """
-    # 12 minutes for FireIsland
-    start = time.clock()
+    # Formerly 12 minutes for FireIsland with a search cursor per transect
     if verbose:
         print("\nMatching dune points with transects:")
 
@@ -956,97 +1012,50 @@ def find_ClosestPt2Trans_snap(in_trans, dh_pts, dl_pts, trans_df, tID_fld='sort_
         print("Using field '{}' as DL Z field...".format(dlz_fld))
     dl_pts = ReProject(dl_pts, dl_pts+'_utm', proj_code=arcpy.Describe(in_trans).spatialReference.factoryCode)
 
-    # Initialize dataframe
-    colnames =['DH_x', 'DH_y', 'DH_z', 'DH_snapX', 'DH_snapY',
-                'DL_x', 'DL_y', 'DL_z', 'DL_snapX','DL_snapY']
-    out_df = pd.DataFrame(columns=colnames, dtype='f8')
-    out_df.index.name = tID_fld
+    # Read geometries to arrays
+    trans = FCtoLines(in_trans, tID_fld)
+    dh_df = FCtoDF(dh_pts, xy=True, dffields=[dhz_fld], fill=fill, verbose=False)
+    dl_df = FCtoDF(dl_pts, xy=True, dffields=[dlz_fld], fill=fill, verbose=False)
 
     # Find nearest point to each transect
     if verbose:
-        print('Looping through transects and dune points to find nearest point within {} m...'.format(proximity))
-    for trow in arcpy.da.SearchCursor(in_trans, ("SHAPE@", tID_fld)):
+        print('Finding nearest point within {} m of each transect...'.format(proximity))
+    out_df = part.run_partitioned(fgeom.dunes2trans, trans,
+                                  [part.make_points(dh_df[['SHAPE@X', 'SHAPE@Y']].values, dh_df[dhz_fld].values),
+                                   part.make_points(dl_df[['SHAPE@X', 'SHAPE@Y']].values, dl_df[dlz_fld].values)],
+                                  {'tID_fld': tID_fld, 'proximity': proximity},
+                                  halo=proximity, workers=workers, tID_fld=tID_fld)
 
-        # Dune crests (dhigh)
-        out_df = geom_dune2trans(trow, out_df, dh_pts, dhz_fld, prefix='DH', proximity=proximity)
-        # Dune toes (dlow)
-        out_df = geom_dune2trans(trow, out_df, dl_pts, dlz_fld, prefix='DL', proximity=proximity)
-
-        if verbose:
-            tID = trow[1]
-            if tID % 100 < 1:
-                print('...duration at transect {}: {}'.format(tID, fun.print_duration(start, True)))
-
-    duration = fun.print_duration(start)
     return(out_df)
 
 """
 Dist2Inlet
 """
+@tracing.traced('dist2inlet')
 def measure_Dist2Inlet(shoreline, in_trans, inletLines, tID_fld='sort_ID'):
     """
     Measure distance along oceanside shore from transect to inlet.
-    Uses three SearchCursors (arcpy's data access module).
     Stores values in new data frame.
 
     Distance to nearest tidal inlet (__Dist2Inlet__) is computed as alongshore distance of each sampling transect from the nearest tidal inlet. This distance includes changes in the path of the shoreline instead of simply a Euclidean distance and reflects sediment transport pathways. It is measured using the oceanside shoreline between inlets (ShoreBetweenInlets).
 
     Note that the ShoreBetweenInlets feature class must be both 'dissolved' and 'singlepart' so that each feature represents one-and-only-one shoreline that runs the entire distance between two inlets or equivalent. If the shoreline is bounded on both sides by an inlet, measure the distance to both and assign the minimum distance of the two. If the shoreline meets only one inlet (meaning the study area ends before the island ends), use the distance to the only inlet.
 
-    The process uses the cut, disjoint, and length geometry methods and properties in ArcPy data access module. The function measure_Dist2Inlet() prints a warning when the difference in Dist2Inlet between two consecutive transects is greater than 300.
+    The shoreline, transects, and inlet lines are each read once. The inlets are located as chainage (distance along the shoreline) and each transect crossing gets a chainage, so Dist2Inlet is the smallest difference in chainage (functions_geom.dist2inlet()). The function prints a warning when the difference in Dist2Inlet between two consecutive transects is greater than 300.
     """
     # Initialize
-    start = time.clock()
-    utmSR = arcpy.Describe(in_trans).spatialReference
-    df = pd.DataFrame(columns=[tID_fld, 'Dist2Inlet']) # initialize dataframe
-    # Get inlets geometry objects
-    inlets = [row[0] for row in arcpy.da.SearchCursor(inletLines, ("SHAPE@"))]
-    # Loop through shoreline features
-    for row in arcpy.da.SearchCursor(shoreline, ("SHAPE@")):
-        line = row[0]
-        # Loop through transect features
-        for [transect, tID] in arcpy.da.SearchCursor(in_trans, ("SHAPE@",  tID_fld)):
-            if not line.disjoint(transect):
-                # 1. cut shoreline at the transect
-                [rseg, lseg] = line.cut(transect)
-                # 2. if the shoreline segment touches any inlet, get the segment length.
-                #    If it doesn't touch an inlet, length is set to NaN to remove it from consideration.
-                #    In case of multipart features, use the shortest part that intersects an inlet.
-                lenR = np.nan
-                for pi in range(rseg.partCount):
-                    part = arcpy.Polyline(rseg.getPart(pi), utmSR)
-                    if not all(part.disjoint(i) for i in inlets):
-                        lenR = np.nanmin([lenR, part.length])
-                lenL = np.nan
-                for pi in range(lseg.partCount):
-                    part = arcpy.Polyline(lseg.getPart(pi), utmSR)
-                    if not all(part.disjoint(i) for i in inlets):
-                        lenL = np.nanmin([lenL, part.length])
-                # 3. If shoreline and transect intersect on an inlet line, return 0 because transect is at an inlet.
-                #    Only check for overlap at segments that touch an inlet (not NaN).
-                xpt = line.intersect(transect, 1) # point where shoreline and transect intersect
-                lenR = 0 if not np.isnan(lenR) and not all(xpt.disjoint(i) for i in inlets) else lenR
-                lenL = 0 if not np.isnan(lenL) and not all(xpt.disjoint(i) for i in inlets) else lenL
-                # 4. Return the length of the shorter segment and save it in the DF
-                mindist = np.nanmin([lenR, lenL])
-                df = df.append({tID_fld:tID, 'Dist2Inlet':mindist}, ignore_index=True)
-                # Alert if there is a large change (>300 m) in values between consecutive transects
-                try:
-                    dist_prev = pd.to_numeric(df.loc[df[tID_fld]==tID-1, 'Dist2Inlet'])
-                    if any(abs(dist_prev - mindist) > 300):
-                        print("CAUTION: Large change in Dist2Inlet values between transects {} ({} m) and {} ({} m).".format(tID-1, dist_prev, tID, mindist))
-                except:
-                    print("Error-catching is not working in Dist2Inlet.")
-                    pass
-    df.index = df[tID_fld]
-    df.drop(tID_fld, axis=1, inplace=True)
-    fun.print_duration(start) # 25.8 seconds for Monomoy; converting shorelines to geom objects took longer time to complete.
+    sr = arcpy.Describe(in_trans).spatialReference
+    trans = FCtoLines(in_trans, tID_fld)
+    sl_lines = FCtoLines(shoreline, 'OID@', spatial_ref=sr)
+    inlets = FCtoLines(inletLines, 'OID@', spatial_ref=sr)
+    df = fgeom.dist2inlet(trans, sl_lines, inlets, tID_fld)
     return(df)
 
 """
 Beach width
 """
-def calc_BeachWidth_fill(in_trans, trans_df, maxDH, tID_fld='sort_ID', MHW='', fill=-99999, skip_missing_z=True):
+@tracing.traced('beachwidth')
+def calc_BeachWidth_fill(in_trans, trans_df, maxDH, tID_fld='sort_ID', MHW='', fill=-99999, skip_missing_z=True, workers=1):
     """
     Upper beach width (__uBW__) and upper beach height (__uBH__) are calculated based on the difference in position between two points: the position of MHW along the transect (__SL_x__, __SL_y__) and the dune toe position or equivalent (usually __DL_snapX__, __DL_snapY__).  In some cases, the dune toe is not appropriate to designate the "top of beach" so beach width and height are calculated from either the position of the dune toe, the dune crest, or the base of an armoring structure. The dune crest was only considered a possibility if the dune crest elevation (__DH_zMHW__) was less than or equal to `maxDH`.
 
@@ -1058,158 +1067,57 @@ def calc_BeachWidth_fill(in_trans, trans_df, maxDH, tID_fld='sort_ID', MHW='', f
 
     Notes:
     - In some morphology datasets, missing elevation values at a point indicate that the point should not be used to measure beach width. In those cases, use the `skip_missing_z` argument to select whether or not to skip these points.
+    - The transect end points are read once and functions_geom.beach_width() projects the DL, DH, and Arm positions onto every transect in bulk. Missing values in the output are NaN.
+    - With workers > 1, ranges of transects are processed in parallel (core.partition).
     """
-    # To find dlow proxy, use code written by Ben in Matlab and converted to pandas by Emily
-    # Uses snapToLine() polyline geometry method from arcpy
-
-    # Replace nan's with fill for cursor operations;
-    if trans_df.isnull().values.any():
-        nan_input = True
-        trans_df.fillna(fill, inplace=True)
-    else:
-        nan_input = False
-
-    # Add (or recalculate) elevation fields adjusted to MHW
-    trans_df = fun.adjust2mhw(trans_df, MHW, ['DH_z', 'DL_z', 'Arm_z'], fill)
-
-    # Initialize beach width dataframe
-    bw_df = pd.DataFrame(fill, index=trans_df.index, columns= ['DistDL', 'DistDH', 'DistArm', 'uBW', 'uBH', 'ub_feat'], dtype='f8')
-    # field ub_feat gets converted to object type when the value is set
-
-    for row in arcpy.da.SearchCursor(in_trans, ("SHAPE@",  tID_fld)):
-        transect = row[0]
-        tID = row[1]
-        tran = trans_df.loc[tID]
-        try:
-            if int(tran['SL_x']) != int(fill):
-
-                # Calculate Dist_ values in bw_df columns. Use snapToLine method.
-                if int(tran.DL_x) != int(fill):
-                    ptDL = transect.snapToLine(arcpy.Point(tran['DL_x'], tran['DL_y']))
-                    bw_df.loc[tID, 'DistDL'] = np.hypot(tran['SL_x']- ptDL[0].X, tran['SL_y'] - ptDL[0].Y)
-                if int(tran.DH_x) != int(fill):
-                    ptDH = transect.snapToLine(arcpy.Point(tran['DH_x'], tran['DH_y']))
-                    bw_df.loc[tID, 'DistDH'] = np.hypot(tran['SL_x'] - ptDH[0].X, tran['SL_y'] - ptDH[0].Y)
-                if int(tran.Arm_x) != int(fill):
-                    ptArm = transect.snapToLine(arcpy.Point(tran['Arm_x'], tran['Arm_y']))
-                    bw_df.loc[tID, 'DistArm'] = np.hypot(tran['SL_x'] - ptArm[0].X, tran['SL_y'] - ptArm[0].Y)
-
-                # Select Dist value for uBW. Use DistDL if available. If not and DH < maxDH, use DistDH. If neither available, use DistArm.
-                if skip_missing_z: # if Z value is fill, don't use the point even if XY is populated
-                    if int(tran.DL_z) != int(fill) and int(tran.DL_x) != int(fill):
-                        bw_df.loc[tID, 'uBW'] = bw_df['DistDL'].loc[tID]
-                        bw_df.loc[tID, 'uBH'] = tran['DL_zmhw']
-                        bw_df.loc[tID, 'ub_feat'] = 'DL'
-                    elif int(tran.DH_x) != int(fill) and int(tran.DH_z) != int(fill) and tran.DH_zmhw <= maxDH:
-                        bw_df.loc[tID, 'uBW'] = bw_df['DistDH'].loc[tID]
-                        bw_df.loc[tID, 'uBH'] = tran['DH_zmhw']
-                        bw_df.loc[tID, 'ub_feat'] = 'DH'
-                    elif int(tran.Arm_x) != int(fill) and int(tran.Arm_z) != int(fill):
-                        bw_df.loc[tID, 'uBW'] = bw_df['DistArm'].loc[tID]
-                        bw_df.loc[tID, 'uBH'] = tran['Arm_zmhw']
-                        bw_df.loc[tID, 'ub_feat'] = 'Arm'
-                    else:
-                        continue
-                # Use any point with XY matching the criteria
-                else:
-                    if int(tran.DL_x) != int(fill):
-                        bw_df.loc[tID, 'uBW'] = bw_df['DistDL'].loc[tID]
-                        bw_df.loc[tID, 'uBH'] = tran['DL_zmhw']
-                        bw_df.loc[tID, 'ub_feat'] = 'DL'
-                    elif int(tran.DH_x) != int(fill) and tran.DH_zmhw <= maxDH and int(tran.DH_z) != int(fill):
-                        bw_df.loc[tID, 'uBW'] = bw_df['DistDH'].loc[tID]
-                        bw_df.loc[tID, 'uBH'] = tran['DH_zmhw']
-                        bw_df.loc[tID, 'ub_feat'] = 'DH'
-                    elif int(tran.Arm_x) != int(fill):
-                        bw_df.loc[tID, 'uBW'] = bw_df['DistArm'].loc[tID]
-                        bw_df.loc[tID, 'uBH'] = tran['Arm_zmhw']
-                        bw_df.loc[tID, 'ub_feat'] = 'Arm'
-                    else:
-                        continue
-            else:
-                continue
-        except TypeError:
-            print(tran.DL_x)
-            print(fill)
-            break
-
-    # Add new uBW and uBH fields to trans_df
-    trans_df = fun.join_columns_id_check(trans_df, bw_df, tID_fld)
-    if nan_input: # restore nan values
-        trans_df.replace(fill, np.nan, inplace=True)
+    trans = FCtoLines(in_trans, tID_fld)
+    ends = fgeom.line_ends(trans)
+    trans_df = part.run_partitioned(fgeom.beach_width, trans_df, [ends],
+                                    {'maxDH': maxDH, 'MHW': MHW, 'tID_fld': tID_fld, 'fill': fill, 'skip_missing_z': skip_missing_z},
+                                    workers=workers, tID_fld=tID_fld)
     print("Fields uBW and uBH populated with beach width and beach height.")
     return(trans_df)
 
 """
 Widths
 """
+@tracing.traced('widths')
 def calc_IslandWidths(in_trans, barrierBoundary, out_clipped='clip2island', tID_fld='sort_ID'):
-    """Clip transects, get barrier widths
+    """Get barrier widths along transects (out_clipped is no longer used)
     Calculates __WidthLand__, __WidthFull__, and __WidthPart__, which measure different flavors of the cross-shore width of the barrier island. __WidthLand__ is the above-water distance between the back-barrier and seaward MHW shorelines. __WidthLand__ only includes regions of the barrier within the shoreline polygon (bndpoly_2sl) and does not extend into any of the sinuous or intervening back-barrier waterways and islands. __WidthFull__ is the total distance between the back-barrier and seaward MHW shorelines (including space occupied by waterways). __WidthPart__ is the width of only the most seaward portion of land within the shoreline.
 
     These are calculated as follows:
-    1. Clip the transect to the full island shoreline (Clip in the Analysis toolbox);
-    2. For __WidthLand__, get the length of the multipart line segment from &quot;SHAPE@LENGTH&quot; feature class attribute. When the feature is multipart, this will include only the remaining portions of the transect;
-    3. For __WidthPart__, convert the clipped transect from multipart to singlepart and get the length of the first line segment, which should be the most seaward;
-    4. For __WidthFull__, calculate the distance between the first vertex and the last vertex of the clipped transect (Feature Class to NumPy Array with explode to points, pandas groupby, numpy hypot).
+    1. Intersect the transects with the rings of the full island shoreline polygon in one batched pass (functions_geom.island_widths()). The crossings are sorted along each transect into the intervals that are inside the polygon; no clipped feature classes are written to the scratch geodatabase;
+    2. For __WidthLand__, sum the lengths of the intervals, which include only the portions of the transect within the polygon;
+    3. For __WidthPart__, get the length of the first interval along the transect, which should be the most seaward;
+    4. For __WidthFull__, calculate the distance between the start of the first interval and the end of the last interval.
     """
-    home = arcpy.env.workspace
-    out_clipped = os.path.join(arcpy.env.scratchGDB, out_clipped)
-    print("Clipping the transects to the barrier island boundaries ('{}')...".format(os.path.basename(out_clipped)))
-    arcpy.Clip_analysis(os.path.join(home, in_trans), os.path.join(home, barrierBoundary), out_clipped) # ~30 seconds
-
-    # WidthPart - spot-checking verifies the results, but it should additionally include a check to ensure that the first transect part encountered intersects the shoreline
-    print('Getting the width along each transect of the oceanside land (WidthPart)...')
-    out_clipsingle = out_clipped + '_singlepart'
-    arcpy.MultipartToSinglepart_management(out_clipped, out_clipsingle)
-    clipsingles = FCtoDF(out_clipsingle, dffields = ['SHAPE@LENGTH', tID_fld], length=True)
-    widthpart = clipsingles.groupby(tID_fld)['SHAPE@LENGTH'].first()
-    widthpart.name = 'WidthPart'
-
-    # WidthFull
-    print('Getting the width along each transect of the entire barrier (WidthFull)...')
-    verts = FCtoDF(out_clipped, id_fld=tID_fld, explode_to_points=True)
-    verts.drop(tID_fld, axis=1, inplace=True)
-    d = verts.groupby(tID_fld)['SHAPE@X', 'SHAPE@Y'].agg(lambda x: x.max() - x.min())
-    widthfull = np.hypot(d['SHAPE@X'], d['SHAPE@Y'])
-    widthfull.name = 'WidthFull'
-
-    # WidthLand
-    print('Getting the width along each transect of above water portion of the barrier (WidthLand)...')
-    clipped = FCtoDF(out_clipped, dffields = ['SHAPE@LENGTH', tID_fld], length=True, verbose=False)
-    widthland = clipped.groupby(tID_fld)['SHAPE@LENGTH'].first()
-    widthland.name = 'WidthLand'
-
-    # Combine into DF
-    widths_df = pd.DataFrame({'WidthFull':widthfull, 'WidthLand':widthland, 'WidthPart':widthpart}, index=widthfull.index)
+    print("Intersecting the transects with the barrier island boundaries ('{}')...".format(os.path.basename(barrierBoundary)))
+    trans = FCtoLines(in_trans, tID_fld)
+    rings = FCtoLines(barrierBoundary, 'OID@', spatial_ref=arcpy.Describe(in_trans).spatialReference)
+    widths_df = fgeom.island_widths(trans, rings, tID_fld)
     return(widths_df)
 
 """
 Format conversion
 """
-def TransectsToPointsDF(in_trans, barrierBoundary, fc_out='', tID_fld='sort_ID', step=5):
+@tracing.traced('points')
+def TransectsToPointsDF(in_trans, barrierBoundary, fc_out='', tID_fld='sort_ID', step=5, workers=1):
     """Split transects into points at 5-m intervals.
 
     The point dataset is created from the tidied transects (tidyTrans, created during pre-processing) as follows:
     1. Clip the tidied transects (tidyTrans) to the shoreline polygon (bndpoly_2sl) , retaining only those portions of the transects that represent land.
-    2. Produce a dataframe of point positions along each transect every 5 m starting from the ocean-side shoreline. This uses the positionAlongLine geometry method accessed with a Search Cursor and saves the outputs in a new dataframe.
+    2. Produce a dataframe of point positions along each transect every 5 m (step) starting from the ocean-side shoreline. The clipped transects are read to coordinate arrays and all positions are interpolated at once with functions_geom.densify_lines().
     3. Create a point feature class from the dataframe.
     """
-    start = time.clock()
-
     out_clipped = os.path.join(arcpy.env.scratchGDB, 'tidytrans_clipped')
     print("Clipping transects to within the shoreline bounds ('{}')...".format(os.path.basename(out_clipped)))
     arcpy.Clip_analysis(in_trans, barrierBoundary, os.path.join(arcpy.env.scratchGDB, out_clipped))
 
-    print('Getting points every 5m along each transect and saving in new dataframe...')
-    # Initialize empty dataframe
-    df = pd.DataFrame(columns=[tID_fld, 'seg_x', 'seg_y'])
-    # Get shape object and tID value for each transect
-    for line, ID in arcpy.da.SearchCursor(out_clipped, ("SHAPE@", tID_fld)):
-        # Get points in 5m increments along transect and save to df
-        for i in range(0, int(line.length), step):
-            pt = line.positionAlongLine(i)[0]
-            df = df.append({tID_fld:ID, 'seg_x':pt.X, 'seg_y':pt.Y}, ignore_index=True)
+    print('Getting points every {}m along each transect and saving in new dataframe...'.format(step))
+    # Get vertices and tID value for each clipped transect and interpolate points
+    df = part.run_partitioned(fgeom.densify_lines, FCtoLines(out_clipped, tID_fld),
+                              kwargs={'step': step, 'tID_fld': tID_fld}, workers=workers, tID_fld=tID_fld)
 
     if len(fc_out) > 1:
         print("Converting dataframe to feature class ('{}')...".format(os.path.basename(fc_out)))
@@ -1219,9 +1127,108 @@ def TransectsToPointsDF(in_trans, barrierBoundary, fc_out='', tID_fld='sort_ID',
             fc_out += '_v2'
             fc_out = DFtoFC(df, fc_out, id_fld=tID_fld, spatial_ref = arcpy.Describe(in_trans).spatialReference)
 
-    duration = fun.print_duration(start)
     return(df, fc_out)
 
+def FCtoLines(fc, id_fld, spatial_ref=None):
+    """Read polyline or polygon vertices into a functions_geom.Lines container.
+    Each part (or polygon ring) becomes a separate line with the feature's id_fld value."""
+    ids = []
+    counts = []
+    xy = []
+    with arcpy.da.SearchCursor(fc, ['SHAPE@', id_fld], spatial_reference=spatial_ref) as cursor:
+        for geom, ID in cursor:
+            if geom is None:
+                continue
+            for part in geom:
+                ring = []
+                # Polygon parts separate interior rings with None
+                for pt in list(part) + [None]:
+                    if pt is None:
+                        if len(ring):
+                            ids.append(ID)
+                            counts.append(len(ring))
+                            xy.extend(ring)
+                        ring = []
+                    else:
+                        ring.append((pt.X, pt.Y))
+    return(fgeom.make_lines(ids, np.array(xy, dtype='f8').reshape(-1, 2), np.r_[0, np.cumsum(counts)]))
+
+def _lines_geometry(lines, i, n, spatial_ref, geomclass=arcpy.Polyline):
+    # Geometry of the feature made of lines i to i+n (see fgeom.feature_runs)
+    parts = arcpy.Array([arcpy.Array([arcpy.Point(x, y) for x, y in lines.xy[lines.offsets[j]:lines.offsets[j+1]]])
+                         for j in range(i, i + n)])
+    return(geomclass(parts, spatial_ref))
+
+def LinesToFC(lines, out_fc, spatial_ref, geometry_type='POLYLINE', id_fld='line_ID'):
+    """Create FC from a functions_geom.Lines container.
+    Lines (parts or rings) with the same ID become one feature; the ID is saved in id_fld."""
+    arcpy.Delete_management(out_fc) # delete if already exists
+    path, name = os.path.split(out_fc)
+    if not path:
+        path = arcpy.env.workspace
+    arcpy.CreateFeatureclass_management(path, name, geometry_type, spatial_reference=spatial_ref)
+    arcpy.AddField_management(out_fc, id_fld, 'LONG')
+    geomclass = arcpy.Polygon if geometry_type.upper() == 'POLYGON' else arcpy.Polyline
+    first, nparts = fgeom.feature_runs(lines)
+    with arcpy.da.InsertCursor(out_fc, ['SHAPE@', id_fld]) as icur:
+        for i, n in zip(first, nparts):
+            icur.insertRow([_lines_geometry(lines, i, n, spatial_ref, geomclass), int(lines.ids[i])])
+    return(out_fc)
+
+def UpdateLineShapes(fc, lines, id_fld='OID@'):
+    """Replace the shapes of the polylines in fc with those in a functions_geom.Lines container
+    (e.g. after fgeom.extend_lines()). Lines are matched to features by id_fld; other features are unchanged."""
+    first, nparts = fgeom.feature_runs(lines)
+    runs = {lines.ids[i].item(): (i, n) for i, n in zip(first, nparts)}
+    spatial_ref = arcpy.Describe(fc).spatialReference
+    with arcpy.da.UpdateCursor(fc, [id_fld, 'SHAPE@']) as cursor:
+        for row in cursor:
+            if row[0] in runs:
+                row[1] = _lines_geometry(lines, *runs[row[0]], spatial_ref)
+                cursor.updateRow(row)
+    return(fc)
+
+def FCFingerprint(fc):
+    """Hash the geometry and attributes of a feature class (or the rows of a table, or the
+    cell values of a raster in a geodatabase). Pass as the fingerprinter of cache.StageCache
+    so that stage keys change only when the input dataset changes (rather than whenever
+    anything in its geodatabase changes). Raster files are hashed by path, size, and
+    modification time; a dataset that does not exist (e.g. an output) is hashed as 'missing'.
+    Returns None for folders (e.g. a tiled grid) and other datasets (cache.fingerprint()
+    hashes folders by their files)."""
+    if not arcpy.Exists(fc):
+        return('missing')
+    import hashlib
+    h = hashlib.sha256()
+    dsc = arcpy.Describe(fc)
+    if dsc.dataType in ('RasterDataset', 'RasterBand'):
+        if os.path.isfile(dsc.catalogPath):
+            st = os.stat(dsc.catalogPath)
+            h.update('{}|{}|{}'.format(dsc.catalogPath, st.st_size, st.st_mtime_ns).encode())
+            return(h.hexdigest())
+        # Raster in a geodatabase: hash the cell values, in blocks of rows
+        ras = arcpy.Raster(fc)
+        h.update('{}|{}|{}|{}'.format(ras.extent.XMin, ras.extent.YMax, ras.meanCellWidth, ras.spatialReference.factoryCode).encode())
+        for r0 in range(0, ras.height, 1024):
+            nrows = min(1024, ras.height - r0)
+            corner = arcpy.Point(ras.extent.XMin, ras.extent.YMax - (r0 + nrows)*ras.meanCellHeight)
+            h.update(arcpy.RasterToNumPyArray(ras, corner, ras.width, nrows).tobytes())
+        return(h.hexdigest())
+    if dsc.dataType == 'Table':
+        fields = [f.name for f in arcpy.ListFields(fc) if f.type not in ('Blob', 'Raster')]
+        with arcpy.da.SearchCursor(fc, fields) as cursor:
+            for row in cursor:
+                h.update(repr(row).encode())
+        return(h.hexdigest())
+    if not hasattr(dsc, 'shapeType'):
+        # e.g. a folder such as a tiled grid
+        return(None)
+    fields = [f.name for f in arcpy.ListFields(fc) if f.type not in ('OID', 'Geometry', 'Blob', 'Raster')]
+    with arcpy.da.SearchCursor(fc, ['OID@', 'SHAPE@WKB'] + fields) as cursor:
+        for row in cursor:
+            h.update(repr(row).encode())
+    return(h.hexdigest())
+
 def FCtoDF(fc, xy=False, dffields=[], fill=-99999, id_fld=False, extra_fields=[], verbose=True, fid=False, explode_to_points=False, length=False):
     """Convert FeatureClass to pandas.DataFrame with np.nan values"""
     # 1. Convert FC to Numpy array
@@ -1266,8 +1273,8 @@ def FCtoDF(fc, xy=False, dffields=[], fill=-99999, id_fld=False, extra_fields=[]
     else:
         df = pd.DataFrame(dict1, index=arr[id_fld])
         df.index.name = id_fld
-    # replace fill values with NaN values
-    df.replace(fill, np.nan, inplace=True) # opposite: df.fillna(fill, inplace=True)
+    # replace fill values with NaN values (opposite: columns.fill_missing(df, fill))
+    df = Columns(df, fill).frame
     if len(extra_fields) > 0:
         extra_fields += [x.upper() for x in extra_fields]
         df.drop(extra_fields, axis=1, inplace=True, errors='ignore')
@@ -1329,9 +1336,9 @@ def DFtoFC(df, out_fc, spatial_ref, id_fld='', xy=["seg_x", "seg_y"], keep_field
     print()
     return(out_fc)
 
+@tracing.traced('DFtoFC_large')
 def DFtoFC_large(pts_df, out_fc, spatial_ref, df_id='SplitSort', xy=["seg_x", "seg_y"], fill=-99999, verbose=True):
     """Create FC from DF using only XY and ID; then join the DF to the new FC"""
-    start = time.clock()
     # 1. Create pts FC with only XY and ID
     if verbose:
         print('Converting points DF to FC...')
@@ -1343,7 +1350,6 @@ def DFtoFC_large(pts_df, out_fc, spatial_ref, df_id='SplitSort', xy=["seg_x", "s
     arcpy.da.ExtendTable(out_fc, df_id, arr, df_id, append_only=False) # Takes a long time
     if verbose:
         print("OUTPUT: {}".format(os.path.basename(out_fc)))
-    fun.print_duration(start)
     return(out_fc)
 
 def DFtoTable(df, tbl, fill=-99999):
@@ -1371,3 +1377,58 @@ def JoinDFtoRaster(df, rst_ID, out_rst='', fill=-99999, id_fld='sort_ID', val_fl
     arcpy.management.JoinField(out_rst, "Value", tbl_path, id_fld, val_fld)
     print('OUTPUT: {}. Field "Value" is ID and "uBW" is beachwidth.'.format(os.path.basename(out_rst)))
     return(out_rst)
+
+def RasterValuesAtPoints(in_raster, x, y, nodata=-99999):
+    """Values of in_raster in the cells that contain the points (NaN for nodata or outside the raster).
+    The block of cells around the points is read once with RasterToNumPyArray."""
+    dsc = arcpy.Describe(in_raster)
+    cs = float(dsc.meanCellWidth)
+    ext = dsc.extent
+    meta = frst.grid_meta(ext.XMin, ext.YMax, cs, int(dsc.height), int(dsc.width))
+    rows, cols, _ = frst.cell_index(meta, x, y)
+    rows, cols = rows[0], cols[0]
+    out = np.full(len(rows), np.nan)
+    ok = (rows >= 0) & (rows < meta['nrows']) & (cols >= 0) & (cols < meta['ncols'])
+    if ok.any():
+        r0, r1, c0, c1 = rows[ok].min(), rows[ok].max(), cols[ok].min(), cols[ok].max()
+        llc = arcpy.Point(ext.XMin + c0*cs, ext.YMax - (r1 + 1)*cs)
+        arr = arcpy.RasterToNumPyArray(in_raster, llc, int(c1 - c0 + 1), int(r1 - r0 + 1), nodata_to_value=nodata)
+        vals = arr[rows[ok] - r0, cols[ok] - c0].astype('f8')
+        out[ok] = np.where(vals == nodata, np.nan, vals)
+    return(out)
+
+def RasterToGrid(in_raster, out_dir, tile=1024, nodata=-99999, verbose=True, overwrite=True):
+    """Export raster to a tiled grid folder (functions_raster) that can be memory-mapped.
+    The raster is read one tile at a time, so it is never loaded whole. The grid is written
+    to a temporary folder and then moved to out_dir, so a reader never sees a partial grid.
+    With overwrite=False, a grid already in out_dir (e.g. exported by another stage) is kept."""
+    if not overwrite and frst.is_grid(out_dir):
+        return(out_dir)
+    dsc = arcpy.Describe(in_raster)
+    cs = float(dsc.meanCellWidth)
+    ext = dsc.extent
+    nrows, ncols = int(dsc.height), int(dsc.width)
+    meta = frst.grid_meta(ext.XMin, ext.YMax, cs, nrows, ncols, 'f4', nodata, tile)
+    final_dir, out_dir = out_dir, '{}_tmp{}'.format(os.path.normpath(out_dir), os.getpid())
+    frst.create_grid(out_dir, meta)
+    for tr in range(-(-nrows // meta['tile_rows'])):
+        for tc in range(-(-ncols // meta['tile_cols'])):
+            nr, nc = frst.tile_shape(meta, tr, tc)
+            # lower left corner of the tile
+            llc = arcpy.Point(ext.XMin + tc*meta['tile_cols']*cs, ext.YMax - (tr*meta['tile_rows'] + nr)*cs)
+            arr = arcpy.RasterToNumPyArray(in_raster, llc, nc, nr, nodata_to_value=nodata)
+            if (arr == nodata).all():
+                continue # tiles that are all nodata are not written
+            frst.write_tile(out_dir, meta, tr, tc, arr)
+    if os.path.exists(final_dir) and (overwrite or not frst.is_grid(final_dir)):
+        shutil.rmtree(final_dir)
+    try:
+        os.rename(out_dir, final_dir)
+    except OSError:
+        # another process exported the grid first
+        if overwrite or not frst.is_grid(final_dir):
+            raise
+        shutil.rmtree(out_dir)
+    if verbose:
+        print("OUTPUT: {} ({} x {} cells in {} x {} tiles)".format(final_dir, nrows, ncols, meta['tile_rows'], meta['tile_cols']))
+    return(final_dir)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Run per-transect functions from functions_geom on ranges of transects in a process pool.
+The transects are split into contiguous runs of sort_ID and each partition gets
+only the points and lines within a halo of its transects, so the merged result is
+the same as one serial call. These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+'''
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import numpy as np
+import core.functions_geom as fgeom
+
+# Points with aligned value arrays (e.g. Z or slope). In the call to func, a Points
+# argument is expanded to xy, *values, so Points(dh_xy, dh_z) fills (dh_xy, dh_z).
+Points = namedtuple('Points', ['xy', 'values'])
+
+def make_points(xy, *values):
+    return(Points(np.asarray(xy, dtype='f8').reshape(-1, 2), tuple(np.asarray(v) for v in values)))
+
+"""
+# Partitions
+"""
+def transect_ranges(ids, nparts):
+    """Split a sequence of transect IDs into at most nparts contiguous runs with about the same
+    number of transects. Consecutive repeats of an ID (multipart lines) stay together.
+    Returns a list of (start, stop) positions in ids."""
+    ids = np.asarray(ids)
+    if not len(ids):
+        return([])
+    # Positions where a new transect starts
+    first = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    nparts = max(1, min(int(nparts), len(first)))
+    cuts = first[np.linspace(0, len(first), nparts + 1).astype(int)[1:-1]]
+    bounds = np.r_[0, cuts, len(ids)]
+    return([(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:])])
+
+def lines_bbox(lines):
+    """Return (xmin, ymin, xmax, ymax) of lines."""
+    if not len(lines.xy):
+        return(None)
+    return(tuple(np.r_[lines.xy.min(axis=0), lines.xy.max(axis=0)]))
+
+def select_lines(lines, keep):
+    """Return Lines with only the lines where keep is True, in the same order."""
+    return(fgeom.take_lines(lines, np.flatnonzero(keep)))
+
+def _in_halo(bbox, halo, xmin, ymin, xmax, ymax):
+    return((xmax >= bbox[0] - halo) & (xmin <= bbox[2] + halo) &
+           (ymax >= bbox[1] - halo) & (ymin <= bbox[3] + halo))
+
+def _subset_arg(arg, bbox, halo, ids, tID_fld):
+    """Subset one argument for a partition. Lines and Points are clipped to bbox + halo
+    (keeping their order, so ties and 'last feature' rules are unchanged); dataframes
+    indexed by (or with a column of) tID_fld are reduced to the partition IDs."""
+    if isinstance(arg, fgeom.Lines):
+        if bbox is None:
+            return(arg)
+        return(select_lines(arg, _in_halo(bbox, halo, *fgeom.line_boxes(arg))))
+    if isinstance(arg, Points):
+        if bbox is None:
+            return(arg)
+        x, y = arg.xy[:, 0], arg.xy[:, 1]
+        keep = _in_halo(bbox, halo, x, y, x, y)
+        return(Points(arg.xy[keep], tuple(v[keep] for v in arg.values)))
+    if isinstance(arg, pd.DataFrame):
+        if arg.index.name == tID_fld or not tID_fld in arg.columns:
+            return(arg[arg.index.isin(ids)])
+        return(arg[arg[tID_fld].isin(ids)])
+    return(arg)
+
+def _expand(args):
+    out = []
+    for arg in args:
+        if isinstance(arg, Points):
+            out.append(arg.xy)
+            out.extend(arg.values)
+        else:
+            out.append(arg)
+    return(out)
+
+def split_transects(trans, nparts, args=(), halo=0.0, tID_fld='sort_ID'):
+    """Split trans (Lines or dataframe) and args into partitions.
+    Returns a list of (trans_part, args_part)."""
+    if isinstance(trans, fgeom.Lines):
+        ids = trans.ids
+    elif trans.index.name == tID_fld or not tID_fld in trans.columns:
+        ids = trans.index.values
+    else:
+        ids = trans[tID_fld].values
+    parts = []
+    for start, stop in transect_ranges(ids, nparts):
+        if isinstance(trans, fgeom.Lines):
+            part = fgeom.subset_lines(trans, start, stop)
+            bbox = lines_bbox(part)
+        else:
+            part = trans.iloc[start:stop]
+            bbox = None
+        pids = pd.unique(ids[start:stop])
+        parts.append((part, [_subset_arg(a, bbox, halo, pids, tID_fld) for a in args]))
+    return(parts)
+
+"""
+# Execution
+"""
+def _run_part(func, trans, args, kwargs):
+    return(func(trans, *_expand(args), **kwargs))
+
+def merge_frames(frames, tID_fld='sort_ID'):
+    """Concatenate the partition results in order. Results indexed by transect ID
+    keep the index name tID_fld; others (e.g. points) get a new RangeIndex."""
+    frames = [f for f in frames if f is not None]
+    if not len(frames):
+        return(pd.DataFrame())
+    nonempty = [f for f in frames if len(f)] or frames[:1]
+    if isinstance(nonempty[0].index, pd.RangeIndex):
+        return(pd.concat(nonempty, ignore_index=True))
+    df = pd.concat(nonempty)
+    df.index.name = nonempty[0].index.name
+    return(df)
+
+def run_partitioned(func, trans, args=(), kwargs=None, halo=0.0, nparts=None, workers=None, tID_fld='sort_ID'):
+    """Run func(trans, *args, **kwargs) on ranges of transects in a process pool and merge the results.
+
+    trans is a Lines container (partitions are clipped spatially) or a dataframe of transect values.
+    Lines, Points (see make_points), and dataframes with transect IDs in args are subset to each
+    partition; other arguments are passed unchanged. halo must be at least the proximity used by func.
+    Transects should be in sort_ID order, as they are after prepper.ipynb.
+
+    Example:
+        run_partitioned(fgeom.dunes2trans, trans, [make_points(dh_xy, dh_z), make_points(dl_xy, dl_z)],
+                        {'tID_fld': 'sort_ID', 'proximity': 25}, halo=25, workers=8)
+    """
+    kwargs = kwargs or {}
+    workers = workers or os.cpu_count()
+    nparts = nparts or workers
+    parts = split_transects(trans, nparts, args, halo, tID_fld)
+    if workers == 1 or len(parts) < 2:
+        results = [_run_part(func, p, a, kwargs) for p, a in parts]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(parts))) as pool:
+            futures = [pool.submit(_run_part, func, p, a, kwargs) for p, a in parts]
+            results = [f.result() for f in futures]
+    return(merge_frames(results, tID_fld))
@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Headless runner for the extraction workflow in extractor.ipynb.
+The notebook steps are declared as stages with dependencies (STAGES) and run
+without prompts; stages whose dependencies are complete run concurrently in a
+process pool. Stage outputs are saved in scratch_dir with core.store, so a run
+can be resumed with --from or stopped with --until.
+
+Usage:
+    python -m core.pipeline Fisherman 2014 path\to\Fisherman2014 --workers 4
+    python -m core.pipeline Fisherman 2014 path\to\Fisherman2014 --from beachwidth --until join
+
+arcpy is imported by the stages, not by this module.
+'''
+import os
+import sys
+import time
+import json
+import argparse
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import numpy as np
+from core.configmap import *
+import core.functions as fun
+import core.functions_raster as frst
+import core.store as store
+import core.compact as compact
+import core.export as export
+from core.columns import Columns
+import core.tracing as tracing
+
+"""
+# Configuration
+"""
+def site_config(site, year, proj_dir, overrides=None):
+    """Return the values that setvars.py and extractor.ipynb set for site and year, without prompting.
+    Keys in overrides (e.g. input paths or maxDH) replace the defaults."""
+    sitevals = dict(sitemap[site])
+    home = os.path.join(proj_dir, '{}{}.gdb'.format(sitevals['site'], year))
+    yabbr = str(year)[2:4]
+    if sitevals['region'] in ('Massachusetts', 'RhodeIsland', 'Maine'):
+        proj_code = 26919 # "NAD 1983 UTM Zone 19N"
+    else:
+        proj_code = 26918 # "NAD 1983 UTM Zone 18N"
+    sitevals['MTL'] = (sitevals['MHW'] + sitevals['MLW'])/2
+    cfg = {'site': site, 'year': str(year), 'proj_dir': proj_dir,
+        'sitevals': sitevals, 'home': home,
+        'scratch_dir': os.path.join(proj_dir, 'scratch'),
+        'scratch_workspace': proj_dir,
+        'proj_code': proj_code,
+        'maxDH': 3 if sitevals['site'] == 'Monomoy' else 2.5,
+        'tID_fld': tID_fld, 'pID_fld': pID_fld, 'fill': fill,
+        'proximity': pt2trans_disttolerance, 'step': 5,
+        'partition_workers': 1, # processes for per-transect stages (core.partition)
+        'trans_name': '{}{}_trans'.format(sitevals['code'], yabbr),
+        'pts_name': '{}{}_pts'.format(sitevals['code'], yabbr),
+        'cache_dir': None,
+        'compact_points': False, # keep points compact until export (core.compact)
+        'csv_chunksize': 20000, # rows per chunk of the CSV export (core.export)
+        'trace': None, # JSON-lines trace file (core.tracing)
+        # Inputs, named as in extractor.ipynb
+        'extendedTrans': os.path.join(home, 'extTrans'),
+        'extTrans_tidy': os.path.join(home, 'tidyTrans'),
+        'ShorelinePts': os.path.join(home, 'SLpts'),
+        'dlPts': os.path.join(home, 'DLpts'),
+        'dhPts': os.path.join(home, 'DHpts'),
+        'inletLines': os.path.join(home, 'inletLines'),
+        'barrierBoundary': os.path.join(home, 'bndpoly_2sl'),
+        'elevGrid': os.path.join(home, 'DEM_5m'),
+        'shoreline': os.path.join(home, 'ShoreBetweenInlets'),
+        'armorLines': os.path.join(home, 'armorLines'),
+        'slopeGrid': os.path.join(home, 'slope_5m'),
+        'SA_bounds': os.path.join(home, 'SA_bounds'),
+        'tr_w_anthro': os.path.join(home, 'extTrans_wAnthro'),
+        }
+    if overrides:
+        cfg.update(overrides)
+    return(cfg)
+
+def _setup_arcpy(cfg):
+    # Same environment settings as setvars.py
+    import arcpy
+    arcpy.env.workspace = cfg['home']
+    arcpy.env.scratchWorkspace = cfg['scratch_workspace']
+    arcpy.env.overwriteOutput = True
+    arcpy.CheckOutExtension("Spatial")
+    return(arcpy)
+
+def _call(cfg, stage, func, *args, **kwargs):
+    # Run func through the stage cache if cfg['cache_dir'] is set
+    if cfg.get('cache_dir'):
+        from core.cache import StageCache
+        from core.functions_warcpy import FCFingerprint
+        return(StageCache(cfg['cache_dir'], fingerprinter=FCFingerprint).run(stage, func, *args, **kwargs))
+    return(func(*args, **kwargs))
+
+def _grid(cfg, raster, name):
+    # Tiled grid (core.functions_raster) of raster in scratch_dir/grids, exported on first use.
+    # Delete the folder to export the raster again.
+    path = os.path.join(cfg['scratch_dir'], 'grids', name)
+    if not frst.is_grid(path):
+        import core.functions_warcpy as fwa
+        fwa.RasterToGrid(raster, path, verbose=False, overwrite=False)
+    return(path)
+
+"""
+# Stages
+"""
+def stage_trans(cfg, inputs):
+    """Copy extended transects to dataframe and join anthro fields (if available)."""
+    arcpy = _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    trans_df = fwa.FCtoDF(cfg['extendedTrans'], id_fld=cfg['tID_fld'], extra_fields=extra_fields)
+    trans_df['DD_ID'] = trans_df[cfg['tID_fld']] + cfg['sitevals']['id_init_val']
+    if arcpy.Exists(cfg['tr_w_anthro']):
+        trdf_anthro = fwa.FCtoDF(cfg['tr_w_anthro'], id_fld=cfg['tID_fld'], dffields=['Development', 'Nourishment','Construction'])
+        trans_df = fun.join_columns(trans_df, trdf_anthro)
+    return(trans_df)
+
+def stage_shoreline(cfg, inputs):
+    """Get the XY position where transect crosses the oceanside shoreline."""
+    arcpy = _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    if not arcpy.Exists(cfg['inletLines']):
+        raise IOError("{} not found. Digitize lines at each inlet before running the pipeline.".format(cfg['inletLines']))
+    if not arcpy.Exists(cfg['shoreline']):
+        SA_bounds = cfg['SA_bounds'] if arcpy.Exists(cfg['SA_bounds']) else ''
+        fwa.CreateShoreBetweenInlets(cfg['barrierBoundary'], cfg['inletLines'], cfg['shoreline'],
+                                     cfg['ShorelinePts'], cfg['proj_code'], SA_bounds)
+    return(_call(cfg, 'shoreline', fwa.add_shorelinePts2Trans, cfg['extendedTrans'], cfg['ShorelinePts'],
+                 cfg['shoreline'], tID_fld=cfg['tID_fld'], proximity=cfg['proximity'],
+                 workers=cfg['partition_workers']))
+
+def stage_dunes(cfg, inputs):
+    """Get dune crest and dune toe positions."""
+    _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    return(_call(cfg, 'dunes', fwa.find_ClosestPt2Trans_snap, cfg['extendedTrans'], cfg['dhPts'], cfg['dlPts'],
+                 inputs['trans'], tID_fld=cfg['tID_fld'], proximity=cfg['proximity'], fill=cfg['fill'],
+                 workers=cfg['partition_workers']))
+
+def stage_dem(cfg, inputs):
+    """Project and aggregate the DEM to a 5 m grid in proj_code (ProcessDEMGrid) and get its slope grid.
+    The slopeGrid raster is used if it is already in proj_code at 5 m; otherwise slope is calculated
+    from the 5 m grid. Returns the paths of the grids, which the armor and points stages sample."""
+    arcpy = _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    grid_dir = os.path.join(cfg['scratch_dir'], 'grids')
+    elev = fwa.ProcessDEMGrid(cfg['elevGrid'], arcpy.SpatialReference(cfg['proj_code']), grid_dir,
+                              workers=cfg['partition_workers'])
+    slope = os.path.join(grid_dir, 'slope_5m')
+    if arcpy.Exists(cfg['slopeGrid']):
+        dsc = arcpy.Describe(cfg['slopeGrid'])
+        if dsc.spatialReference.factoryCode == cfg['proj_code'] and dsc.meanCellWidth == 5:
+            slope = _grid(cfg, cfg['slopeGrid'], 'slope')
+    if not frst.is_grid(slope):
+        # Horn slope (PERCENT_RISE) of the 5 m grid, as arcpy.Slope_3d
+        frst.slope_grid(elev, slope, workers=cfg['partition_workers'])
+    return(pd.DataFrame({'elev': [elev], 'slope': [slope]}))
+
+def stage_armor(cfg, inputs):
+    """Get position and elevation of armoring lines at each transect."""
+    _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    return(_call(cfg, 'armor', fwa.ArmorLineToTrans_PD, cfg['extendedTrans'], cfg['armorLines'],
+                 inputs['shoreline'], cfg['tID_fld'], cfg['proj_code'], inputs['dem']['elev'].iloc[0],
+                 fill=cfg['fill'], workers=cfg['partition_workers']))
+
+def stage_beachwidth(cfg, inputs):
+    """Join shoreline, dune, and armoring positions and calculate beach width and height."""
+    _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    trans_df = inputs['trans']
+    for name in ['shoreline', 'dunes', 'armor']:
+        trans_df = fun.join_columns_id_check(trans_df, inputs[name], cfg['tID_fld'])
+    return(_call(cfg, 'beachwidth', fwa.calc_BeachWidth_fill, cfg['extendedTrans'], trans_df, cfg['maxDH'],
+                 tID_fld=cfg['tID_fld'], MHW=cfg['sitevals']['MHW'], fill=cfg['fill'], skip_missing_z=True,
+                 workers=cfg['partition_workers']))
+
+def stage_dist2inlet(cfg, inputs):
+    """Measure distance to inlet along the shoreline."""
+    _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    return(_call(cfg, 'dist2inlet', fwa.measure_Dist2Inlet, cfg['shoreline'], cfg['extendedTrans'],
+                 cfg['inletLines'], tID_fld=cfg['tID_fld']))
+
+def stage_widths(cfg, inputs):
+    """Get barrier widths along transects."""
+    _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    return(_call(cfg, 'widths', fwa.calc_IslandWidths, cfg['extendedTrans'], cfg['barrierBoundary'],
+                 tID_fld=cfg['tID_fld']))
+
+def stage_transects(cfg, inputs):
+    """Join Dist2Inlet and widths to the transects."""
+    trans_df = inputs['beachwidth']
+    for name in ['dist2inlet', 'widths']:
+        trans_df = fun.join_columns_id_check(trans_df, inputs[name], cfg['tID_fld'], fill=cfg['fill'])
+    return(trans_df)
+
+def stage_points(cfg, inputs):
+    """Create points every 5 m along the tidied transects and extract elevation and slope from the
+    dem stage grids (and BN layers if present)."""
+    arcpy = _setup_arcpy(cfg)
+    import core.functions_warcpy as fwa
+    pts_presort = os.path.join(arcpy.env.scratchGDB, 'transPts_unsorted')
+    pts_df, pts_presort = _call(cfg, 'points', fwa.TransectsToPointsDF, cfg['extTrans_tidy'], cfg['barrierBoundary'],
+                                fc_out=pts_presort, tID_fld=cfg['tID_fld'], step=cfg['step'],
+                                workers=cfg['partition_workers'])
+    # Sample the rasters at the points from tiled grids (same cell values as ExtractMultiValuesToPoints)
+    grids = {'ptZ': inputs['dem']['elev'].iloc[0], 'ptSlp': inputs['dem']['slope'].iloc[0]}
+    bnlayers = [f for f in ['SubType', 'VegType', 'VegDens', 'GeoSet', 'DisMOSH'] if cfg.get(f)]
+    grids.update({f: _grid(cfg, cfg[f], f) for f in bnlayers})
+    pts_df = frst.extract_values_to_pts(pts_df, grids, xy=['seg_x', 'seg_y'])
+    pts_df = pts_df.rename(columns={'seg_x':'SHAPE@X', 'seg_y':'SHAPE@Y'})
+    pts_df = pts_df[[cfg['tID_fld']] + list(grids) + ['SHAPE@X', 'SHAPE@Y']]
+    pts_df.replace({f: {9999:np.nan} for f in bnlayers}, inplace=True)
+    return(pts_df)
+
+def stage_join(cfg, inputs):
+    """Calculate point distances, sort points, aggregate elevation to transects, and join transect values to points.
+    Returns the points; the transects are saved as 'join_trans'. With cfg['compact_points'], only the transect
+    values needed for the point distances are joined and the points are returned as a compact table (core.compact)."""
+    tID_fld, pID_fld = cfg['tID_fld'], cfg['pID_fld']
+    trans_df = inputs['transects']
+    if cfg.get('compact_points'):
+        pts_df = fun.join_columns(inputs['points'], trans_df.reindex(columns=compact.PREP_TRANS_FLDS), tID_fld)
+    else:
+        pts_df = fun.join_columns(inputs['points'], trans_df, tID_fld)
+    pts_df = fun.prep_points(pts_df, tID_fld, pID_fld, cfg['sitevals']['MHW'], cfg['fill'])
+    pts_df, zmhw = fun.aggregate_z(pts_df, cfg['sitevals']['MHW'], tID_fld, 'ptZ', cfg['fill'])
+    trans_df = fun.join_columns(trans_df, zmhw)
+    trans_df = trans_df.drop(extra_fields, axis=1, errors='ignore')
+    store.DFtoStore(trans_df, os.path.join(cfg['scratch_dir'], 'join_trans'), verbose=False)
+    trans_df.to_pickle(os.path.join(cfg['scratch_dir'], cfg['trans_name']+'_null.pkl'))
+    if cfg.get('compact_points'):
+        # transect values are added back in stage_csv
+        pts_df = Columns(pts_df, cfg['fill']).frame
+        if not pID_fld in pts_df.columns:
+            pts_df.reset_index(drop=False, inplace=True)
+        return(compact.compact_points(pts_df, trans_df, tID_fld))
+    pts_df = fun.join_columns(pts_df, trans_df, tID_fld)
+    if not pID_fld in pts_df.columns:
+        pts_df.reset_index(drop=False, inplace=True)
+    pts_df = _point_fields(pts_df)
+    pts_df.to_pickle(os.path.join(cfg['scratch_dir'], cfg['pts_name']+'_null.pkl'))
+    return(pts_df)
+
+def _point_fields(pts_df):
+    # Columns of the points output, in the order of sorted_pt_flds
+    flds = [c for c in pts_df.columns if c.lower() in [f.lower() for f in sorted_pt_flds]]
+    return(pts_df.reindex(columns=flds))
+
+def stage_csv(cfg, inputs):
+    """Recode BN values, fill nulls, and save the points CSV in scratch_dir (core.export).
+    Returns the file name and number of rows."""
+    pts_df = inputs['join']
+    trans_df = None
+    columns = None
+    if cfg.get('compact_points'):
+        # transect values are added to each chunk
+        trans_df = store.StoreToDF(os.path.join(cfg['scratch_dir'], 'join_trans'), mmap=False)
+        columns = list(_point_fields(pd.DataFrame(columns=list(pts_df.columns) +
+                       [c for c in trans_df.columns if not c in pts_df.columns and c != cfg['tID_fld']])).columns)
+    csv_fname = os.path.join(cfg['scratch_dir'], cfg['pts_name'] +'.csv')
+    nrows = export.write_csv(pts_df, csv_fname, cfg['fill'], chunksize=cfg['csv_chunksize'],
+                             trans_df=trans_df, columns=columns, tID_fld=cfg['tID_fld'], verbose=False)
+    print("OUTPUT: {} in specified scratch_dir.".format(os.path.basename(csv_fname)))
+    return(pd.DataFrame({'csv': [csv_fname], 'rows': [nrows]}))
+
+Stage = namedtuple('Stage', ['name', 'func', 'deps'])
+STAGES = OrderedDict((s.name, s) for s in [
+    Stage('trans', stage_trans, []),
+    Stage('shoreline', stage_shoreline, []),
+    Stage('dunes', stage_dunes, ['trans']),
+    Stage('dem', stage_dem, []),
+    Stage('armor', stage_armor, ['shoreline', 'dem']),
+    Stage('beachwidth', stage_beachwidth, ['trans', 'shoreline', 'dunes', 'armor']),
+    Stage('dist2inlet', stage_dist2inlet, ['shoreline']),
+    Stage('widths', stage_widths, []),
+    Stage('transects', stage_transects, ['beachwidth', 'dist2inlet', 'widths']),
+    Stage('points', stage_points, ['dem']),
+    Stage('join', stage_join, ['transects', 'points']),
+    Stage('csv', stage_csv, ['join']),
+    ])
+
+"""
+# Scheduling
+"""
+def ancestors(name, stages=STAGES):
+    """Stages that name depends on, directly or indirectly."""
+    out = set()
+    todo = list(stages[name].deps)
+    while todo:
+        dep = todo.pop()
+        if not dep in out:
+            out.add(dep)
+            todo.extend(stages[dep].deps)
+    return(out)
+
+def descendants(name, stages=STAGES):
+    """Stages that depend on name, directly or indirectly."""
+    return(set(s for s in stages if name in ancestors(s, stages)))
+
+def select_stages(start=None, until=None, stages=STAGES):
+    """Names of stages to run, in declared order: --from start (and all that depend on it)
+    through --until until (and all it depends on)."""
+    selected = set(stages)
+    if until is not None:
+        selected &= ancestors(until, stages) | {until}
+    if start is not None:
+        selected &= descendants(start, stages) | {start}
+    return([s for s in stages if s in selected])
+
+def _stage_path(cfg, name):
+    return(os.path.join(cfg['scratch_dir'], name))
+
+def run_stage(cfg, name, stages=STAGES):
+    """Load the inputs of stage name from scratch_dir, run it, and save its output.
+    Returns (name, seconds, rows). Runs in a worker process."""
+    start = time.time()
+    tracing.configure(cfg.get('trace'), site=cfg['site'], year=cfg['year'])
+    with tracing.span('stage:'+name) as sp:
+        inputs = {dep: store.StoreToDF(_stage_path(cfg, dep), mmap=False) for dep in stages[name].deps}
+        sp.rows_in = sum(len(df) for df in inputs.values()) if inputs else None
+        df = stages[name].func(cfg, inputs)
+        store.DFtoStore(df, _stage_path(cfg, name), verbose=False)
+        sp.rows_out = len(df)
+    return(name, time.time() - start, len(df))
+
+def run_pipeline(cfg, start=None, until=None, workers=1, stages=STAGES, verbose=True):
+    """Run the selected stages, each as soon as its dependencies are done, with up to
+    workers stages at a time. Returns a dataframe with the status, seconds, and rows of each stage."""
+    todo = select_stages(start, until, stages)
+    if not os.path.exists(cfg['scratch_dir']):
+        os.makedirs(cfg['scratch_dir'])
+    # Dependencies outside the selection must already be saved
+    for name in todo:
+        for dep in stages[name].deps:
+            if not dep in todo and not os.path.exists(os.path.join(_stage_path(cfg, dep), store.SCHEMA)):
+                raise IOError("Stage '{}' needs output of '{}', which has not been run.".format(name, dep))
+    summary = OrderedDict((name, {'status': 'pending', 'seconds': np.nan, 'rows': np.nan}) for name in todo)
+    done = set(s for s in stages if not s in todo)
+    running = {}
+    start_time = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while todo or running:
+            for name in [s for s in todo if set(stages[s].deps) <= done]:
+                if verbose:
+                    print("Starting stage '{}'...".format(name))
+                running[pool.submit(run_stage, cfg, name, stages)] = name
+                todo.remove(name)
+                summary[name]['status'] = 'running'
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    name, seconds, rows = future.result()
+                    summary[name].update({'status': 'done', 'seconds': seconds, 'rows': rows})
+                    done.add(name)
+                    if verbose:
+                        print("Finished stage '{}' in {:.1f} seconds ({} rows).".format(name, seconds, rows))
+                except Exception as err:
+                    summary[name]['status'] = 'failed: {}'.format(err)
+                    print("Stage '{}' failed: {}".format(name, err))
+            # Stages that depend on a failed stage are skipped
+            failed = set(s for s in summary if summary[s]['status'].startswith('failed'))
+            for name in [s for s in todo if ancestors(s, stages) & failed]:
+                summary[name]['status'] = 'skipped'
+                todo.remove(name)
+    summary = pd.DataFrame.from_dict(summary, orient='index')
+    if verbose:
+        print("\nStage timing summary for {}{} (total {:.1f} seconds):".format(cfg['site'], cfg['year'], time.time() - start_time))
+        print(summary.to_string(float_format='{:.1f}'.format))
+    return(summary)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m core.pipeline', description=__doc__.split('Usage:')[0],
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('site', nargs='?', help='site name in configmap.sitemap')
+    parser.add_argument('year', nargs='?')
+    parser.add_argument('proj_dir', nargs='?', help='project directory containing <site><year>.gdb')
+    parser.add_argument('--from', dest='start', choices=list(STAGES), help='first stage to run')
+    parser.add_argument('--until', choices=list(STAGES), help='last stage to run')
+    parser.add_argument('--workers', type=int, default=1, help='number of stages to run at once (default 1: concurrent '
+                        'stages write to the same file geodatabases and can fail on schema locks)')
+    parser.add_argument('--partition_workers', type=int, default=1, help='processes for each per-transect stage (core.partition)')
+    parser.add_argument('--cache', dest='cache_dir', help='stage cache directory (see core.cache)')
+    parser.add_argument('--trace', help='append stage timing spans to this JSON-lines file (summarize with python -m core.tracing)')
+    parser.add_argument('--compact', action='store_true', help='keep the joined points compact until the CSV export (core.compact)')
+    parser.add_argument('--config', help='JSON file with values to override, e.g. {"maxDH": 3, "armorLines": "..."}')
+    parser.add_argument('--list', action='store_true', help='list stages and dependencies and exit')
+    args = parser.parse_args(argv)
+    if args.list:
+        for s in STAGES.values():
+            print('{:<12} <- {}'.format(s.name, ', '.join(s.deps)))
+        return(0)
+    if not (args.site and args.year and args.proj_dir):
+        parser.error('site, year, and proj_dir are required')
+    if not args.site in sitemap:
+        parser.error("site must be one of: {}".format(', '.join(sitemap.keys())))
+    overrides = {}
+    if args.config:
+        with open(args.config) as f:
+            overrides = json.load(f)
+    if args.cache_dir:
+        overrides['cache_dir'] = args.cache_dir
+    overrides['partition_workers'] = max(args.partition_workers, 1)
+    if args.compact:
+        overrides['compact_points'] = True
+    if args.trace:
+        overrides['trace'] = os.path.abspath(args.trace)
+    cfg = site_config(args.site, args.year, args.proj_dir, overrides)
+    summary = run_pipeline(cfg, args.start, args.until, max(args.workers, 1))
+    return(int(not (summary['status'] == 'done').all()))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Columnar storage for intermediate dataframes in scratch_dir.
+Each dataframe is saved as a folder with one file per column and a
+schema.json sidecar, so that a reader can memory-map only the columns it
+needs instead of unpickling the whole frame. These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+'''
+import os
+import json
+import zlib
+import pickle
+import pandas as pd
+import numpy as np
+
+SCHEMA = 'schema.json'
+INDEX = '__index__'
+
+def _encode(values, fname, compress):
+    """Save one column of values. Returns the schema entry for the column."""
+    entry = {'dtype': str(values.dtype)}
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        entry.update({'kind': 'category', 'categories': values.cat.categories.tolist(),
+                      'ordered': bool(values.cat.ordered)})
+        arr = values.cat.codes.values
+    elif values.dtype == object:
+        nonnull = values[values.notnull()]
+        if all(isinstance(v, str) for v in nonnull):
+            # strings (with nulls) are saved as integer codes and a list of categories
+            cat = pd.Categorical(values)
+            entry.update({'kind': 'strings', 'categories': cat.categories.tolist(),
+                          'null': None if not len(values) or values.notnull().all() else _null_repr(values[values.isnull()].iloc[0])})
+            arr = cat.codes
+        else:
+            entry['kind'] = 'pickle'
+            with open(fname + '.pkl', 'wb') as f:
+                pickle.dump(values.values, f)
+            return(entry)
+    else:
+        entry['kind'] = 'array'
+        arr = values.values
+        if isinstance(arr, pd.api.extensions.ExtensionArray):
+            entry['kind'] = 'pickle'
+            with open(fname + '.pkl', 'wb') as f:
+                pickle.dump(arr, f)
+            return(entry)
+    arr = np.ascontiguousarray(arr)
+    entry['array_dtype'] = arr.dtype.str
+    entry['compress'] = bool(compress)
+    if compress:
+        with open(fname + '.zlib', 'wb') as f:
+            f.write(zlib.compress(arr.tobytes(), 6))
+    else:
+        np.save(fname + '.npy', arr)
+    return(entry)
+
+def _null_repr(v):
+    """Record which null object a string column used (None or NaN)."""
+    return('None' if v is None else 'nan')
+
+def _decode(entry, fname, mmap):
+    """Load one column saved by _encode()."""
+    if entry['kind'] == 'pickle':
+        with open(fname + '.pkl', 'rb') as f:
+            return(pickle.load(f))
+    if entry['compress']:
+        with open(fname + '.zlib', 'rb') as f:
+            arr = np.frombuffer(zlib.decompress(f.read()), dtype=entry['array_dtype'])
+    else:
+        arr = np.load(fname + '.npy', mmap_mode='r' if mmap else None)
+    if entry['kind'] == 'category':
+        return(pd.Categorical.from_codes(np.asarray(arr), entry['categories'], ordered=entry['ordered']))
+    if entry['kind'] == 'strings':
+        null = None if entry.get('null') == 'None' else np.nan
+        cats = np.array(entry['categories'] + [null], dtype=object)
+        codes = np.asarray(arr).astype(np.int64)
+        return(cats[np.where(codes < 0, len(cats) - 1, codes)])
+    return(arr)
+
+def DFtoStore(df, path, compress=False, verbose=True):
+    """Save dataframe as a folder of column files with a schema sidecar.
+    Set compress=True to zlib-compress the columns (they are then decompressed, not memory-mapped, on read)."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    schema = {'nrows': len(df), 'columns': [], 'index': None}
+    for i, col in enumerate(df.columns):
+        entry = _encode(df.iloc[:, i], os.path.join(path, 'c{}'.format(i)), compress)
+        entry['name'] = col
+        schema['columns'].append(entry)
+    if isinstance(df.index, pd.MultiIndex):
+        raise TypeError('DFtoStore does not support a MultiIndex; reset the index first.')
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        entry = _encode(df.index.to_series(), os.path.join(path, INDEX), compress)
+        schema['index'] = entry
+    schema['index_name'] = df.index.name
+    # e.g. the original dtypes of a compact point table (core.compact)
+    schema['attrs'] = df.attrs
+    with open(os.path.join(path, SCHEMA), 'w') as f:
+        json.dump(schema, f, indent=1)
+    if verbose:
+        print("OUTPUT: {} ({} columns, {} rows)".format(os.path.basename(path), len(df.columns), len(df)))
+    return(path)
+
+def read_schema(path):
+    """Read the schema of a stored dataframe."""
+    with open(os.path.join(path, SCHEMA)) as f:
+        return(json.load(f))
+
+def store_columns(path):
+    """List the columns of a stored dataframe."""
+    return([c['name'] for c in read_schema(path)['columns']])
+
+def StoreToDF(path, columns=None, mmap=True):
+    """Load stored dataframe. Only the listed columns are read; uncompressed
+    numeric columns are memory-mapped when mmap is True."""
+    schema = read_schema(path)
+    entries = schema['columns']
+    if columns is not None:
+        names = [c['name'] for c in entries]
+        missing = [c for c in columns if not c in names]
+        if len(missing):
+            raise KeyError("Columns {} are not in {}.".format(missing, os.path.basename(path)))
+        entries = [entries[names.index(c)] for c in columns]
+    allnames = [c['name'] for c in schema['columns']]
+    data = {}
+    for entry in entries:
+        i = allnames.index(entry['name'])
+        data[entry['name']] = _decode(entry, os.path.join(path, 'c{}'.format(i)), mmap)
+    if schema['index'] is not None:
+        index = pd.Index(_decode(schema['index'], os.path.join(path, INDEX), mmap),
+                         dtype=schema['index']['dtype'] if schema['index']['kind'] == 'array' else None)
+    else:
+        index = pd.RangeIndex(schema['nrows'])
+    index.name = schema['index_name']
+    # copy=False keeps the memory-mapped columns as views of the column files
+    df = pd.DataFrame(data, index=index, columns=[e['name'] for e in entries], copy=False)
+    # Restore dtypes of empty or object columns (pandas may infer a string dtype)
+    for entry in entries:
+        if entry['kind'] != 'category' and str(df[entry['name']].dtype) != entry['dtype']:
+            df[entry['name']] = df[entry['name']].astype(entry['dtype'])
+    df.attrs = schema.get('attrs', {})
+    return(df)
+
+def PickleToStore(pkl, path=None, compress=False, verbose=True):
+    """Convert a pickled dataframe (e.g. from scratch_dir) to a store. By default the store has the name of the pickle without .pkl."""
+    if path is None:
+        path = os.path.splitext(pkl)[0]
+    df = pd.read_pickle(pkl)
+    return(DFtoStore(df, path, compress, verbose))
+
+def ImportScratchPickles(scratch_dir, out_dir=None, compress=False, verbose=True):
+    """Convert every .pkl in scratch_dir to a store in out_dir (default: scratch_dir) and check that it loads back unchanged."""
+    if out_dir is None:
+        out_dir = scratch_dir
+    converted = []
+    for fname in sorted(os.listdir(scratch_dir)):
+        if not fname.endswith('.pkl'):
+            continue
+        pkl = os.path.join(scratch_dir, fname)
+        path = PickleToStore(pkl, os.path.join(out_dir, fname[:-4]), compress, verbose)
+        df = pd.read_pickle(pkl)
+        check = StoreToDF(path, mmap=False)
+        if not (check.equals(df) and (check.dtypes == df.dtypes).all() and check.index.equals(df.index)):
+            raise ValueError("{} did not load back unchanged from {}.".format(fname, path))
+        converted.append(path)
+    return(converted)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Barrier Island Geomorphology Extraction along transects (BI-geomorph-extraction module)
+Author: Emily Sturdivant
+email: esturdivant@usgs.gov;
+
+Structured timing of processing stages.
+Functions emit spans (stage name, wall and CPU time, rows in and out, change in
+peak RSS, site and year) with the span() context manager or the traced()
+decorator. Spans are appended to a JSON-lines trace file set with configure();
+when no trace file is set, nothing is recorded or printed.
+These functions do not use arcpy.
+Designed to be imported by either prepper.ipynb or extractor.py.
+
+Summarize a trace after a run:
+    python -m core.tracing path\to\trace.jsonl
+'''
+import os
+import sys
+import json
+import time
+import socket
+import threading
+import functools
+import pandas as pd
+
+_config = {'path': None, 'tags': {}}
+_local = threading.local()
+
+def configure(path=None, **tags):
+    """Write spans to path (JSON lines; None to stop tracing). Keyword arguments
+    (e.g. site='Fisherman', year='2014') are added to every span."""
+    _config['path'] = path
+    _config['tags'] = tags
+    if path and os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+def enabled():
+    return(_config['path'] is not None)
+
+def peak_rss():
+    """Peak resident set size of this process in bytes (None if unavailable)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return(peak if sys.platform == 'darwin' else peak * 1024)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        mem = psutil.Process().memory_info()
+        return(getattr(mem, 'peak_wset', mem.rss))
+    except ImportError:
+        return(None)
+
+def _nrows(obj):
+    # Rows of a dataframe/array (or of the first item of a tuple of results)
+    if isinstance(obj, tuple) and len(obj):
+        obj = obj[0]
+    if isinstance(obj, (pd.DataFrame, pd.Series)) or hasattr(obj, 'shape'):
+        return(len(obj))
+    return(None)
+
+class Span(object):
+    """Timing record of one stage. Set rows_out (and rows_in) while the span is open."""
+    def __init__(self, stage, rows_in=None, **tags):
+        self.stage = stage
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.tags = tags
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', [])
+        _local.stack = stack
+        self.parent = stack[-1].stage if stack else None
+        self.depth = len(stack)
+        stack.append(self)
+        self._rss0 = peak_rss()
+        self._cpu0 = time.process_time()
+        self._wall0 = time.perf_counter()
+        self.start = time.time()
+        return(self)
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._wall0
+        cpu = time.process_time() - self._cpu0
+        rss1 = peak_rss()
+        _local.stack.pop()
+        if not enabled():
+            return(False)
+        record = dict(_config['tags'])
+        record.update(self.tags)
+        record.update({'stage': self.stage, 'parent': self.parent, 'depth': self.depth,
+                       'start': self.start, 'wall_s': wall, 'cpu_s': cpu,
+                       'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                       'peak_rss_delta': None if rss1 is None else rss1 - self._rss0,
+                       'pid': os.getpid(), 'host': socket.gethostname(),
+                       'status': 'ok' if exc_type is None else 'error: {}'.format(exc_type.__name__)})
+        line = json.dumps(record, default=str) + '\n'
+        # One write per span so that processes can share the trace file
+        with open(_config['path'], 'a') as f:
+            f.write(line)
+        return(False)
+
+def span(stage, rows_in=None, **tags):
+    """Context manager that records a span, e.g.
+    with tracing.span('sort_pts', rows_in=len(df)) as sp:
+        ...
+        sp.rows_out = len(df)"""
+    return(Span(stage, rows_in, **tags))
+
+def traced(stage=None):
+    """Decorator that records a span for each call. Rows in and out are the lengths
+    of the first dataframe argument and of the returned dataframe (if any)."""
+    def decorate(func):
+        name = stage or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return(func(*args, **kwargs))
+            rows_in = next((n for n in (_nrows(a) for a in args) if n is not None), None)
+            with Span(name, rows_in) as sp:
+                result = func(*args, **kwargs)
+                sp.rows_out = _nrows(result)
+            return(result)
+        return(wrapper)
+    return(decorate)
+
+"""
+# Reading traces
+"""
+def read_trace(path):
+    """Read a JSON-lines trace file to a dataframe with one row per span."""
+    with open(path) as f:
+        return(pd.DataFrame([json.loads(line) for line in f if line.strip()]))
+
+def summarize(path_or_df, by=('site', 'year', 'stage')):
+    """Total wall and CPU time, calls, rows, and largest peak RSS increase per stage,
+    sorted by wall time. Only columns in by that are in the trace are used."""
+    df = read_trace(path_or_df) if isinstance(path_or_df, str) else path_or_df
+    if not len(df):
+        return(df)
+    by = [c for c in by if c in df.columns]
+    summary = df.groupby(by, dropna=False).agg(calls=('wall_s', 'size'), wall_s=('wall_s', 'sum'),
+                                               cpu_s=('cpu_s', 'sum'), rows_in=('rows_in', 'sum'),
+                                               rows_out=('rows_out', 'sum'),
+                                               peak_rss_delta_MB=('peak_rss_delta', 'max'))
+    summary['peak_rss_delta_MB'] = summary['peak_rss_delta_MB'] / 1e6
+    return(summary.sort_values('wall_s', ascending=False))
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit('Usage: python -m core.tracing trace.jsonl')
+    with pd.option_context('display.width', 200, 'display.max_rows', 500):
+        print(summarize(sys.argv[1]).to_string(float_format='{:.2f}'.format))
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.cache: results are reused for the same inputs and recomputed when
+an input or a listed parameter changes.
+'''
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import core.cache as cache
+
+CALLS = []
+
+def _stage(df, tID_fld='sort_ID', proximity=25, verbose=True):
+    CALLS.append(1)
+    return(df.assign(dist=df['x'] * proximity))
+
+def _sample_df():
+    return(pd.DataFrame({'x': np.arange(5.0), 'sort_ID': np.arange(1, 6)}))
+
+def test_cache_hit(tmp_path):
+    sc = cache.StageCache(str(tmp_path), verbose=False)
+    df = _sample_df()
+    del CALLS[:]
+    first = sc.run('shoreline', _stage, df, proximity=25)
+    second = sc.run('shoreline', _stage, df, proximity=25, verbose=False)
+    assert len(CALLS) == 1
+    pd.testing.assert_frame_equal(second, first)
+
+def test_cache_key(tmp_path):
+    sc = cache.StageCache(str(tmp_path), verbose=False)
+    df = _sample_df()
+    key = sc.key('shoreline', _stage, (df,), {'proximity': 25})
+    # Keyword arguments not in STAGE_PARAMS do not change the key
+    assert sc.key('shoreline', _stage, (df,), {'proximity': 25, 'verbose': False}) == key
+    assert sc.key('shoreline', _stage, (df,), {'proximity': 10}) != key
+    df.loc[2, 'x'] = 99.0
+    assert sc.key('shoreline', _stage, (df,), {'proximity': 25}) != key
+
+def test_fingerprint_paths(tmp_path):
+    fname = tmp_path / 'a.txt'
+    fname.write_text('abc')
+    digest = cache.fingerprint(str(fname))
+    fname.write_text('abd')
+    assert cache.fingerprint(str(fname)) != digest
+    # A dataset in a geodatabase needs a fingerprinter
+    gdb = tmp_path / 'site.gdb'
+    gdb.mkdir()
+    with pytest.raises(ValueError):
+        cache.fingerprint(os.path.join(str(gdb), 'extTrans'))
+    assert cache.fingerprint(os.path.join(str(gdb), 'extTrans'), lambda fc: 'rows') != \
+        cache.fingerprint(os.path.join(str(gdb), 'extTrans'), lambda fc: 'other rows')
+
+def test_evict(tmp_path):
+    sc = cache.StageCache(str(tmp_path), max_bytes=0, verbose=False)
+    sc.put('a', _sample_df())
+    sc.put('b', _sample_df())
+    # The newest result is kept even over budget
+    assert [e[0] for e in sc.entries()] == ['b']
+    sc.clear()
+    assert sc.entries() == []
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.columns on the sample_scratch points: fill values are read as NaN
+and written back unchanged.
+'''
+import os
+import numpy as np
+import pandas as pd
+from core.columns import Columns, fill_missing
+
+scratch_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_scratch')
+
+def _sample_pts():
+    return(pd.read_pickle(os.path.join(scratch_dir, 'pts_df_elev_slope.pkl')))
+
+def test_fill_roundtrip():
+    pts = _sample_pts()
+    pts_fill = pts.fillna(-99999)
+    cols = Columns(pts_fill, -99999)
+    assert cols.fill_cols == {'ptZ', 'ptSlp'}
+    pd.testing.assert_frame_equal(cols.frame, pts)
+    assert cols.missing_count('ptZ') == pts['ptZ'].isnull().sum()
+    assert np.array_equal(cols.valid('ptSlp'), pts['ptSlp'].notnull().values)
+    pd.testing.assert_frame_equal(cols.restore(), pts_fill)
+    # The input is not modified
+    assert not pts_fill.isnull().values.any()
+
+def test_nan_input():
+    pts = _sample_pts()
+    cols = Columns(pts, -99999)
+    assert cols.fill_cols == set() and cols.null_cols == {'ptZ', 'ptSlp'}
+    assert cols.restore() is cols.frame
+    pd.testing.assert_frame_equal(cols.to_fill(), pts.fillna(-99999))
+
+def test_update_scans_new_columns():
+    pts = _sample_pts().fillna(-99999)
+    cols = Columns(pts, -99999)
+    df = cols.frame
+    df['ptZmhw'] = df['ptZ'] - 0.34
+    cols.update(df)
+    assert cols.missing_count('ptZmhw') == cols.missing_count('ptZ')
+    assert (cols.restore()['ptZmhw'] == -99999).sum() == (pts['ptZ'] == -99999).sum()
+
+def test_fill_missing():
+    pts = _sample_pts()
+    pts['ub_feat'] = np.where(np.arange(len(pts)) % 3, 'DL', None)
+    expected = pts.astype({'ub_feat': object}).fillna(-99999)
+    out = fill_missing(pts)
+    pd.testing.assert_frame_equal(out, expected, check_dtype=False)
+    assert out['ptZ'].dtype == pts['ptZ'].dtype
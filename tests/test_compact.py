@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.compact on the sample_scratch points and transects: a compact point
+table expands back to the full table.
+'''
+import os
+import numpy as np
+import pandas as pd
+import core.compact as compact
+
+scratch_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_scratch')
+
+def _sample_tables():
+    pts = pd.read_pickle(os.path.join(scratch_dir, 'pts_df_elev_slope.pkl'))
+    trans = pd.read_pickle(os.path.join(scratch_dir, 'trans_df_beachmetrics.pkl'))
+    trans = trans[['SL_x', 'SL_y', 'DH_z', 'DL_z']].reset_index()
+    pts['ub_feat'] = np.where(pts['sort_ID'] % 2, 'DL', 'DH')
+    return(pts, trans)
+
+def test_compact_roundtrip():
+    pts, trans = _sample_tables()
+    small = compact.compact_points(pts)
+    assert compact.memory_MB(small) < compact.memory_MB(pts)
+    assert small['sort_ID'].dtype.kind == 'i' and small['SHAPE@X'].dtype == np.float32
+    out = compact.expand_points(small)
+    assert list(out.columns) == list(pts.columns)
+    assert (out.dtypes.drop('ub_feat') == pts.dtypes.drop('ub_feat')).all()
+    num = pts.columns.drop('ub_feat')
+    assert np.allclose(out[num], pts[num], atol=0.001, equal_nan=True)
+    assert (out['ub_feat'].astype(str) == pts['ub_feat']).all()
+
+def test_expand_with_transects():
+    pts, trans = _sample_tables()
+    full = pts.merge(trans, on='sort_ID', how='left')
+    small = compact.compact_points(full, trans)
+    assert not 'SL_x' in small.columns
+    out = compact.expand_points(small, trans)
+    assert list(out.columns) == list(full.columns)
+    num = full.columns.drop('ub_feat')
+    assert np.allclose(out[num].astype('f8'), full[num].astype('f8'), atol=0.001, equal_nan=True)
+
+def test_transect_values_missing():
+    pts = pd.DataFrame({'sort_ID': [1, 5, 2]})
+    trans = pd.DataFrame({'SL_x': [10.0, 20.0], 'ub_feat': ['DL', 'DH']}, index=pd.Index([1, 2], name='sort_ID'))
+    out = compact.transect_values(pts, trans)
+    assert np.allclose(out['SL_x'], [10, np.nan, 20], equal_nan=True)
+    assert out['ub_feat'].tolist()[::2] == ['DL', 'DH'] and pd.isnull(out['ub_feat'].iloc[1])
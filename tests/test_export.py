@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.export on the sample_scratch points: the chunked CSV is the same as
+df.replace(RECODES).fillna(fill).to_csv(index=False).
+'''
+import os
+import numpy as np
+import pandas as pd
+import core.compact as compact
+import core.export as export
+
+scratch_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_scratch')
+
+def _sample_pts():
+    pts = pd.read_pickle(os.path.join(scratch_dir, 'pts_df_elev_slope.pkl'))
+    # BN classes with codes of sets and some nulls
+    pts['SubType'] = np.tile([1111.0, 7777.0, 2222.0, np.nan, 1000.0], len(pts) // 5 + 1)[:len(pts)]
+    pts['ub_feat'] = np.where(pts['sort_ID'] % 3, 'DL', None)
+    return(pts)
+
+def _read(fname):
+    with open(fname) as f:
+        return(f.read())
+
+def test_write_csv(tmp_path):
+    pts = _sample_pts()
+    fname = str(tmp_path / 'pts.csv')
+    nrows = export.write_csv(pts, fname, chunksize=5000, verbose=False)
+    assert nrows == len(pts)
+    expected = str(tmp_path / 'expected.csv')
+    pts.replace(export.RECODES).fillna(-99999).to_csv(expected, index=False)
+    assert _read(fname) == _read(expected)
+
+def test_write_csv_compact(tmp_path):
+    pts = _sample_pts()
+    trans = pd.read_pickle(os.path.join(scratch_dir, 'trans_df_beachmetrics.pkl'))[['SL_x', 'DH_z']].reset_index()
+    full = pts.merge(trans, on='sort_ID', how='left')
+    fname = str(tmp_path / 'pts.csv')
+    small = compact.compact_points(full, trans)
+    export.write_csv(small, fname, chunksize=5000, trans_df=trans, columns=list(full.columns), verbose=False)
+    out = pd.read_csv(fname)
+    expected = full.replace(export.RECODES).fillna(-99999)
+    assert list(out.columns) == list(full.columns)
+    num = ['SHAPE@X', 'SHAPE@Y', 'ptSlp', 'ptZ', 'sort_ID', 'SL_x', 'DH_z']
+    assert np.allclose(out[num], expected[num].astype('f8'), atol=0.001)
+    assert (out['SubType'].astype(str) == expected['SubType'].astype(str)).all()
+
+def test_recode():
+    lookup = export.recode_lookup(export.RECODES['VegType'])
+    values = np.array([11.0, 77.0, np.nan, 99.0])
+    out = export.recode(values, lookup)
+    assert out.tolist()[:2] == [11.0, '{11, 22}'] and out[3] == '{33, 44}'
+    # Unchanged values are returned as is
+    first = values[:1]
+    assert export.recode(first, lookup) is first
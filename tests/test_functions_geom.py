@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.functions_geom on small synthetic geometry: four parallel transects
+running from the ocean (y=0) to the bay (y=100) at x = 0, 10, 20, 30 and a
+shoreline along y=20.
+'''
+import numpy as np
+import pandas as pd
+import core.functions_geom as fgeom
+
+def _transects(n=4, spacing=10.0, length=100.0):
+    return(fgeom.lines_from_list(np.arange(1, n+1), [[(i*spacing, 0), (i*spacing, length)] for i in range(n)]))
+
+def _hline(fid, y, x0=-5.0, x1=45.0):
+    return(fgeom.lines_from_list([fid], [[(x0, y), (x1, y)]]))
+
+def _rect(x0, y0, x1, y1):
+    return([(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)])
+
+def test_line_crossings():
+    xing = fgeom.line_crossings(_transects(), _hline(1, 20))
+    assert list(xing['line']) == [0, 1, 2, 3]
+    assert (xing['other'] == 0).all()
+    assert np.allclose(xing['x'], [0, 10, 20, 30]) and np.allclose(xing['y'], 20)
+    assert np.allclose(xing['along'], 20)
+    assert np.allclose(xing['along_other'], [5, 15, 25, 35])
+
+def test_line_crossings_none():
+    xing = fgeom.line_crossings(_transects(), _hline(1, 200))
+    assert len(xing) == 0
+    assert list(xing.columns) == ['line', 'other', 'x', 'y', 'along', 'along_other']
+
+def test_dunes2trans():
+    dh_xy, dh_z = [(1, 50), (12, 60)], [3.0, 4.0]
+    dl_xy, dl_z = [(0.5, 40)], [2.0]
+    df = fgeom.dunes2trans(_transects(), dh_xy, dh_z, dl_xy, dl_z, proximity=5)
+    assert list(df.index) == [1, 2] and df.index.name == 'sort_ID'
+    assert np.allclose(df.loc[1, ['DH_x', 'DH_y', 'DH_z', 'DH_snapX', 'DH_snapY']], [1, 50, 3, 0, 50])
+    assert np.allclose(df.loc[2, ['DH_x', 'DH_y', 'DH_z', 'DH_snapX', 'DH_snapY']], [12, 60, 4, 10, 60])
+    assert np.allclose(df.loc[1, ['DL_x', 'DL_y', 'DL_z']], [0.5, 40, 2])
+    assert df.loc[2, ['DL_x', 'DL_y', 'DL_z']].isnull().all()
+
+def test_shore2trans():
+    df = fgeom.shore2trans(_transects(), _hline(1, 20), [(0, 21), (10, 19)], [0.1, 0.2], proximity=5)
+    assert list(df.index) == [1, 2, 3, 4]
+    assert np.allclose(df['SL_x'], [0, 10, 20, 30]) and np.allclose(df['SL_y'], 20)
+    assert np.allclose(df['Bslope'], [0.1, 0.2, np.nan, np.nan], equal_nan=True)
+
+def test_shore2trans_last_feature():
+    # A transect that crosses two shoreline features gets the crossing of the last one
+    shoreline = fgeom.lines_from_list([1, 2], [[(-5, 20), (45, 20)], [(-5, 30), (45, 30)]])
+    df = fgeom.shore2trans(_transects(), shoreline, np.zeros((0, 2)), [])
+    assert np.allclose(df['SL_y'], 30)
+    assert df['Bslope'].isnull().all()
+
+def test_armor2trans():
+    armor = fgeom.lines_from_list([1, 2], [[(-5, 30), (15, 30)], [(-5, 40), (15, 40)]])
+    sl_df = pd.DataFrame({'SL_x': [0.0, 10.0], 'SL_y': [20.0, 20.0]}, index=pd.Index([1, 2], name='sort_ID'))
+    df = fgeom.armor2trans(_transects(), armor, sl_df)
+    assert list(df.index) == [1, 2]
+    assert np.allclose(df['Arm_x'], [0, 10]) and np.allclose(df['Arm_y'], 30)
+    # The crossing closest to the shoreline is used
+    sl_df['SL_y'] = 100.0
+    assert np.allclose(fgeom.armor2trans(_transects(), armor, sl_df)['Arm_y'], 40)
+    # Without a shoreline position, the crossing nearest the start of the transect
+    sl_df[['SL_x', 'SL_y']] = -99999
+    assert np.allclose(fgeom.armor2trans(_transects(), armor, sl_df)['Arm_y'], 30)
+
+def test_armor2trans_none():
+    df = fgeom.armor2trans(_transects(), _hline(1, 30, 100, 200), pd.DataFrame(columns=['SL_x', 'SL_y']))
+    assert len(df) == 0 and list(df.columns) == ['Arm_x', 'Arm_y']
+
+def test_beach_width():
+    MHW, fill = 0.5, -99999
+    trans = _transects()
+    nan = np.nan
+    trans_df = pd.DataFrame({'SL_x': [0, 10, 20, fill], 'SL_y': [20, 20, 20, fill],
+                             'DL_x': [1, nan, nan, nan], 'DL_y': [50, nan, nan, nan], 'DL_z': [MHW+1, nan, nan, nan],
+                             'DH_x': [nan, 10, 21, nan], 'DH_y': [nan, 60, 70, nan], 'DH_z': [nan, MHW+2, MHW+3, nan],
+                             'Arm_x': [nan, nan, 20, nan], 'Arm_y': [nan, nan, 30, nan], 'Arm_z': [nan, nan, MHW+1, nan]},
+                            index=pd.Index(trans.ids, name='sort_ID'))
+    df = fgeom.beach_width(trans_df, fgeom.line_ends(trans), maxDH=2.5, MHW=MHW)
+    assert np.allclose(df['uBW'], [30, 40, 10, nan], equal_nan=True)
+    assert np.allclose(df['uBH'], [1, 2, 1, nan], equal_nan=True)
+    assert list(df['ub_feat'][:3]) == ['DL', 'DH', 'Arm'] and pd.isnull(df['ub_feat'].iloc[3])
+    assert np.allclose(df['DistDH'], [nan, 40, 50, nan], equal_nan=True)
+
+def test_dist2inlet():
+    inlets = fgeom.lines_from_list([1, 2], [[(-5, 0), (-5, 40)], [(45, 0), (45, 40)]])
+    df = fgeom.dist2inlet(_transects(), _hline(1, 20), inlets, verbose=False)
+    assert list(df.index) == [1, 2, 3, 4]
+    assert np.allclose(df['Dist2Inlet'], [5, 15, 25, 15])
+
+def test_dist2inlet_no_inlet():
+    df = fgeom.dist2inlet(_transects(), _hline(1, 20), _hline(1, 200), verbose=False)
+    assert df['Dist2Inlet'].isnull().all()
+
+def test_island_widths():
+    rings = fgeom.lines_from_list([1], [_rect(-5, 10, 45, 90)])
+    df = fgeom.island_widths(_transects(), rings)
+    assert np.allclose(df[['WidthFull', 'WidthLand', 'WidthPart']], 80)
+    # Two islands along the transects
+    rings = fgeom.lines_from_list([1, 2], [_rect(-5, 10, 45, 40), _rect(-5, 60, 25, 90)])
+    df = fgeom.island_widths(_transects(), rings)
+    assert np.allclose(df['WidthFull'], [80, 80, 80, 30])
+    assert np.allclose(df['WidthLand'], [60, 60, 60, 30])
+    assert np.allclose(df['WidthPart'], 30)
+
+def test_lines_near_polygons():
+    rings = fgeom.lines_from_list([1], [_rect(8, 40, 12, 60)])
+    near = fgeom.lines_near_polygons(_transects(), rings, distance=5)
+    assert list(near) == [False, True, False, False]
+    # A line inside the polygon does not come near an edge
+    inside = fgeom.lines_from_list([1], [[(9, 45), (11, 55)]])
+    assert list(fgeom.lines_near_polygons(inside, rings, distance=0.1)) == [True]
+
+def test_densify_lines():
+    lines = fgeom.lines_from_list([1, 2, 2], [[(0, 0), (0, 12)], [(10, 0), (10, 4)], [(20, 0), (20, 4)]])
+    df = fgeom.densify_lines(lines, step=5)
+    assert list(df['sort_ID']) == [1, 1, 1, 2, 2]
+    assert np.allclose(df['seg_y'], [0, 5, 10, 0, 1])
+    # The second part of feature 2 starts after the 4 m of the first
+    assert np.allclose(df['seg_x'], [0, 0, 0, 10, 20])
+    chunks = pd.concat(fgeom.iter_densify_lines(lines, step=5, chunksize=2), ignore_index=True)
+    assert chunks.equals(df)
+
+def test_extend_lines():
+    lines = fgeom.extend_lines(_transects(2), 10, end='both')
+    assert np.allclose(lines.xy[:, 1], [-10, 110, -10, 110])
+    lines = fgeom.extend_lines(_transects(2), pd.Series([-50], index=[2]), end='end')
+    assert np.allclose(lines.xy[:, 1], [0, 100, 0, 50])
+
+def test_duplicate_lines():
+    others = fgeom.lines_from_list([7, 8], [[(0, 100.0004), (0, 0)], [(5, 0), (5, 100)]])
+    df = fgeom.duplicate_lines(_transects(), others)
+    assert df.values.tolist() == [[1, 7]]
+
+def test_chainage_order():
+    ref = fgeom.lines_from_list([1], [[(45, 20), (-5, 20)]])
+    df = fgeom.chainage_order(_transects(), ref)
+    assert list(df.index) == [4, 3, 2, 1]
+    assert list(df['sort_ID']) == [1, 2, 3, 4]
+    assert np.allclose(df['chainage'], [15, 25, 35, 45])
+    df = fgeom.chainage_order(_transects(), ref, reverse=True, start=10)
+    assert list(df.index) == [1, 2, 3, 4] and list(df['sort_ID']) == [10, 11, 12, 13]
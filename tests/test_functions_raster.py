@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.functions_raster on small synthetic grids with tiles smaller than
+the grid, so that windows and halos cross tile edges.
+'''
+import os
+import numpy as np
+import pandas as pd
+import core.functions_raster as frst
+
+def _dem(nrows=12, ncols=10, seed=0):
+    arr = np.random.default_rng(seed).uniform(-1, 3, (nrows, ncols)).astype('f4')
+    arr[0, :3] = np.nan
+    return(arr)
+
+def test_write_read_grid(tmp_path):
+    arr = _dem()
+    path = frst.write_grid(str(tmp_path / 'elev'), arr, 100.0, 500.0, 1.0, tile=4)
+    assert frst.is_grid(path)
+    assert np.array_equal(frst.read_grid(path), arr, equal_nan=True)
+    # Only the finished grid is left
+    assert os.listdir(str(tmp_path)) == ['elev']
+
+def test_aggregate_grid(tmp_path):
+    arr = _dem()
+    elev = frst.write_grid(str(tmp_path / 'elev'), arr, 100.0, 500.0, 1.0, tile=4)
+    out = frst.aggregate_grid(elev, str(tmp_path / 'elev_2m'), factor=2)
+    meta = frst.read_grid_meta(out)
+    assert meta['cellsize'] == 2.0 and (meta['nrows'], meta['ncols']) == (6, 5)
+    with np.errstate(invalid='ignore'):
+        expected = np.nanmean(arr.astype('f8').reshape(6, 2, 5, 2), axis=(1, 3))
+    assert np.allclose(frst.read_grid(out), expected, equal_nan=True)
+    assert sorted(os.listdir(str(tmp_path))) == ['elev', 'elev_2m']
+
+def test_slope_grid(tmp_path):
+    # Plane rising 0.5 m per m to the east: 50 percent rise
+    x = np.arange(10, dtype='f4')
+    elev = frst.write_grid(str(tmp_path / 'elev'), np.tile(0.5 * x, (12, 1)), 0.0, 12.0, 1.0, tile=4)
+    out = frst.slope_grid(elev, str(tmp_path / 'slope'))
+    slope = frst.read_grid(out)
+    assert np.allclose(slope[1:-1, 1:-1], 50)
+    assert np.array_equal(frst.read_grid(frst.slope_grid(elev, str(tmp_path / 'slope'), workers=2)), slope)
+
+def test_sample_grids(tmp_path):
+    arr = _dem()
+    elev = frst.write_grid(str(tmp_path / 'elev'), arr, 100.0, 500.0, 1.0, tile=4)
+    rows, cols = np.array([0, 5, 11, 3]), np.array([0, 9, 4, 7])
+    x, y = 100.0 + cols + 0.5, 500.0 - rows - 0.5
+    df = frst.sample_grids({'ptZ': elev}, np.r_[x, 50.0], np.r_[y, 50.0])
+    assert np.array_equal(df['ptZ'].values, np.r_[arr[rows, cols], np.nan], equal_nan=True)
+    # At cell centers, bilinear gives the cell values
+    df = frst.sample_grids({'ptZ': (elev, 'bilinear')}, x[1:], y[1:])
+    assert np.allclose(df['ptZ'], arr[rows[1:], cols[1:]])
+
+def test_extract_values_to_pts(tmp_path):
+    arr = _dem()
+    elev = frst.write_grid(str(tmp_path / 'elev'), arr, 100.0, 500.0, 1.0, tile=4)
+    pts = pd.DataFrame({'sort_ID': [1, 2], 'seg_x': [104.5, 101.5], 'seg_y': [498.5, 490.5]}, index=[10, 20])
+    out = frst.extract_values_to_pts(pts, {'ptZ': elev})
+    assert list(out.index) == [10, 20]
+    assert np.allclose(out['ptZ'], [arr[1, 4], arr[9, 1]])
+
+def test_contour_polygons():
+    # Land (2 m) in a 4 x 6 cell block with a 1 x 1 cell pond (0 m), surrounded by water
+    arr = np.zeros((10, 12))
+    arr[3:7, 3:9] = 2.0
+    arr[4, 5] = 0.0
+    polys = frst.contour_polygons(arr, 0.0, 10.0, 1.0, [1.0], min_area=0, min_hole_sz=0)
+    rings = polys[1.0]
+    assert len(pd.unique(rings.ids)) == 1 and len(rings.ids) == 2
+    xmin, ymin, xmax, ymax = [v[0] for v in frst.fgeom.line_boxes(rings)]
+    assert np.allclose([xmin, xmax, ymin, ymax], [3.0, 9.0, 3.0, 7.0])
+    # Holes smaller than min_hole_sz are filled
+    rings = frst.contour_polygons(arr, 0.0, 10.0, 1.0, [1.0], min_area=0, min_hole_sz=10)[1.0]
+    assert len(rings.ids) == 1
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.partition: results of run_partitioned are the same as one call on
+all transects, run serially or in a process pool.
+'''
+import numpy as np
+import pandas as pd
+import core.functions_geom as fgeom
+import core.partition as part
+
+def _transects(n=40, spacing=10.0):
+    return(fgeom.lines_from_list(np.arange(1, n+1), [[(i*spacing, 0), (i*spacing, 100)] for i in range(n)]))
+
+def _dune_pts(seed, n=60):
+    rng = np.random.default_rng(seed)
+    return(np.column_stack([rng.uniform(-5, 400, n), rng.uniform(30, 70, n)]), rng.uniform(1, 5, n))
+
+def test_transect_ranges():
+    ids = np.array([1, 1, 2, 3, 3, 3, 4, 5])
+    ranges = part.transect_ranges(ids, 3)
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(ids)
+    # Parts of a multipart transect stay in one range
+    assert all(ids[a] != ids[a-1] for a, b in ranges[1:])
+    assert part.transect_ranges([], 3) == []
+
+def test_run_partitioned_dunes():
+    trans = _transects()
+    dh_xy, dh_z = _dune_pts(0)
+    dl_xy, dl_z = _dune_pts(1)
+    kwargs = {'tID_fld': 'sort_ID', 'proximity': 25}
+    expected = fgeom.dunes2trans(trans, dh_xy, dh_z, dl_xy, dl_z, **kwargs)
+    args = [part.make_points(dh_xy, dh_z), part.make_points(dl_xy, dl_z)]
+    for workers in (1, 2):
+        df = part.run_partitioned(fgeom.dunes2trans, trans, args, kwargs, halo=25, nparts=4, workers=workers)
+        pd.testing.assert_frame_equal(df, expected)
+
+def test_run_partitioned_frame():
+    # A dataframe of transect values is split by its index
+    trans_df = pd.DataFrame({'SL_x': np.arange(10.0)}, index=pd.Index(np.arange(1, 11), name='sort_ID'))
+    sl_df = pd.DataFrame({'SL_y': np.arange(10.0) * 2}, index=trans_df.index)
+    df = part.run_partitioned(lambda t, s: t.join(s), trans_df, [sl_df], nparts=3, workers=1)
+    pd.testing.assert_frame_equal(df, trans_df.join(sl_df))
+
+def test_merge_frames_empty():
+    assert part.merge_frames([None]).empty
+    empty = pd.DataFrame({'a': np.zeros(0)}, index=pd.Index([], name='sort_ID'))
+    df = part.merge_frames([empty, empty])
+    assert list(df.columns) == ['a'] and len(df) == 0
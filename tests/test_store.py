@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#! python3
+'''
+Tests of core.store: stored dataframes load back unchanged, and memory-mapped
+columns are views of the column files rather than copies.
+'''
+import os
+import numpy as np
+import pandas as pd
+import core.store as store
+
+def _memmap_file(arr):
+    # Follow the chain of array bases to the memmap, if any
+    while arr is not None:
+        if isinstance(arr, np.memmap):
+            return(arr.filename)
+        arr = getattr(arr, 'base', None)
+    return(None)
+
+def _sample_df():
+    return(pd.DataFrame({'ptZ': np.linspace(0, 5, 100), 'sort_ID': np.arange(100, dtype=np.int32),
+                         'ub_feat': ['DL', 'DH'] * 50},
+                        index=pd.Index(np.arange(100) + 10, name='SplitSort')))
+
+def test_roundtrip(tmp_path):
+    df = _sample_df()
+    path = store.DFtoStore(df, str(tmp_path / 'pts'), verbose=False)
+    for mmap in (True, False):
+        out = store.StoreToDF(path, mmap=mmap)
+        assert out.equals(df)
+        assert (out.dtypes == df.dtypes).all()
+        assert out.index.equals(df.index) and out.index.name == df.index.name
+
+def test_mmap_columns_share_memory(tmp_path):
+    path = store.DFtoStore(_sample_df(), str(tmp_path / 'pts'), verbose=False)
+    out = store.StoreToDF(path, columns=['ptZ', 'sort_ID'], mmap=True)
+    for i, col in enumerate(['ptZ', 'sort_ID']):
+        fname = _memmap_file(out[col].values)
+        assert fname is not None, '{} was copied into memory'.format(col)
+        assert os.path.samefile(fname, os.path.join(path, 'c{}.npy'.format(i)))
+
+def test_no_mmap_is_in_memory(tmp_path):
+    path = store.DFtoStore(_sample_df(), str(tmp_path / 'pts'), verbose=False)
+    out = store.StoreToDF(path, columns=['ptZ'], mmap=False)
+    assert _memmap_file(out['ptZ'].values) is None
+
+def test_sample_scratch_roundtrip(tmp_path):
+    scratch_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_scratch')
+    for name in ['pts_df_elev_slope', 'trans_df_beachmetrics']:
+        df = pd.read_pickle(os.path.join(scratch_dir, name + '.pkl'))
+        out = store.StoreToDF(store.DFtoStore(df, str(tmp_path / name), verbose=False))
+        pd.testing.assert_frame_equal(out, df, check_column_type=False)